@@ -1,5 +1,5 @@
 # -*- coding: utf-8 -*-
-from typing import Union, Tuple, List, Callable
+from typing import Dict, Union, Tuple, List, Callable, Iterable, Iterator
 
 from utils import logger
 import utils
@@ -7,6 +7,7 @@ import logging
 import math
 from time import time
 from abc import ABC, abstractmethod
+from array import array
 import sys
 
 
@@ -128,24 +129,314 @@ class History:
 
 class Cell:
     """
-    This class holds information about a single cell
+    This class holds information about a single cell.
+    If the cell is part of a `CellBank`, it's a view on the arrays of the bank.
 
     :param voltage: float = the voltage of the cell in Volts
     :param balance: bool = the balance status of the cell
     """
 
-    voltage: float = None
+    __slots__ = ("_bank", "_index", "_voltage", "_balance", "_temp")
+
+    def __init__(self, balance: bool = None):
+        self._bank: Union[CellBank, None] = None
+        self._index: int = None
+        self._voltage: float = None
+        self._balance: bool = balance
+        self._temp: float = None
+
+    @property
+    def voltage(self) -> Union[float, None]:
+        """
+        The voltage of a specific cell in Volts
+        """
+        if self._bank is None:
+            return self._voltage
+        voltage = self._bank.voltages[self._index]
+        return None if voltage != voltage else voltage
+
+    @voltage.setter
+    def voltage(self, value: Union[float, None]) -> None:
+        if self._bank is None:
+            self._voltage = value
+        else:
+            self._bank.voltages[self._index] = math.nan if value is None else value
+            self._bank.voltage_samples += 1
+            self._bank.changes += 1
+
+    @property
+    def balance(self) -> Union[bool, None]:
+        """
+        The balance status of a specific cell
+        """
+        if self._bank is None:
+            return self._balance
+        balance = self._bank.balances[self._index]
+        return None if balance < 0 else bool(balance)
+
+    @balance.setter
+    def balance(self, value: Union[bool, None]) -> None:
+        if self._bank is None:
+            self._balance = value
+        else:
+            self._bank.balances[self._index] = -1 if value is None else 1 if value else 0
+            self._bank.changes += 1
+
+    @property
+    def temp(self) -> Union[float, None]:
+        """
+        The temperature of a specific cell in °C
+        """
+        if self._bank is None:
+            return self._temp
+        temp = self._bank.temps[self._index]
+        return None if temp != temp else temp
+
+    @temp.setter
+    def temp(self, value: Union[float, None]) -> None:
+        if self._bank is None:
+            self._temp = value
+        else:
+            self._bank.temps[self._index] = math.nan if value is None else value
+            self._bank.changes += 1
+
+
+class CellBank:
     """
-    The voltage of a specific cell in Volts
+    This class holds the cells of a battery in arrays. Missing voltages and temperatures are stored as NaN,
+    missing balance states as -1. It behaves like a list of `Cell`, so drivers can use
+    `self.cells.append(Cell(False))` and `self.cells[c].voltage = ...`. To assign all cell voltages
+    of a decoded frame at once, use `set_voltages()`.
+
+    :param cells: the cells to add
     """
 
-    balance: bool = None
+    def __init__(self, cells: Iterable[Cell] = ()):
+        self.voltages: array = array("d")
+        """
+        Voltages of the cells in Volts
+        """
+
+        self.balances: array = array("b")
+        """
+        Balance states of the cells, -1 = unknown, 0 = not balancing, 1 = balancing
+        """
+
+        self.temps: array = array("d")
+        """
+        Temperatures of the cells in °C
+        """
+
+        self.changes: int = 0
+        """
+        Number of changes of the cells, used to invalidate the cell statistics
+        """
+
+        self.voltage_samples: int = 0
+        """
+        Number of voltages assigned by the driver, used to filter only new samples
+        """
+
+        self.views: List[Cell] = []
+        self.extend(cells)
+
+    def __len__(self) -> int:
+        return len(self.views)
+
+    def __iter__(self) -> Iterator[Cell]:
+        return iter(self.views)
+
+    def __getitem__(self, idx):
+        return self.views[idx]
+
+    def __setitem__(self, idx: int, cell: Cell) -> None:
+        voltage, balance, temp = cell.voltage, cell.balance, cell.temp
+        self.views[idx]._bank = None
+        self.views[idx] = cell
+        cell._bank = self
+        cell._index = idx if idx >= 0 else len(self.views) + idx
+        cell.voltage, cell.balance, cell.temp = voltage, balance, temp
+
+    def append(self, cell: Cell) -> None:
+        voltage, balance, temp = cell.voltage, cell.balance, cell.temp
+        self.voltages.append(math.nan)
+        self.balances.append(-1)
+        self.temps.append(math.nan)
+        self.views.append(cell)
+        cell._bank = self
+        cell._index = len(self.views) - 1
+        cell.voltage, cell.balance, cell.temp = voltage, balance, temp
+
+    def extend(self, cells: Iterable[Cell]) -> None:
+        for cell in list(cells):
+            self.append(cell)
+
+    def clear(self) -> None:
+        for cell in self.views:
+            cell._bank = None
+        del self.voltages[:]
+        del self.balances[:]
+        del self.temps[:]
+        self.views = []
+        self.changes += 1
+
+    def resize(self, count: int, balance: bool = None) -> None:
+        """
+        Add or remove cells, so that the bank holds `count` cells.
+
+        :param count: the number of cells
+        :param balance: the balance status of added cells
+        :return: None
+        """
+        while len(self.views) < count:
+            self.append(Cell(balance))
+        if len(self.views) > count:
+            for cell in self.views[count:]:
+                cell._bank = None
+            del self.voltages[count:]
+            del self.balances[count:]
+            del self.temps[count:]
+            del self.views[count:]
+            self.changes += 1
+
+    def set_voltages(self, voltages: Iterable[float], balance: bool = None) -> None:
+        """
+        Set the voltages of all cells at once. Cells are added or removed to match the number of voltages.
+
+        :param voltages: the cell voltages in Volts
+        :param balance: the balance status of added cells
+        :return: None
+        """
+        voltages = array("d", (math.nan if voltage is None else voltage for voltage in voltages))
+        self.resize(len(voltages), balance)
+        self.voltages[:] = voltages
+        self.voltage_samples += 1
+        self.changes += 1
+
+    def set_balances(self, balances: Iterable[bool]) -> None:
+        """
+        Set the balance status of the first cells at once.
+
+        :param balances: the balance status of the cells
+        :return: None
+        """
+        for idx, balance in enumerate(balances):
+            if idx >= len(self.views):
+                break
+            self.balances[idx] = -1 if balance is None else 1 if balance else 0
+        self.changes += 1
+
+
+class CellStatistics:
     """
-    The balance status of a specific cell
+    This class holds the statistics of all cells, calculated in a single pass over the cells.
+    It's calculated on demand by `Battery.get_cell_statistics()` and invalidated when a cell changes.
+
+    :param cells: the cells of the battery
+    :param cell_count: the number of cells of the battery
     """
 
-    def __init__(self, balance: bool = None):
-        self.balance = balance
+    def __init__(self, cells: CellBank, cell_count: int):
+        self.min_voltage: Union[float, None] = None
+        """
+        Lowest voltage of all cells
+        """
+
+        self.max_voltage: Union[float, None] = None
+        """
+        Highest voltage of all cells
+        """
+
+        self.min_cell: Union[int, None] = None
+        """
+        Index of the cell with the lowest voltage within `cell_count`
+        """
+
+        self.max_cell: Union[int, None] = None
+        """
+        Index of the cell with the highest voltage within `cell_count`
+        """
+
+        self.voltage_sum: float = 0
+        """
+        Sum of the cell voltages within `cell_count`
+        """
+
+        self.balancing: int = 0
+        """
+        1 if any cell within `cell_count` is balancing, else 0
+        """
+
+        self.half1_voltage: float = 0
+        """
+        Sum of the cell voltages of the first half of the battery, used for the midpoint
+        """
+
+        self.half2_voltage: float = 0
+        """
+        Sum of the cell voltages of the second half of the battery, used for the midpoint
+        """
+
+        count = min(len(cells), cell_count) if cell_count is not None else 0
+        halfcount = count // 2
+        half2_start = halfcount + count % 2
+        min_cell_voltage = 9999
+        max_cell_voltage = 0
+
+        balances = cells.balances
+        for idx, voltage in enumerate(cells.voltages):
+            # NaN is a missing voltage
+            missing = voltage != voltage
+            if not missing:
+                if self.min_voltage is None or voltage < self.min_voltage:
+                    self.min_voltage = voltage
+                if self.max_voltage is None or voltage > self.max_voltage:
+                    self.max_voltage = voltage
+
+            if idx >= count:
+                continue
+
+            if balances[idx] > 0:
+                self.balancing = 1
+
+            if missing:
+                continue
+
+            if voltage < min_cell_voltage:
+                min_cell_voltage = voltage
+                self.min_cell = idx
+            if voltage > max_cell_voltage:
+                max_cell_voltage = voltage
+                self.max_cell = idx
+
+            if voltage:
+                self.voltage_sum += voltage
+            if idx < halfcount:
+                self.half1_voltage += voltage
+            elif idx >= half2_start:
+                self.half2_voltage += voltage
+
+
+class SampledValue:
+    """
+    Attribute of a `Battery`, which counts the values assigned by the driver in `Battery.samples`.
+    The value itself is stored in the attribute with a leading underscore, filtered values are written
+    there directly, so they are not counted as a new sample. See `Battery.apply_filters()`.
+    """
+
+    def __set_name__(self, owner, name: str) -> None:
+        self.name: str = name
+        self.attribute: str = "_" + name
+
+    def __get__(self, battery, owner=None):
+        if battery is None:
+            return self
+        return battery.__dict__.get(self.attribute)
+
+    def __set__(self, battery, value) -> None:
+        battery.__dict__[self.attribute] = value
+        samples = battery.__dict__.setdefault("samples", {})
+        samples[self.name] = samples.get(self.name, 0) + 1
 
 
 class Battery(ABC):
@@ -155,11 +446,27 @@ class Battery(ABC):
     use the individual implementations as type Battery and work with it.
     """
 
+    FILTERED_VALUES: Tuple[str, ...] = ("current", "temp1", "temp2", "temp3", "temp4", "temp_mos")
+    """
+    Values, which are filtered by `apply_filters()` if a filter is configured
+    """
+
+    current = SampledValue()
+    temp1 = SampledValue()
+    temp2 = SampledValue()
+    temp3 = SampledValue()
+    temp4 = SampledValue()
+    temp_mos = SampledValue()
+
     def __init__(self, port: str, baud: int, address: str):
         self.port: str = port
         self.baud_rate: int = baud
         self.address: str = address
         self.role: str = "battery"
+        self.samples: Dict[str, int] = self.__dict__.get("samples", {})
+        """
+        Number of values assigned by the driver to each value in `FILTERED_VALUES`
+        """
         self.type: str = "Generic"
         self.poll_interval: int = 1000
         self.dbus_external_objects: dict = None
@@ -193,7 +500,10 @@ class Battery(ABC):
         self.control_allow_discharge: bool = None
 
         self.current_avg: float = None
-        self.current_avg_lst: list = []
+        self.current_avg_window: utils.RollingWindow = utils.RollingWindow(utils.CURRENT_AVG_WINDOW)
+        """
+        Current samples of the last `CURRENT_AVG_WINDOW` seconds, used to calculate the average current
+        """
         self.current_external: float = None
         self.capacity_remain: float = None
         self.capacity: float = None
@@ -208,7 +518,7 @@ class Battery(ABC):
         self.temp3: float = None
         self.temp4: float = None
         self.temp_mos: float = None
-        self.cells: List[Cell] = []
+        self.cells: CellBank = CellBank()
         self.control_voltage: float = None
         self.soc_reset_requested: bool = False
         self.soc_reset_last_reached: int = 0  # save state to preserve on restart
@@ -254,9 +564,9 @@ class Battery(ABC):
         Timestamp when it was last checked, if the error could be reset
         """
 
-        self.error_timestamps: list = []
+        self.error_rate: utils.ErrorRateTracker = utils.ErrorRateTracker(180)
         """
-        List of timestamps when an error occurred
+        Timestamps of the last 180 errors and the number of errors by error code
         """
 
         self.custom_field: str = None
@@ -264,8 +574,54 @@ class Battery(ABC):
         Custom field that the user can define in the BMS settings via the BMS app
         """
 
+        self.cell_statistics: Union[CellStatistics, None] = None
+        """
+        Statistics of the cells, see `get_cell_statistics()`
+        """
+
+        self.cell_statistics_key: tuple = None
+        """
+        State of the cells, when the statistics were calculated
+        """
+
+        self.poll_reads: List[dict] = []
+        """
+        Reads registered by the driver with their poll group, see `add_poll_read()`
+        """
+
+        self.filters: Dict[str, Union[utils.FilterPipeline, None]] = {
+            "current": utils.create_filter_pipeline(utils.FILTER_CURRENT),
+            "cell_voltages": utils.create_filter_pipeline(utils.FILTER_CELL_VOLTAGES),
+            **{name: utils.create_filter_pipeline(utils.FILTER_TEMPERATURES) for name in ("temp1", "temp2", "temp3", "temp4", "temp_mos")},
+        }
+        """
+        Filter pipelines of the signals, None if a signal is not filtered, see `apply_filters()`.
+        Each temperature has its own pipeline, since the sensors may be read in different poll groups.
+        """
+
+        self.filters_samples: Dict[str, int] = {}
+        """
+        Number of samples of each value in `samples`, when it was filtered the last time
+        """
+
+        self.filters_cell_samples: Tuple[Union[CellBank, None], int] = (None, 0)
+        """
+        Cells and their number of voltage samples, when they were filtered the last time
+        """
+
         self.init_values()
 
+    @property
+    def cells(self) -> CellBank:
+        """
+        The cells of the battery. Assigned lists of `Cell` are converted to a `CellBank`.
+        """
+        return self._cells
+
+    @cells.setter
+    def cells(self, cells: Iterable[Cell]) -> None:
+        self._cells = cells if isinstance(cells, CellBank) else CellBank(cells)
+
     def init_values(self) -> None:
         """
         Used to initialize and reset values, if battery unexpectly disconnects
@@ -276,6 +632,42 @@ class Battery(ABC):
         self.current: float = None
         self.current_corrected: float = None
 
+        # initialize the filters again with the next values
+        for pipeline in self.filters.values():
+            if pipeline is not None:
+                pipeline.reset()
+
+    def apply_filters(self) -> None:
+        """
+        Filter the current, the cell voltages and the temperatures read by the driver with the configured filter pipelines.
+        Called after each successful `refresh_data()`. A pipeline is only fed, if the driver assigned a new value since
+        the last call, so values read in a slower poll group are not filtered again with their own filtered value.
+        All cells are filtered at once. Missing values are not filtered.
+
+        :return: None
+        """
+        samples, filters_samples = self.samples, self.filters_samples
+        for name in self.FILTERED_VALUES:
+            pipeline = self.filters[name]
+            count = samples.get(name, 0)
+            if pipeline is None or filters_samples.get(name, 0) == count:
+                continue
+            filters_samples[name] = count
+            value = getattr(self, "_" + name)
+            if value is not None:
+                # store the filtered value directly, else it would be counted as a new sample
+                setattr(self, "_" + name, pipeline.update((value,))[0])
+
+        pipeline = self.filters["cell_voltages"]
+        cells = self.cells
+        if pipeline is not None and (self.filters_cell_samples[0] is not cells or self.filters_cell_samples[1] != cells.voltage_samples):
+            self.filters_cell_samples = (cells, cells.voltage_samples)
+            voltages = cells.voltages
+            # NaN is a missing voltage
+            if len(voltages) > 0 and all(voltage == voltage for voltage in voltages):
+                voltages[:] = pipeline.update(voltages)
+                cells.changes += 1
+
     @abstractmethod
     def test_connection(self) -> bool:
         """
@@ -368,6 +760,68 @@ class Battery(ABC):
         """
         return False
 
+    POLL_GROUPS = {
+        "fast": 0,
+        "medium": utils.POLL_INTERVAL_MEDIUM,
+        "slow": utils.POLL_INTERVAL_SLOW,
+    }
+    """
+    Poll groups and their poll interval in seconds
+    """
+
+    def add_poll_read(self, group: str, read: Callable[..., bool], alarms: List[str] = None) -> None:
+        """
+        Registers a read of the driver in a poll group. The registered reads are executed
+        by `refresh_poll_reads()` depending on the poll interval of their group.
+
+        - `fast`: voltage, current, cell voltages; read every poll interval
+        - `medium`: temperatures, FET states, alarms; read every `POLL_INTERVAL_MEDIUM` seconds
+        - `slow`: limits, capacity, version; read every `POLL_INTERVAL_SLOW` seconds
+
+        :param group: the poll group, `fast`, `medium` or `slow`
+        :param read: function reading and populating the data, returns False on failure
+        :param alarms: names of the `Protection` values, which trigger the read immediately when they change
+        :return: None
+        """
+        if group not in self.POLL_GROUPS:
+            raise ValueError(f"Unknown poll group {group}")
+
+        self.poll_reads.append({"group": group, "read": read, "alarms": alarms or [], "last_read": 0})
+
+    def refresh_poll_reads(self, *args) -> bool:
+        """
+        Executes all registered reads, which are due in their poll group. Reads that failed
+        are retried on the next call. Reads related to an alarm, which changed, are executed immediately.
+
+        :param args: arguments passed to each read, e.g. the opened serial port
+        :return: False if any executed read failed, else True
+        """
+        now = time()
+        protection = vars(self.protection).copy()
+        result = True
+        executed = []
+
+        for poll_read in self.poll_reads:
+            if poll_read["last_read"] + self.POLL_GROUPS[poll_read["group"]] <= now:
+                executed.append(poll_read)
+                if poll_read["read"](*args):
+                    poll_read["last_read"] = now
+                else:
+                    result = False
+
+        # read data related to a changed alarm immediately
+        alarms = [name for name, value in vars(self.protection).items() if protection.get(name) != value]
+        if len(alarms) > 0:
+            for poll_read in self.poll_reads:
+                if poll_read not in executed and any(alarm in alarms for alarm in poll_read["alarms"]):
+                    logger.debug(f"Alarm changed, reading {poll_read['group']} data immediately")
+                    if poll_read["read"](*args):
+                        poll_read["last_read"] = now
+                    else:
+                        result = False
+
+        return result
+
     def to_temp(self, sensor: int, value: float) -> None:
         """
         Keep the temp value between -20 and 100 to handle sensor issues or no data.
@@ -1441,22 +1895,29 @@ class Battery(ABC):
             logger.error(f"Exception occurred: {repr(exception_object)} of type {exception_type} in {file} line #{line}")
             return self.max_battery_discharge_current
 
+    def get_cell_statistics(self) -> CellStatistics:
+        """
+        Get the statistics of the cells. They are calculated once in a single pass and
+        recalculated only if a cell, the list of cells or the cell count changed.
+
+        :return: The statistics of the cells
+        """
+        key = (id(self.cells), self.cells.changes, len(self.cells), self.cell_count)
+        if self.cell_statistics is None or self.cell_statistics_key != key:
+            self.cell_statistics = CellStatistics(self.cells, self.cell_count)
+            self.cell_statistics_key = key
+        return self.cell_statistics
+
     def get_min_cell(self) -> int:
         """
         Get the cell with the lowest voltage.
 
         :return: The number of the cell with the lowest voltage
         """
-        min_voltage = 9999
-        min_cell = None
         if len(self.cells) == 0 and hasattr(self, "cell_min_no"):
             return self.cell_min_no
 
-        for c in range(min(len(self.cells), self.cell_count)):
-            if self.cells[c].voltage is not None and min_voltage > self.cells[c].voltage:
-                min_voltage = self.cells[c].voltage
-                min_cell = c
-        return min_cell
+        return self.get_cell_statistics().min_cell
 
     def get_max_cell(self) -> int:
         """
@@ -1464,16 +1925,10 @@ class Battery(ABC):
 
         :return: The number of the cell with the highest voltage
         """
-        max_voltage = 0
-        max_cell = None
         if len(self.cells) == 0 and hasattr(self, "cell_max_no"):
             return self.cell_max_no
 
-        for c in range(min(len(self.cells), self.cell_count)):
-            if self.cells[c].voltage is not None and max_voltage < self.cells[c].voltage:
-                max_voltage = self.cells[c].voltage
-                max_cell = c
-        return max_cell
+        return self.get_cell_statistics().max_cell
 
     def get_min_cell_desc(self) -> Union[str, None]:
         """
@@ -1510,12 +1965,7 @@ class Battery(ABC):
 
         :return: The sum of all cell voltages
         """
-        voltage_sum = 0
-        for i in range(self.cell_count):
-            voltage = self.get_cell_voltage(i)
-            if voltage:
-                voltage_sum += voltage
-        return voltage_sum
+        return self.get_cell_statistics().voltage_sum
 
     def get_cell_balancing(self, idx: int) -> Union[int, None]:
         """
@@ -1628,10 +2078,7 @@ class Battery(ABC):
             min_voltage = self.cell_min_voltage
 
         if min_voltage is None:
-            try:
-                min_voltage = min(c.voltage for c in self.cells if c.voltage is not None)
-            except ValueError:
-                pass
+            min_voltage = self.get_cell_statistics().min_voltage
         return min_voltage
 
     def get_max_cell_voltage(self) -> Union[float, None]:
@@ -1640,10 +2087,7 @@ class Battery(ABC):
             max_voltage = self.cell_max_voltage
 
         if max_voltage is None:
-            try:
-                max_voltage = max(c.voltage for c in self.cells if c.voltage is not None)
-            except ValueError:
-                pass
+            max_voltage = self.get_cell_statistics().max_voltage
         return max_voltage
 
     def get_midvoltage(self) -> Tuple[Union[float, None], Union[float, None]]:
@@ -1657,15 +2101,9 @@ class Battery(ABC):
             return None, None
 
         halfcount = int(math.floor(self.cell_count / 2))
-        uneven_cells_offset = self.cell_count % 2
-        half1voltage = 0
-        half2voltage = 0
-
-        try:
-            half1voltage = sum(cell.voltage for cell in self.cells[:halfcount] if cell.voltage is not None)
-            half2voltage = sum(cell.voltage for cell in self.cells[halfcount + uneven_cells_offset :] if cell.voltage is not None)
-        except ValueError:
-            pass
+        cell_statistics = self.get_cell_statistics()
+        half1voltage = cell_statistics.half1_voltage
+        half2voltage = cell_statistics.half2_voltage
 
         try:
             extra = 0 if self.cell_count % 2 == 0 else self.cells[halfcount].voltage / 2
@@ -1679,10 +2117,7 @@ class Battery(ABC):
             return None, None
 
     def get_balancing(self) -> int:
-        for c in range(min(len(self.cells), self.cell_count)):
-            if self.cells[c].balance is not None and self.cells[c].balance:
-                return 1
-        return 0
+        return self.get_cell_statistics().balancing
 
     def get_temp(self) -> Union[float, None]:
         try:
@@ -1862,18 +2297,13 @@ class Battery(ABC):
 
         :param error_code: The error code to display
         """
-        self.error_timestamps.append(int(time()))
-
-        # only keep last 180 errors
-        if len(self.error_timestamps) > 180:
-            # remove first element
-            self.error_timestamps.pop(0)
+        self.error_rate.add(error_code, int(time()))
 
         # check if
         #     there are more or equal to 180 errors
-        #     the first error in the list is within the last 3 hours
+        #     the first of the last 180 errors is within the last 3 hours
         #     the error code is different from the current error
-        if len(self.error_timestamps) >= 180 and int(time()) - self.error_timestamps[0] <= (60 * 60 * 3) and self.error_code != error_code:
+        if self.error_code != error_code and self.error_rate.limit_reached(60 * 60 * 3, int(time())):
             # set error code
             self.error_code = error_code
 
@@ -1883,21 +2313,16 @@ class Battery(ABC):
         """
         # check if
         #     there are more or equal to 180 errors
-        #     the first error in the list is not within the last 3 hours
+        #     the first of the last 180 errors is not within the last 3 hours
         #     the error code is not already None
-        if len(self.error_timestamps) >= 180 and int(time()) - self.error_timestamps[0] > (60 * 60 * 3) and self.error_code is not None:
+        if self.error_code is not None and self.error_rate.full and not self.error_rate.limit_reached(60 * 60 * 3, int(time())):
             self.error_code = None
 
     def log_cell_data(self) -> bool:
-        if logger.getEffectiveLevel() > logging.INFO and len(self.cells) == 0:
+        if not logger.isEnabledFor(logging.DEBUG) or len(self.cells) == 0:
             return False
 
-        cell_res = ""
-        cell_counter = 1
-        for c in self.cells:
-            cell_res += "[{0}]{1}V ".format(cell_counter, c.voltage)
-            cell_counter = cell_counter + 1
-        logger.debug("Cells:" + cell_res)
+        logger.debug("Cells:%s", "".join("[{0}]{1}V ".format(idx, c.voltage) for idx, c in enumerate(self.cells, start=1)))
         return True
 
     def log_settings(self) -> None:
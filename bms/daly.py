@@ -7,6 +7,9 @@ from battery import Battery, Cell
 from utils import (
     bytearray_to_string,
     open_serial_port,
+    read_serialport_bytes,
+    sum8,
+    verify_sum8,
     logger,
     AUTO_RESET_SOC,
     BATTERY_CAPACITY,
@@ -14,7 +17,7 @@ from utils import (
     MIN_CELL_VOLTAGE,
 )
 from struct import unpack_from, pack_into
-from time import sleep, time
+from time import monotonic, sleep, time
 from datetime import datetime
 from re import sub
 import sys
@@ -46,6 +49,19 @@ class Daly(Battery):
             "force_discharging_off_callback",
         ]
 
+        # reads executed by refresh_data(), grouped by how fast the data changes
+        # the FET states and temperatures are read immediately, if the BMS reports a changed alarm
+        alarms_fet = ["high_voltage", "low_voltage", "high_charge_current", "high_charge_temp", "low_charge_temp", "high_temperature", "low_temperature", "low_soc"]
+        alarms_temp = ["high_charge_temp", "low_charge_temp", "high_temperature", "low_temperature"]
+        self.add_poll_read("fast", self.read_soc_data)
+        self.add_poll_read("fast", self.read_alarm_data)
+        self.add_poll_read("fast", self.read_cell_voltage_range_data)
+        self.add_poll_read("fast", self.read_cells_volts)
+        self.add_poll_read("medium", self.read_fed_data, alarms_fet)
+        self.add_poll_read("medium", self.read_temperature_range_data, alarms_temp)
+        self.add_poll_read("medium", self.read_balance_state)
+        self.add_poll_read("slow", self.read_status_data)
+
     # command bytes [StartFlag=A5][Address=40][Command=94][DataLength=8][8x fill bytes][checksum]
     # use 0xAA (or 0x55) as fill bytes to allow the daly's "weak" uart to sync better
     # this reduces read errors dramatically
@@ -117,45 +133,16 @@ class Daly(Battery):
         # Open serial port to be used for all data reads instead of opening multiple times
         try:
             with open_serial_port(self.port, self.baud_rate) as ser:
-                result = self.read_soc_data(ser)
+                # read the data, which is due in its poll group
+                result = self.refresh_poll_reads(ser)
                 self.reset_soc = self.soc if self.soc else 0
                 if self.runtime > 0.200:  # TROUBLESHOOTING for no reply errors
-                    logger.debug("  |- refresh_data: read_soc_data - result: " + str(result) + " - runtime: " + str(f"{self.runtime:.1f}") + "s")
-
-                # result placed last to ensure all data is read anyway
-                result = self.read_fed_data(ser) and result
-                if self.runtime > 0.200:  # TROUBLESHOOTING for no reply errors
-                    logger.debug("  |- refresh_data: read_fed_data - result: " + str(result) + " - runtime: " + str(f"{self.runtime:.1f}") + "s")
-
-                # result placed last to ensure all data is read anyway
-                result = self.read_cell_voltage_range_data(ser) and result
-                if self.runtime > 0.200:  # TROUBLESHOOTING for no reply errors
-                    logger.debug("  |- refresh_data: read_cell_voltage_range_data - result: " + str(result) + " - runtime: " + str(f"{self.runtime:.1f}") + "s")
+                    logger.debug("  |- refresh_data: refresh_poll_reads - result: " + str(result) + " - runtime: " + str(f"{self.runtime:.1f}") + "s")
 
                 self.write_soc_and_datetime(ser)
                 if self.runtime > 0.200:  # TROUBLESHOOTING for no reply errors
                     logger.debug("  |- refresh_data: write_soc_and_datetime - result: " + str(result) + " - runtime: " + str(f"{self.runtime:.1f}") + "s")
 
-                # result placed last to ensure all data is read anyway
-                result = self.read_alarm_data(ser) and result
-                if self.runtime > 0.200:  # TROUBLESHOOTING for no reply errors
-                    logger.debug("  |- refresh_data: read_alarm_data - result: " + str(result) + " - runtime: " + str(f"{self.runtime:.1f}") + "s")
-
-                # result placed last to ensure all data is read anyway
-                result = self.read_temperature_range_data(ser) and result
-                if self.runtime > 0.200:  # TROUBLESHOOTING for no reply errors
-                    logger.debug("  |- refresh_data: read_temperature_range_data - result: " + str(result) + " - runtime: " + str(f"{self.runtime:.1f}") + "s")
-
-                # result placed last to ensure all data is read anyway
-                result = self.read_balance_state(ser) and result
-                if self.runtime > 0.200:  # TROUBLESHOOTING for no reply errors
-                    logger.debug("  |- refresh_data: read_balance_state - result: " + str(result) + " - runtime: " + str(f"{self.runtime:.1f}") + "s")
-
-                # result placed last to ensure all data is read anyway
-                result = self.read_cells_volts(ser) and result
-                if self.runtime > 0.200:  # TROUBLESHOOTING for no reply errors
-                    logger.debug("  |- refresh_data: read_cells_volts - result: " + str(result) + " - runtime: " + str(f"{self.runtime:.1f}") + "s")
-
                 self.write_charge_discharge_mos(ser)
 
                 if AUTO_RESET_SOC:
@@ -586,7 +573,7 @@ class Daly(Battery):
             now.second,
             int(self.soc_to_set * 10),
         )
-        cmd[12] = sum(cmd[:12]) & 0xFF
+        cmd[12] = sum8(cmd, 0, 12)
 
         logger.info(f"write soc {self.soc_to_set}%")
         self.soc_to_set = None  # Reset value, so we will set it only once
@@ -645,7 +632,7 @@ class Daly(Battery):
         if self.trigger_force_disable_charge is not None:
             cmd[2] = self.command_disable_charge_mos[0]
             cmd[4] = 0 if self.trigger_force_disable_charge else 1
-            cmd[12] = sum(cmd[:12]) & 0xFF
+            cmd[12] = sum8(cmd, 0, 12)
             logger.info(f"write force disable charging: {'true' if self.trigger_force_disable_charge else 'false'}")
             self.trigger_force_disable_charge = None
             ser.flushOutput()
@@ -660,7 +647,7 @@ class Daly(Battery):
         if self.trigger_force_disable_discharge is not None:
             cmd[2] = self.command_disable_discharge_mos[0]
             cmd[4] = 0 if self.trigger_force_disable_discharge else 1
-            cmd[12] = sum(cmd[:12]) & 0xFF
+            cmd[12] = sum8(cmd, 0, 12)
             logger.info(f"write force disable discharging: {'true' if self.trigger_force_disable_discharge else 'false'}")
             self.trigger_force_disable_discharge = None
             ser.flushOutput()
@@ -677,7 +664,7 @@ class Daly(Battery):
         buffer = bytearray(self.command_base)
         buffer[1] = self.address[0]  # Always serial 40 or 80
         buffer[2] = command[0]
-        buffer[12] = sum(buffer[:12]) & 0xFF  # checksum calc
+        buffer[12] = sum8(buffer, 0, 12)  # checksum calc
         return buffer
 
     def request_data(self, ser, command, sentences_to_receive=1):
@@ -706,7 +693,7 @@ class Daly(Battery):
         return false if less than 13 bytes received in timeout secs, or frame errors occured
         return received datasection as bytearray else
         """
-        time_start = time()
+        time_start = monotonic()
 
         reply = ser.read_until(b"\xA5")
         if not reply or b"\xA5" not in reply:
@@ -715,16 +702,11 @@ class Daly(Battery):
 
         idx = reply.index(b"\xA5")
         reply = reply[idx:]
-        toread = ser.inWaiting()
-        while toread < 12:
-            sleep((12 - toread) * 0.001)
-            toread = ser.inWaiting()
-            time_run = time() - time_start
-            if time_run > timeout:
-                logger.debug(f"read_sentence {bytearray_to_string(expected_reply)}: timeout")
-                return False
+        reply += read_serialport_bytes(ser, 12, time_start + timeout)
+        if len(reply) < 13:
+            logger.debug(f"read_sentence {bytearray_to_string(expected_reply)}: timeout")
+            return False
 
-        reply += ser.read(12)
         try:
             _, id, cmd, length = unpack_from(">BBBB", reply)
         except Exception:
@@ -736,8 +718,7 @@ class Daly(Battery):
             logger.debug(f"read_sentence {bytearray_to_string(expected_reply)}: wrong header")
             return False
 
-        chk = unpack_from(">B", reply, 12)[0]
-        if sum(reply[:12]) & 0xFF != chk:
+        if not verify_sum8(reply, 12):
             logger.debug(f"read_sentence {bytearray_to_string(expected_reply)}: wrong checksum")
             return False
 
@@ -8,8 +8,8 @@
 
 # avoid importing wildcards, remove unused imports
 from battery import Battery, Cell
-from utils import open_serial_port, logger
-from time import sleep
+from utils import checksum16, lenid, open_serial_port, read_serialport_until, verify_checksum16_ascii, verify_lenid, logger
+from time import monotonic
 from struct import unpack
 from re import findall
 import sys
@@ -26,6 +26,8 @@ class Daren485(Battery):
         self.serial_number = ""
 
     BATTERYTYPE = "Daren485"
+    # overall time to wait for a complete response frame, terminated by EOI (\r)
+    RESPONSE_TIMEOUT = 1.0
 
     def test_connection(self):
         """
@@ -148,8 +150,6 @@ class Daren485(Battery):
         ser.write(req.encode())
         logger.debug("get_mfg_params request sent: {}".format(req))
 
-        sleep(0.4)  # Allow the BMS some time to send a full response
-
         response = self.read_response(ser)
 
         if response:
@@ -182,8 +182,6 @@ class Daren485(Battery):
         ser.write(req.encode())
         logger.debug("get_cap_params request sent: {}".format(req))
 
-        sleep(0.4)  # Allow the BMS some time to send a full response
-
         response = self.read_response(ser)
 
         if response:
@@ -222,8 +220,6 @@ class Daren485(Battery):
         ser.write(req.encode())
         logger.debug("get_realtime_data request sent: {}".format(req))
 
-        sleep(0.5)  # Allow the BMS some time to send a full response
-
         response = self.read_response(ser)
 
         if response:
@@ -413,8 +409,6 @@ class Daren485(Battery):
         ser.write(req.encode())
         logger.debug("get_manufacturer_info request sent: {}".format(req))
 
-        sleep(0.4)  # Allow the BMS some time to send a full response
-
         response = self.read_response(ser)
 
         if response:
@@ -460,8 +454,6 @@ class Daren485(Battery):
         ser.write(req.encode())
         logger.debug("get_cells_params request sent: {}".format(req))
 
-        sleep(0.4)  # Allow the BMS some time to send a full response
-
         response = self.read_response(ser)
 
         if response:
@@ -504,23 +496,25 @@ class Daren485(Battery):
 
     def read_response(self, ser):
         """
-        After sending the command to the device, this service processes
-        the receive buffer and performs basic parsing and validation of received data.
+        After sending the command to the device, this service reads the response
+        until the EOI (\r) is received or the timeout is reached.
+        Then it performs basic parsing and validation of received data.
         """
-        buff = ""
-
-        while ser.inWaiting() > 0:
-            try:
-                chr = ser.read()
-                buff += chr.decode()
-                if chr == b"\r":
-                    break
-            except Exception as e:
-                logger.error("Exception during inWaiting(): {}".format(e))
-                pass
+        try:
+            buff = read_serialport_until(ser, b"\r", monotonic() + self.RESPONSE_TIMEOUT)
+        except Exception as e:
+            logger.error("Exception during read: {}".format(e))
+            return False
+
+        # skip everything received before the SOI (~)
+        start = buff.find(b"~")
+        if start < 0 or not buff.endswith(b"\r"):
+            logger.error("read_response timeout! Received data: {}".format(buff))
+            return False
+        del buff[:start]
 
         try:
-            CID2 = buff[7:9]
+            CID2 = buff[7:9].decode()
             if self.CID2_decode(CID2) == -1:
                 logger.debug("CID2_Decode error!")
                 logger.debug("Buffer contents: {}".format(buff))
@@ -533,9 +527,7 @@ class Daren485(Battery):
         logger.debug("Received data: {}".format(buff))
 
         try:
-            LENID = int(buff[9:13], base=16)
-            length = LENID & 0x0FFF
-            if self.length_checksum(length) == LENID:
+            if verify_lenid(int(buff[9:13], base=16)):
                 logger.debug("Data length ok.")
             else:
                 logger.error("Data length error.")
@@ -546,12 +538,10 @@ class Daren485(Battery):
             return False
 
         try:
-            chksum = int(buff[len(buff) - 5 :], base=16)
-            calculated_chksum = self.calculate_checksum(buff[1 : len(buff) - 5])
-            if calculated_chksum == chksum:
+            if verify_checksum16_ascii(buff):
                 logger.debug("Checksum ok.")
             else:
-                logger.error("Checksum error. Calculated: {}, Received: {}".format(calculated_chksum, chksum))
+                logger.error("Checksum error. Received data: {}".format(buff))
                 return False
 
         except Exception as e:
@@ -559,7 +549,8 @@ class Daren485(Battery):
             return False
 
         logger.debug("read_response Data valid!")
-        return buff
+        # the response is validated, decode it once for the field parsers
+        return buff.decode(errors="replace")
 
     def create_command_get_cells_params(self):
         """
@@ -624,37 +615,16 @@ class Daren485(Battery):
         command += cid2.hex().upper()  # B5=CID2
 
         if len(info) > 0:
-            length = len(info)
-            length = self.length_checksum(length)
-            command += format(length, "x").upper()
+            command += "{:04X}".format(lenid(len(info)))
             command += info
         else:
             command += "0000"  # Length = 0, LenID=0, Lchecksum=0
-        checksum = self.calculate_checksum(command[1 : len(command)])
-
-        command += format(checksum, "x").upper()
+        command += "{:04X}".format(checksum16(command.encode(), 1))
         command += "\r"  # Last Byte=EOI, \r
 
         # logger.info("Command: {}".format(command))
         return command
 
-    def calculate_checksum(self, str):
-        checksum = 0
-        for value in str:
-            checksum = checksum + ord(value)
-        checksum = checksum ^ 0xFFFF
-        return checksum + 1
-
-    # creates length + checksum from length val in two byte integer
-    def length_checksum(self, value):
-        value = value & 0x0FFF
-        n1 = value & 0xF
-        n2 = (value >> 4) & 0xF
-        n3 = (value >> 8) & 0xF
-        chksum = ((n1 + n2 + n3) & 0xF) ^ 0xF
-        chksum = chksum + 1
-        return value + (chksum << 12)
-
     def CID2_decode(self, CID2):
         if CID2 == "00":
             logger.debug("CID2 response ok.")
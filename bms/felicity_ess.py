@@ -17,6 +17,12 @@ import serial
 
 RETRYCNT = 3
 
+# register windows read on every refresh (start register, number of registers)
+REG_WINDOW_BAT_INFO = (0x1302, 0x0A)
+REG_WINDOW_LIMITS = (0x131C, 0x04)
+REG_WINDOW_CELL_DATA = (0x132A, 0x18)
+REG_WINDOWS = [REG_WINDOW_BAT_INFO, REG_WINDOW_LIMITS, REG_WINDOW_CELL_DATA]
+
 class FelicityEss(Battery):
     def __init__(self, port, baud, address):
         super(FelicityEss, self).__init__(port, baud, address)
@@ -45,6 +51,10 @@ class FelicityEss(Battery):
         self.discharge_fet = None
         self.control_allow_charge = None
         self.control_allow_discharge = None
+        # merge the register windows into as few Modbus requests as possible
+        self.register_blocks = utils.plan_register_reads(
+            REG_WINDOWS, utils.FELICITY_ESS_MODBUS_MAX_GAP, utils.FELICITY_ESS_MODBUS_MAX_REGISTERS
+        )
         self.get_settings()
 
     BATTERYTYPE = "Felicity_ESS_modbus"
@@ -60,20 +70,20 @@ class FelicityEss(Battery):
         else:
             minimalmodbus._SLAVEADDRESS_BROADCAST = 0
 
+        # use the pooled serial port instead of opening and closing the port on each call
+        ser = utils.get_serial_port(self.port, 9600, 0.4, parity=serial.PARITY_NONE, stopbits=serial.STOPBITS_ONE)
+
         if self.mbdev is not None and slaveaddress == self.slaveaddress:
             return self.mbdev
 
+        minimalmodbus._serialports[self.port] = ser
         mbdev = minimalmodbus.Instrument(
             self.port,
             slaveaddress=slaveaddress,
             mode="rtu",
-            close_port_after_each_call=True,
+            close_port_after_each_call=False,
             debug=False,
         )
-        mbdev.serial.parity = minimalmodbus.serial.PARITY_NONE
-        mbdev.serial.stopbits = serial.STOPBITS_ONE
-        mbdev.serial.baudrate = 9600
-        mbdev.serial.timeout = 0.4
         return mbdev
 
     def test_connection(self):
@@ -155,14 +165,17 @@ class FelicityEss(Battery):
         # modbus object
         mb = self.get_modbus(self.slaveaddress)
 
+        # read all register windows at once
+        registers = self.readRegisterBlocks(mb)
+
         # collect cell ist
-        cellDataValidity = self.readCellData(mb)
+        cellDataValidity = self.readCellData(utils.slice_register_window(registers, *REG_WINDOW_CELL_DATA))
 
         # collect charge / discharge limits
-        limitsValidity = self.readLimits(mb)
+        limitsValidity = self.readLimits(utils.slice_register_window(registers, *REG_WINDOW_LIMITS))
 
         # collect battery infos
-        infoValidity = self.readBatInfo(mb)
+        infoValidity = self.readBatInfo(utils.slice_register_window(registers, *REG_WINDOW_BAT_INFO))
 
         # set needed battery protection
         self.processBatteryProtection()
@@ -172,34 +185,66 @@ class FelicityEss(Battery):
         return (cellDataValidity and limitsValidity and infoValidity) #return True in case connection is established and ist is valid
 
 
-    def readCellData(self,mb):
+    def readRegisterBlocks(self, mb):
+        # read the register blocks planned in __init__
+        # returns a list of (start register, number of registers, values), values are None on failure
+        registers = []
+        for start, count in list(self.register_blocks):
+            try:
+                dataList = mb.read_registers(registeraddress=start, number_of_registers=count, functioncode=3)
+                logger.debug(f"Felicity_ESS: readRegisterBlocks() reponse {hex(start)}x{count} {dataList}")
+                registers.append((start, count, dataList))
+                continue
+            except minimalmodbus.IllegalRequestError as e:
+                windows = [window for window in REG_WINDOWS if start <= window[0] and window[0] + window[1] <= start + count]
+                if len(windows) <= 1:
+                    logger.debug(f"Felicity_ESS: readRegisterBlocks() failed to request {hex(start)}x{count} ({e})")
+                    registers.append((start, count, None))
+                    continue
+
+                # the BMS rejects reading the registers between the windows, read them separately from now on
+                logger.warning(f"Felicity_ESS: readRegisterBlocks() request {hex(start)}x{count} rejected, split into {len(windows)} requests ({e})")
+                index = self.register_blocks.index((start, count))
+                self.register_blocks[index : index + 1] = windows
+            except Exception as e:
+                logger.debug(f"Felicity_ESS: readRegisterBlocks() failed to request {hex(start)}x{count} ({e})")
+                registers.append((start, count, None))
+                continue
+
+            for window_start, window_count in windows:
+                try:
+                    dataList = mb.read_registers(registeraddress=window_start, number_of_registers=window_count, functioncode=3)
+                    logger.debug(f"Felicity_ESS: readRegisterBlocks() reponse {hex(window_start)}x{window_count} {dataList}")
+                    registers.append((window_start, window_count, dataList))
+                except Exception as e:
+                    logger.debug(f"Felicity_ESS: readRegisterBlocks() failed to request {hex(window_start)}x{window_count} ({e})")
+                    registers.append((window_start, window_count, None))
+
+        return registers
+
+    def readCellData(self,dataList):
         #collect cell ist
         try: 
-            dataList = mb.read_registers(registeraddress=0x132A, number_of_registers=0x18, functioncode=3)
-            logger.debug(f"Felicity_ESS: readCellData() reponse {dataList}")
+            if dataList is None:
+                return False
 
             if len(dataList) >= 24:
                 
-                cnt = 0
-                tmpVoltage = 0
-                for ist in dataList:
-                    # first 16 entries are cell voltage in mV
-                    if cnt <= self.cell_count - 1: #cellvoltages
-                        self.cells[cnt].voltage = ist / 1000 # mV to V
-                        tmpVoltage = tmpVoltage + self.cells[cnt].voltage
-                        logger.debug(f"Felicity_ESS: readCellData() cell voltage " + str(cnt) + " " + str(ist) + "mV")
-                    # 17-24 ciontaining temperature informations (temp 5-8 seems to be not connected/supported)
-                    elif cnt <= 24 - 1:
-                        self.temps[cnt-self.cell_count] = ist
-                        logger.debug(f"Felicity_ESS: readCellData() temp " + str(cnt-16) + " " + str(ist) + "degC")
-                    cnt += 1
+                # first 16 entries are cell voltage in mV
+                self.cells.set_voltages([ist / 1000 for ist in dataList[: self.cell_count]], False) # mV to V
+                tmpVoltage = sum(self.cells.voltages)
+                logger.debug("Felicity_ESS: readCellData() cell voltages %s mV", dataList[: self.cell_count])
+
+                # 17-24 ciontaining temperature informations (temp 5-8 seems to be not connected/supported)
+                self.temps[: 24 - self.cell_count] = dataList[self.cell_count : 24]
+                logger.debug("Felicity_ESS: readCellData() temps %s degC", self.temps)
                 
                 # assign to temps
                 self.temp1 = self.temps[0]
                 self.temp2 = self.temps[1]
                 self.temp3 = self.temps[2]
                 self.temp4 = self.temps[3]
-                logger.debug(f"Felicity_ESS: readCellData() tmp bat voltage " + str(tmpVoltage) + "V")
+                logger.debug("Felicity_ESS: readCellData() tmp bat voltage %s V", tmpVoltage)
                 return True
             else:
                 logger.debug(
@@ -212,11 +257,11 @@ class FelicityEss(Battery):
 
             return False
         
-    def readLimits(self,mb):
+    def readLimits(self,dataList):
         #collect limits
         try: 
-            dataList = mb.read_registers(registeraddress=0x131C, number_of_registers=0x04, functioncode=3)
-            logger.debug(f"Felicity_ESS: readLimits() reponse {dataList}")
+            if dataList is None:
+                return False
 
             if len(dataList) >= 4:
                 # 0 is charge voltage limit in 0.01V
@@ -263,11 +308,11 @@ class FelicityEss(Battery):
 
             return False
         
-    def readBatInfo(self,mb):
+    def readBatInfo(self,dataList):
         #collect bat info
         try: 
-            dataList = mb.read_registers(registeraddress=0x1302, number_of_registers=0x0A, functioncode=3)
-            logger.debug(f"Felicity_ESS: readBatInfo() reponse {dataList}")
+            if dataList is None:
+                return False
 
             if len(dataList) >= 10:
                 # 0 Bttery Status
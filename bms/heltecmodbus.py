@@ -8,7 +8,7 @@
 
 
 from battery import Battery, Cell
-from utils import logger
+from utils import logger, get_serial_port
 import serial
 import time
 import ext.minimalmodbus as minimalmodbus
@@ -48,18 +48,18 @@ class HeltecModbus(Battery):
         # are supported on the same serial interface. Then locking on the port will be enough.
 
         with locks[self.address]:
+            # use the pooled serial port instead of opening and closing the port on each call
+            # yes, 400ms is long but the BMS is sometimes really slow in responding, so this is a good compromise
+            minimalmodbus._serialports[self.port] = get_serial_port(
+                self.port, 9600, 0.4, parity=serial.PARITY_NONE, stopbits=serial.STOPBITS_ONE
+            )
             mbdev = minimalmodbus.Instrument(
                 self.port,
                 slaveaddress=self.address,
                 mode="rtu",
-                close_port_after_each_call=True,
+                close_port_after_each_call=False,
                 debug=False,
             )
-            mbdev.serial.parity = minimalmodbus.serial.PARITY_NONE
-            mbdev.serial.stopbits = serial.STOPBITS_ONE
-            mbdev.serial.baudrate = 9600
-            # yes, 400ms is long but the BMS is sometimes really slow in responding, so this is a good compromise
-            mbdev.serial.timeout = 0.4
             mbdevs[self.address] = mbdev
 
             for n in range(1, RETRYCNT):
@@ -4,7 +4,7 @@
 # Updated by https://github.com/peterohman
 
 from battery import Battery, Cell
-from utils import logger
+from utils import open_serial_port, logger
 import serial
 from time import sleep
 import sys
@@ -218,7 +218,9 @@ class HLPdataBMS4S(Battery):
 
 def read_serial_data(command, port, baud, time, min_len):
     try:
-        with serial.Serial(port, baudrate=baud, timeout=2.5) as ser:
+        with open_serial_port(port, baud, timeout=2.5) as ser:
+            if ser is None:
+                return False
             ret = read_serialport_data(ser, command, time, min_len)
         return ret
 
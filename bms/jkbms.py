@@ -4,17 +4,87 @@
 # Updated by https://github.com/mr-manuel
 
 from battery import Battery, Cell
-from utils import bytearray_to_string, is_bit_set, read_serial_data, logger, ZERO_CHAR
-from struct import unpack_from
+from typing import Dict
+from utils import bytearray_to_string, is_bit_set, read_serial_data, sum16, logger, ZERO_CHAR
+from struct import Struct, unpack_from
 from re import sub
 import sys
 
 
+UINT8 = Struct(">B")
+UINT16 = Struct(">H")
+UINT32 = Struct(">L")
+
+# length of the value of each id code in the status frame
+# the cell voltages (0x79) are not listed, since they have their own length byte
+STATUS_FIELD_LENGTHS = {
+    0x80: 2,  # MOSFET temperature
+    0x81: 2,  # temperature sensor 1
+    0x82: 2,  # temperature sensor 2
+    0x83: 2,  # total voltage
+    0x84: 2,  # current
+    0x85: 1,  # SOC
+    0x86: 1,  # number of temperature sensors
+    0x87: 2,  # charge cycles
+    0x89: 4,  # total charge cycle capacity
+    0x8A: 2,  # cell count
+    0x8B: 2,  # warnings
+    0x8C: 2,  # status
+    0x8E: 2,  # total overvoltage protection
+    0x8F: 2,  # total undervoltage protection
+    0x90: 2,  # cell overvoltage protection
+    0x91: 2,  # cell overvoltage recovery
+    0x92: 2,  # cell overvoltage protection delay
+    0x93: 2,  # cell undervoltage protection
+    0x94: 2,  # cell undervoltage recovery
+    0x95: 2,  # cell undervoltage protection delay
+    0x96: 2,  # cell voltage difference protection
+    0x97: 2,  # continued discharge current
+    0x98: 2,  # discharge overcurrent delay
+    0x99: 2,  # continued charge current
+    0x9A: 2,  # charge overcurrent delay
+    0x9B: 2,  # balance start voltage
+    0x9C: 2,  # balance start voltage difference
+    0x9D: 1,  # balance switch
+    0x9E: 2,  # MOSFET overtemperature protection
+    0x9F: 2,  # MOSFET overtemperature recovery
+    0xA0: 2,  # overtemperature protection
+    0xA1: 2,  # overtemperature recovery
+    0xA2: 2,  # temperature difference protection
+    0xA3: 2,  # charge overtemperature protection
+    0xA4: 2,  # discharge overtemperature protection
+    0xA5: 2,  # charge undertemperature protection
+    0xA6: 2,  # charge undertemperature recovery
+    0xA7: 2,  # discharge undertemperature protection
+    0xA8: 2,  # discharge undertemperature recovery
+    0xA9: 1,  # cell count setting
+    0xAA: 4,  # capacity
+    0xAB: 1,  # charge MOSFET switch
+    0xAC: 1,  # discharge MOSFET switch
+    0xAD: 2,  # current calibration
+    0xAE: 1,  # protection board address
+    0xAF: 1,  # battery type
+    0xB0: 2,  # sleep waiting time
+    0xB1: 1,  # low capacity alarm
+    0xB2: 10,  # password
+    0xB3: 1,  # dedicated charger switch
+    0xB4: 8,  # user private data
+    0xB5: 4,  # production date
+    0xB6: 4,  # system working time
+    0xB7: 15,  # software version
+    0xB8: 1,  # start current calibration
+    0xB9: 4,  # actual capacity
+    0xBA: 24,  # manufacturer id
+    0xC0: 1,  # protocol version
+}
+
+
 class Jkbms(Battery):
     def __init__(self, port, baud, address):
         super(Jkbms, self).__init__(port, baud, address)
         self.type = self.BATTERYTYPE
         self.unique_identifier_tmp = ""
+        self.cell_struct = None
 
     BATTERYTYPE = "JKBMS"
     LENGTH_CHECK = 1
@@ -78,13 +148,37 @@ class Jkbms(Battery):
         # Return True if success, False for failure
         return self.read_status_data()
 
-    def get_data(self, bytes, idcode, start, length):
-        # logger.debug("start "+str(start) + " length " + str(length))
-        # logger.debug(binascii.hexlify(bytearray(bytes[start:start + 1 + length])).decode('ascii'))
-        start = bytes.find(idcode, start, start + 1 + length)
-        if start < 0:
-            return False
-        return bytes[start + 1 : start + length + 1]
+    def parse_status_data(self, status_data: bytearray) -> Dict[int, memoryview]:
+        """
+        Walk once over the status frame and map each id code to its value, without copying the data.
+        The cell voltages (0x79) have their own length byte, all other id codes have a fixed length.
+        Stops at the first unknown id code, since the position of the next id code is unknown then.
+        """
+        data = memoryview(status_data)
+        fields = {}
+        # byte 0 is the transmission type
+        pos = 1
+        end = len(data)
+        while pos < end:
+            idcode = data[pos]
+            if idcode == 0x79:
+                if pos + 1 >= end:
+                    break
+                length = data[pos + 1]
+                pos += 2
+            else:
+                length = STATUS_FIELD_LENGTHS.get(idcode)
+                if length is None:
+                    logger.debug("Unknown id code 0x%02X at position %u, stop parsing", idcode, pos)
+                    break
+                pos += 1
+
+            if pos + length > end:
+                break
+            fields[idcode] = data[pos : pos + length]
+            pos += length
+
+        return fields
 
     def read_status_data(self):
         status_data = self.read_serial_data_jkbms(self.command_status)
@@ -92,65 +186,60 @@ class Jkbms(Battery):
         if status_data is False:
             return False
 
+        fields = self.parse_status_data(status_data)
+        if 0x79 not in fields or 0x8A not in fields:
+            logger.error(">>> ERROR: Incomplete status data")
+            return False
+
         # cell voltages
-        offset = 1
-        cellbyte_count = unpack_from(">B", self.get_data(status_data, b"\x79", offset, 1))[0]
+        cellbyte_count = len(fields[0x79])
 
-        offset = cellbyte_count + 30
-        cell_count = unpack_from(">H", self.get_data(status_data, b"\x8A", offset, 2))[0]
+        cell_count = UINT16.unpack(fields[0x8A])[0]
         # check if the cell count is valid
         if cell_count > 0:
             self.cell_count = cell_count
 
         if cellbyte_count == 3 * self.cell_count and self.cell_count == len(self.cells):
-            offset = 1
-            celldata = self.get_data(status_data, b"\x79", offset, 1 + cellbyte_count)
-
-            for c in range(self.cell_count):
-                cell_voltage = unpack_from(">xH", celldata, c * 3 + 1)[0] / 1000
+            # each cell has 1 byte cell number and 2 bytes voltage
+            if self.cell_struct is None or self.cell_struct.size != cellbyte_count:
+                self.cell_struct = Struct(">" + "xH" * self.cell_count)
 
+            for c, cell_voltage in enumerate(self.cell_struct.unpack(fields[0x79])):
                 # check if the cell voltage is valid
                 if cell_voltage > 0:
-                    self.cells[c].voltage = cell_voltage
+                    self.cells[c].voltage = cell_voltage / 1000
 
         # MOSFET temperature
-        offset = cellbyte_count + 3
-        temp_mos = unpack_from(">H", self.get_data(status_data, b"\x80", offset, 2))[0]
+        temp_mos = UINT16.unpack(fields[0x80])[0]
         # check if the mosfet temperature is valid
         if temp_mos >= 0:
             self.to_temp(0, temp_mos if temp_mos < 99 else (100 - temp_mos))
 
         # Temperature sensors
-        offset = cellbyte_count + 6
-        temp1 = unpack_from(">H", self.get_data(status_data, b"\x81", offset, 2))[0]
+        temp1 = UINT16.unpack(fields[0x81])[0]
         # check if the temperature is valid
         if temp1 >= 0:
             self.to_temp(1, temp1 if temp1 < 99 else (100 - temp1))
 
-        offset = cellbyte_count + 9
-        temp2 = unpack_from(">H", self.get_data(status_data, b"\x82", offset, 2))[0]
+        temp2 = UINT16.unpack(fields[0x82])[0]
         # check if the temperature is valid
         if temp2 >= 0:
             self.to_temp(2, temp2 if temp2 < 99 else (100 - temp2))
 
-        offset = cellbyte_count + 12
-        voltage = unpack_from(">H", self.get_data(status_data, b"\x83", offset, 2))[0]
+        voltage = UINT16.unpack(fields[0x83])[0]
         self.voltage = voltage / 100
 
-        offset = cellbyte_count + 15
-        current = unpack_from(">H", self.get_data(status_data, b"\x84", offset, 2))[0]
+        current = UINT16.unpack(fields[0x84])[0]
         self.current = current / -100 if current < self.CURRENT_ZERO_CONSTANT else (current - self.CURRENT_ZERO_CONSTANT) / 100
 
         # Continued discharge current
-        offset = cellbyte_count + 66
-        max_battery_discharge_current = float(unpack_from(">H", self.get_data(status_data, b"\x97", offset, 2))[0])
+        max_battery_discharge_current = float(UINT16.unpack(fields[0x97])[0])
         # check if the max discharge current is valid
         if max_battery_discharge_current >= 0:
             self.max_battery_discharge_current = max_battery_discharge_current
 
         # Continued charge current
-        offset = cellbyte_count + 72
-        max_battery_charge_current = float(unpack_from(">H", self.get_data(status_data, b"\x99", offset, 2))[0])
+        max_battery_charge_current = float(UINT16.unpack(fields[0x99])[0])
         # check if the max charge current is valid
         if max_battery_charge_current >= 0:
             self.max_battery_charge_current = max_battery_charge_current
@@ -158,60 +247,49 @@ class Jkbms(Battery):
         # the JKBMS resets to
         # 95% SoC, if all cell voltages are above or equal to OVPR (Over Voltage Protection Recovery)
         # 100% Soc, if all cell voltages are above or equal to OVP (Over Voltage Protection)
-        offset = cellbyte_count + 18
-        soc = unpack_from(">B", self.get_data(status_data, b"\x85", offset, 1))[0]
+        soc = UINT8.unpack(fields[0x85])[0]
         # check if the soc is valid
         if soc >= 0 and soc <= 100:
             self.soc = soc
 
-        offset = cellbyte_count + 22
-        charge_cycles = unpack_from(">H", self.get_data(status_data, b"\x87", offset, 2))[0]
+        charge_cycles = UINT16.unpack(fields[0x87])[0]
         # check if the charge cycles are valid
         if charge_cycles >= 0:
             self.history.charge_cycles = charge_cycles
 
-        # offset = cellbyte_count + 25
-        # self.capacity_remain = unpack_from('>L', self.get_data(status_data, b'\x89', offset, 4))[0]
-        offset = cellbyte_count + 121
-        capacity = unpack_from(">L", self.get_data(status_data, b"\xAA", offset, 4))[0]
+        # self.capacity_remain = UINT32.unpack(fields[0x89])[0]
+        capacity = UINT32.unpack(fields[0xAA])[0]
         # check if the capacity is valid
         if capacity >= 0:
             self.capacity = capacity
 
-        offset = cellbyte_count + 33
-        self.to_protection_bits(unpack_from(">H", self.get_data(status_data, b"\x8B", offset, 2))[0])
+        self.to_protection_bits(UINT16.unpack(fields[0x8B])[0])
 
-        offset = cellbyte_count + 36
-        self.to_fet_bits(unpack_from(">H", self.get_data(status_data, b"\x8C", offset, 2))[0])
+        self.to_fet_bits(UINT16.unpack(fields[0x8C])[0])
 
-        offset = cellbyte_count + 84
-        self.to_balance_bits(unpack_from(">B", self.get_data(status_data, b"\x9D", offset, 1))[0])
+        self.to_balance_bits(UINT8.unpack(fields[0x9D])[0])
 
         # "User Private Data" field in APP
-        offset = cellbyte_count + 155
         tmp = sub(
             " +",
             " ",
-            (unpack_from(">8s", self.get_data(status_data, b"\xB4", offset, 8))[0].decode().replace("\x00", " ").strip()),
+            (bytes(fields[0xB4]).decode().replace("\x00", " ").strip()),
         )
         self.custom_field = tmp if tmp != "Input Us" else None
 
         # production date
         try:
-            offset = cellbyte_count + 164
-            tmp = unpack_from(">4s", self.get_data(status_data, b"\xB5", offset, 4))[0].decode()
+            tmp = bytes(fields[0xB5]).decode()
             self.production = "20" + tmp + "01" if tmp and tmp != "" else None
         except UnicodeDecodeError:
             self.production = None
 
-        offset = cellbyte_count + 174
-        self.version = unpack_from(">15s", self.get_data(status_data, b"\xB7", offset, 15))[0].decode().replace("_", " ").strip()
+        self.version = bytes(fields[0xB7]).decode().replace("_", " ").strip()
 
-        offset = cellbyte_count + 197
         self.unique_identifier_tmp = sub(
             " +",
             "_",
-            (unpack_from(">24s", self.get_data(status_data, b"\xBA", offset, 24))[0].decode().replace("\x00", " ").replace("Input Userda", "").strip()),
+            (bytes(fields[0xBA]).decode().replace("\x00", " ").replace("Input Userda", "").strip()),
         )
 
         # show wich cells are balancing
@@ -335,7 +413,7 @@ class Jkbms(Battery):
         start, length = unpack_from(">HH", data)
         end, crc_hi, crc_lo = unpack_from(">BHH", data[-5:])
 
-        s = sum(data[0:-4])
+        s = sum16(data, 0, len(data) - 4)
 
         logger.debug("bytearray: " + bytearray_to_string(data))
 
@@ -5,7 +5,8 @@
 # https://github.com/Louisvdw/dbus-serialbattery/pull/372
 # Updated by https://github.com/mr-manuel
 
-from struct import unpack_from, calcsize
+from struct import Struct, unpack_from
+from array import array
 from bleak import BleakScanner, BleakClient, exc
 from time import sleep, time
 import asyncio
@@ -22,8 +23,24 @@ if __name__ == "__main__":
     def bytearray_to_string(data):
         return "".join("\\x" + format(byte, "02x") for byte in data)
 
+    def LazyString(function, *args):
+        return function(*args)
+
+    class DebugSampler:
+        active = True
+
+        def next(self):
+            return True
+
+    def sum8(data, start=0, end=None):
+        return sum(data[start:end]) & 0xFF
+
+    def verify_sum8(frame, end=None):
+        end = len(frame) - 1 if end is None else end
+        return len(frame) > end and sum8(frame, 0, end) == frame[end]
+
 else:
-    from utils import bytearray_to_string, logger
+    from utils import bytearray_to_string, logger, DebugSampler, LazyString, sum8, verify_sum8
 
 # zero means parse all incoming data (every second)
 CELL_INFO_REFRESH_S = 0
@@ -123,6 +140,114 @@ TRANSLATE_CELL_INFO_32S = [
 ]
 
 
+class TranslationPlan:
+    """
+    A translation table compiled into a few flat struct.Struct unpack plans.
+    Fields that do not overlap are merged into one Struct with pad bytes,
+    so a frame is decoded with a handful of unpacks instead of one per value.
+    Arrays are written into preallocated arrays of the status dict.
+    """
+
+    def __init__(self, translation, f32s=False, counts=None):
+        # array sizes as given in the translation table, by key
+        self.array_sizes = {t[0][1]: t[0][2] for t in translation if len(t[0]) == 3}
+        fields = []
+        for t in translation:
+            path, offset, fmt = t[0], t[1], t[2]
+            scale = t[3] if len(t) == 4 else None
+            count = path[2] if len(path) == 3 else None
+            if counts is not None and path[1] in counts:
+                count = counts[path[1]]
+            if f32s:
+                if offset >= 112:
+                    offset += 32
+                elif offset >= 54:
+                    offset += 16
+
+            if isinstance(fmt, int):
+                # raw bytes, 3. param gives no format but number of bytes
+                kind = "raw"
+                fmt = f"{fmt}s"
+            else:
+                fmt = fmt.lstrip("<>!=@")
+                kind = "str" if fmt.endswith("s") else "value"
+            item = Struct("<" + fmt)
+            # number of values per item, e.g. "4?" unpacks to 4 values and only the first is used
+            width = len(item.unpack(bytes(item.size)))
+            fields.append((offset, fmt, item.size * (1 if count is None else count), path[0], path[1], kind, width, count, scale))
+
+        # merge fields into groups, a new group is needed when a field overlaps the previous one
+        self.groups = []
+        group_fmt, group_start, group_end, group_fields = "", None, None, []
+        for offset, fmt, size, section, key, kind, width, count, scale in sorted(fields, key=lambda f: f[0]):
+            if group_end is None or offset < group_end:
+                if group_fields:
+                    self.groups.append((Struct("<" + group_fmt), group_start, group_fields))
+                group_fmt, group_start, group_end, group_fields = "", offset, offset, []
+            if offset > group_end:
+                group_fmt += f"{offset - group_end}x"
+            group_fmt += fmt * (1 if count is None else count)
+            group_end = offset + size
+            group_fields.append((section, key, kind, width, count, scale))
+        if group_fields:
+            self.groups.append((Struct("<" + group_fmt), group_start, group_fields))
+
+    def decode(self, fb, o):
+        for group, start, group_fields in self.groups:
+            values = group.unpack_from(fb, start)
+            i = 0
+            for section, key, kind, width, count, scale in group_fields:
+                if section not in o:
+                    o[section] = {}
+                target = o[section]
+
+                if count is not None:
+                    arr = target.get(key)
+                    if not isinstance(arr, array) or len(arr) != count:
+                        arr = target[key] = array("d", bytes(8 * count))
+                    for j in range(count):
+                        val = values[i]
+                        arr[j] = val * scale if scale is not None else val
+                        i += width
+                    continue
+
+                val = values[i]
+                i += width
+                if kind == "str":
+                    try:
+                        val = val.decode("utf-8").rstrip(" \t\n\r\0")
+                    except UnicodeDecodeError:
+                        val = ""
+                elif kind == "raw":
+                    val = bytearray(val)
+                elif scale is not None:
+                    val = val * scale
+                target[key] = val
+
+
+# compiled translation plans, by table, 32s offsets and cell count
+TRANSLATION_PLANS = {}
+
+
+def get_translation_plan(translation, f32s=False, cell_count=None):
+    key = (id(translation), f32s, cell_count)
+    plan = TRANSLATION_PLANS.get(key)
+    if plan is None:
+        plan = TranslationPlan(translation, f32s, None if cell_count is None else {"voltages": cell_count})
+        TRANSLATION_PLANS[key] = plan
+    return plan
+
+
+# compile the plans once at startup, the cell info plans for the configured cell count are added on first use
+for _translation, _f32s in (
+    (TRANSLATE_DEVICE_INFO, False),
+    (TRANSLATE_SETTINGS, False),
+    (TRANSLATE_CELL_INFO_24S, False),
+    (TRANSLATE_CELL_INFO_32S, True),
+):
+    get_translation_plan(_translation, _f32s)
+
+
 class Jkbms_Brn:
     # entries for translating the bytearray to py-object via unpack
     # [[py dict entry as list, each entry ] ]
@@ -148,6 +273,9 @@ class Jkbms_Brn:
     # translate info placeholder, since it depends on the bms_max_cell_count
     translate_cell_info = []
 
+    # cell count from the settings frame, limits the decoded cell voltages
+    cell_info_cell_count = None
+
     def __init__(self, addr, reset_bt_callback=None):
         self.address = addr
         self.bt_thread = None
@@ -155,6 +283,8 @@ class Jkbms_Brn:
         self.bt_reset = reset_bt_callback
         self.should_be_scraping = False
         self.trigger_soc_reset = False
+        # decides which frames are logged at debug level
+        self.debug_sampler = DebugSampler()
 
     async def scanForDevices(self):
         devices = await BleakScanner.discover()
@@ -192,49 +322,8 @@ class Jkbms_Brn:
 
         logger.debug(f"bms_max_cell_count recognized: {self.bms_max_cell_count}")
 
-    # iterative implementation maybe later due to referencing
-    def translate(self, fb, translation, o, f32s=False, i=0):
-        if i == len(translation[0]) - 1:
-            # keep things universal by using an n=1 list
-            kees = range(0, translation[0][i]) if isinstance(translation[0][i], int) else [translation[0][i]]
-            offset = 0
-            if f32s:
-                if translation[1] >= 112:
-                    offset = 32
-                elif translation[1] >= 54:
-                    offset = 16
-            i = 0
-            for j in kees:
-                if isinstance(translation[2], int):
-                    # handle raw bytes without unpack_from;
-                    # 3. param gives no format but number of bytes
-                    val = bytearray(fb[translation[1] + i + offset : translation[1] + i + translation[2] + offset])
-                    i += translation[2]
-                else:
-                    val = unpack_from(translation[2], bytearray(fb), translation[1] + i + offset)[0]
-                    # calculate stepping in case of array
-                    i = i + calcsize(translation[2])
-
-                if isinstance(val, bytes):
-                    try:
-                        val = val.decode("utf-8").rstrip(" \t\n\r\0")
-                    except UnicodeDecodeError:
-                        val = ""
-
-                elif isinstance(val, int) and len(translation) == 4:
-                    val = val * translation[3]
-                o[j] = val
-        else:
-            if translation[0][i] not in o:
-                if len(translation[0]) == i + 2 and isinstance(translation[0][i + 1], int):
-                    o[translation[0][i]] = [None] * translation[0][i + 1]
-                else:
-                    o[translation[0][i]] = {}
-
-            self.translate(fb, translation, o[translation[0][i]], f32s=f32s, i=i + 1)
-
     def decode_warnings(self, fb):
-        val = unpack_from("<H", bytearray(fb), 136)[0]
+        val = unpack_from("<H", fb, 136)[0]
 
         self.bms_status["cell_info"]["error_bitmask_16"] = hex(val)
         self.bms_status["cell_info"]["error_bitmask_2"] = format(val, "016b")
@@ -255,14 +344,12 @@ class Jkbms_Brn:
 
     def decode_device_info_jk02(self):
         fb = self.frame_buffer
-        for t in TRANSLATE_DEVICE_INFO:
-            self.translate(fb, t, self.bms_status)
+        get_translation_plan(TRANSLATE_DEVICE_INFO).decode(fb, self.bms_status)
 
     def decode_cellinfo_jk02(self):
         fb = self.frame_buffer
         has32s = self.bms_max_cell_count == 32
-        for t in self.translate_cell_info:
-            self.translate(fb, t, self.bms_status, f32s=has32s)
+        get_translation_plan(self.translate_cell_info, has32s, self.cell_info_cell_count).decode(fb, self.bms_status)
         self.decode_warnings(fb)
         logger.debug("decode_cellinfo_jk02(): self.frame_buffer")
         logger.debug(self.frame_buffer)
@@ -270,8 +357,7 @@ class Jkbms_Brn:
 
     def decode_settings_jk02(self):
         fb = self.frame_buffer
-        for t in TRANSLATE_SETTINGS:
-            self.translate(fb, t, self.bms_status)
+        get_translation_plan(TRANSLATE_SETTINGS).decode(fb, self.bms_status)
         logger.debug(self.bms_status)
 
     def decode(self):
@@ -282,11 +368,14 @@ class Jkbms_Brn:
             logger.debug("Processing frame with settings info")
             if protocol_version == PROTOCOL_VERSION_JK02:
                 self.decode_settings_jk02()
-                # adapt translation table for cell array lengths
-                ccount = self.bms_status["settings"]["cell_count"]
-                for i, t in enumerate(self.translate_cell_info):
-                    if t[0][-2] == "voltages" or t[0][-2] == "voltages":
-                        self.translate_cell_info[i][0][-1] = ccount
+                # adapt translation plan for cell array lengths,
+                # ignore cell counts that do not fit the table
+                cell_count = self.bms_status["settings"]["cell_count"]
+                max_cell_count = get_translation_plan(self.translate_cell_info, self.bms_max_cell_count == 32).array_sizes["voltages"]
+                if 0 < cell_count <= max_cell_count:
+                    self.cell_info_cell_count = cell_count
+                else:
+                    logger.debug(f"ignoring cell count {cell_count} from settings, has to be 1 to {max_cell_count}")
                 self.bms_status["last_update"] = time()
 
         elif info_type == 0x02:
@@ -316,44 +405,44 @@ class Jkbms_Brn:
         self._new_data_callback = callback
 
     def assemble_frame(self, data: bytearray):
-        logger.debug(f"--> assemble_frame() -> self.frame_buffer (before extend) -> lenght:  {len(self.frame_buffer)}")
-        logger.debug(self.frame_buffer)
+        debug = self.debug_sampler.active
+        if debug:
+            logger.debug("--> assemble_frame() -> self.frame_buffer (before extend) -> lenght:  %d", len(self.frame_buffer))
         if len(self.frame_buffer) > MAX_RESPONSE_SIZE:
             logger.debug("data dropped because it alone was longer than max frame length")
-            self.frame_buffer = []
+            self.frame_buffer = bytearray()
 
         if data[0] == 0x55 and data[1] == 0xAA and data[2] == 0xEB and data[3] == 0x90:
             # beginning of new frame, clear buffer
-            self.frame_buffer = []
+            self.frame_buffer = bytearray()
 
         self.frame_buffer.extend(data)
 
-        logger.debug(f"--> assemble_frame() -> self.frame_buffer (after extend) -> lenght:  {len(self.frame_buffer)}")
-        logger.debug(self.frame_buffer)
+        if debug:
+            logger.debug("--> assemble_frame() -> self.frame_buffer (after extend) -> lenght:  %d", len(self.frame_buffer))
         if len(self.frame_buffer) >= MIN_RESPONSE_SIZE:
             # check crc; always at position 300, independent of
             # actual frame-lentgh, so crc up to 299
-            ccrc = self.crc(self.frame_buffer, 300 - 1)
-            rcrc = self.frame_buffer[300 - 1]
-            logger.debug(f"compair recvd. crc: {rcrc} vs calc. crc: {ccrc}")
-            if ccrc == rcrc:
-                logger.debug("great success! frame complete and sane, lets decode")
+            if debug:
+                logger.debug("compair recvd. crc: %d vs calc. crc: %d", self.frame_buffer[300 - 1], sum8(self.frame_buffer, 0, 300 - 1))
+            if verify_sum8(self.frame_buffer, 300 - 1):
+                if debug:
+                    logger.debug("great success! frame complete and sane, lets decode")
+                    logger.debug("frame: %s", LazyString(bytearray_to_string, self.frame_buffer))
                 self.decode()
-                self.frame_buffer = []
+                self.frame_buffer = bytearray()
                 if self._new_data_callback is not None:
                     self._new_data_callback()
 
     def ncallback(self, sender: int, data: bytearray):
-        logger.debug(f"--> NEW PACKAGE! lenght:  {len(data)}")
-        logger.debug("ncallback(): " + bytearray_to_string(data))
+        # decide once per frame, if it's logged
+        if data[0:4] == b"\x55\xaa\xeb\x90":
+            self.debug_sampler.next()
+        if self.debug_sampler.active:
+            logger.debug("--> NEW PACKAGE! lenght:  %d", len(data))
+            logger.debug("ncallback(): %s", LazyString(bytearray_to_string, data))
         self.assemble_frame(data)
 
-    def crc(self, arr: bytearray, length: int) -> int:
-        crc = 0
-        for a in arr[:length]:
-            crc = crc + a
-        return crc.to_bytes(2, "little")[0]
-
     async def write_register(
         self,
         address,
@@ -382,7 +471,7 @@ class Jkbms_Brn:
         frame[16] = 0x00
         frame[17] = 0x00
         frame[18] = 0x00
-        frame[19] = self.crc(frame, len(frame) - 1)
+        frame[19] = sum8(frame, 0, len(frame) - 1)
         logger.debug("Write register: " + str(address) + " " + str(frame))
 
         # some JKBMS trow an error
@@ -4,7 +4,7 @@
 # Added by https://github.com/KoljaWindeler
 
 from battery import Battery, Cell
-from utils import bytearray_to_string, read_serial_data, logger, USE_PORT_AS_UNIQUE_ID
+from utils import bytearray_to_string, crc16_modbus, read_serial_data, logger, USE_PORT_AS_UNIQUE_ID
 from struct import unpack_from
 import sys
 
@@ -335,7 +335,7 @@ class Jkbms_pb(Battery):
         """
         modbus_msg = self.address
         modbus_msg += command
-        modbus_msg += self.modbusCrc(modbus_msg)
+        modbus_msg += crc16_modbus(modbus_msg).to_bytes(2, "little")
 
         data = read_serial_data(
             modbus_msg,
@@ -360,19 +360,3 @@ class Jkbms_pb(Battery):
         else:
             logger.error(">>> ERROR: Incorrect Reply ")
             return False
-
-    def modbusCrc(self, msg: str):
-        """
-        copied from https://stackoverflow.com/a/75328573
-        to calculate the needed checksum
-        """
-        crc = 0xFFFF
-        for n in range(len(msg)):
-            crc ^= msg[n]
-            for i in range(8):
-                if crc & 1:
-                    crc >>= 1
-                    crc ^= 0xA001
-                else:
-                    crc >>= 1
-        return crc.to_bytes(2, "little")
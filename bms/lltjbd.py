@@ -5,7 +5,9 @@
 
 from battery import Protection, Battery, Cell
 from utils import (
+    FilterFloatingAvg,
     bytearray_to_string,
+    checksum16,
     is_bit_set,
     kelvin_to_celsius,
     read_serial_data,
@@ -16,20 +18,24 @@ from utils import (
     MIN_CELL_VOLTAGE,
     MAX_CELL_VOLTAGE,
     MQTT_SERVER,
+    MQTT_PUBLISH_INTERVAL,
+    MQTT_QUEUE_SIZE,
+    MQTT_CELL_VOLTAGE_TOPICS,
     CELL_VOLT_FROM_MQTT
 )
 from struct import unpack_from, pack
 import struct
 import sys
 from time import time
+from array import array
 # imports for new MQTT if
+from collections import deque
 import threading
-import paho.mqtt.client as mqtt
 import time
 import json
 
 class MQTTHandler:
-    def __init__(self, broker, port=1883, client_id=None, username=None, password=None, keepalive=15):
+    def __init__(self, broker, port=1883, client_id=None, username=None, password=None, keepalive=15, queue_size=MQTT_QUEUE_SIZE):
         self.broker = broker
         self.port = port
         self.keepalive = keepalive
@@ -38,19 +44,53 @@ class MQTTHandler:
         self.isSubscribed = False
         self.enaMqtt = False
 
+        # cell voltages of the NEEY balancers and the time they were received, see set_cell_topics()
+        self.cell_topics = {}
+        self.cellVoltages = []
+        self.cellVoltTs = []
+
+        # messages are sent by a background thread, so that a slow broker doesn't block the poll loop
+        # if the queue is full, the oldest message is dropped
+        self.publish_queue = deque(maxlen=queue_size)
+        self.publish_event = threading.Event()
+        self.publish_thread = None
+        self.publish_dropped = 0
+
+        # paho is optional, import it only when the MQTT interface is used
+        try:
+            import paho.mqtt.client as mqtt
+        except ImportError:
+            logger.warning("MQTT IF: paho-mqtt is not installed, MQTT is disabled")
+            self.client = None
+            return
+
         self.client = mqtt.Client(client_id=client_id)
 
         if username and password:
             self.client.username_pw_set(username, password)
 
-
-        self.cellVoltages = [0] * 16
-        self.cellVoltTs = [0] * 16
-
         # Attach callbacks
         self.client.on_connect = self._on_connect
         self.client.on_disconnect = self._on_disconnect
         self.client.on_message = self._on_message
+
+    def set_cell_topics(self, prefixes, cell_count):
+        """
+        Map the cell voltage topics of the NEEY balancers to the cells and size the arrays from the cell count.
+        The cells are distributed evenly over the balancers, the first balancer measures the first cells.
+        """
+        prefixes = prefixes if len(prefixes) > 0 else ["battery_monitoring/sensor/neey_cell_voltage_"]
+        cells_per_balancer = -(-cell_count // len(prefixes))
+        self.cell_topics = {}
+        for balancer, prefix in enumerate(prefixes):
+            for cell in range(cells_per_balancer):
+                idx = balancer * cells_per_balancer + cell
+                if idx < cell_count:
+                    self.cell_topics[f"{prefix}{cell + 1:02d}/state"] = idx
+        self.cellVoltages = [0] * cell_count
+        self.cellVoltTs = [0] * cell_count
+        self.isSubscribed = False
+
     def getMqttEna(self):
         return self.enaMqtt
         
@@ -65,9 +105,16 @@ class MQTTHandler:
     # --------------------
     def connect(self):
         """Connect to MQTT broker and start network loop."""
+        if self.client is None:
+            return False
+
         self.client.connect(self.broker, self.port, self.keepalive)
         self.client.loop_start()
 
+        if self.publish_thread is None:
+            self.publish_thread = threading.Thread(target=self._publish_loop, name="Thread-MQTT-Publish", daemon=True)
+            self.publish_thread.start()
+
         # Optional: wait for connection
         timeout = 1
         start = time.time()
@@ -78,6 +125,8 @@ class MQTTHandler:
 
     def disconnect(self):
         """Disconnect cleanly from broker."""
+        if self.client is None:
+            return
         self.client.loop_stop()
         self.client.disconnect()
         self.isSubscribed = False
@@ -87,7 +136,7 @@ class MQTTHandler:
         return self._connected
     
     def reconnect(self):
-        if self.is_connected() == False:
+        if self.client is not None and self.is_connected() == False:
             logger.error("MQTT IF: reconnect needed!")
             self.connect()
 
@@ -96,6 +145,8 @@ class MQTTHandler:
     # --------------------
     def subscribe(self, topic):
         """Subscribe to a topic."""
+        if self.client is None:
+            return
         self.client.subscribe(topic)
         logger.info("MQTT subscribed to: " + topic)
         #self.isSubscribed = True
@@ -108,10 +159,26 @@ class MQTTHandler:
         self.isSubscribed = subsc
 
     def publish(self, topic, payload, qos=0, retain=False):
-        """Publish a message."""
-        if not self._connected:
-            raise RuntimeError("MQTT client not connected")
-        self.client.publish(topic, payload, qos=qos, retain=retain)
+        """Queue a message, it's sent by the publish thread. Does not block."""
+        if self.client is None:
+            return
+        if len(self.publish_queue) == self.publish_queue.maxlen:
+            self.publish_dropped += 1
+            logger.debug(f"MQTT IF: publish queue full, dropped oldest message ({self.publish_dropped} in total)")
+        self.publish_queue.append((topic, payload, qos, retain))
+        self.publish_event.set()
+
+    def _publish_loop(self):
+        """Send the queued messages, while the client is connected."""
+        while True:
+            self.publish_event.wait()
+            self.publish_event.clear()
+            while self.publish_queue and self._connected:
+                topic, payload, qos, retain = self.publish_queue.popleft()
+                try:
+                    self.client.publish(topic, payload, qos=qos, retain=retain)
+                except Exception as e:
+                    logger.error(f"MQTT IF: publish to {topic} failed: {e}")
 
     def get_topics(self):
         """Return list of subscribed topics."""
@@ -125,6 +192,8 @@ class MQTTHandler:
             self.isSubscribed = False
             logger.info("MQTT IF Connected to broker")
             self._connected = True
+            # send the messages queued while disconnected
+            self.publish_event.set()
             # for subscription in self.topics:
             #     logger.info("MQTT subscribe to topic: " + subscription)
         else:
@@ -142,8 +211,7 @@ class MQTTHandler:
             self.enaMqtt = int(msg.payload.decode())
         else:
             try:
-                splitted = msg.topic.split("_")
-                idx = int(splitted[-1].replace("/state",""))-1
+                idx = self.cell_topics[msg.topic]
                 payload_str = msg.payload.decode()
                 self.cellVoltages[idx] = float(payload_str)
                 self.cellVoltTs[idx] = time.time()
@@ -152,57 +220,60 @@ class MQTTHandler:
                 logger.error("MQTT IF: error parsing topic: " + msg.topic)
                 logger.error("MQTT IF: with payload: " + str(msg.payload))
 
-class FilterPT1:
-    def __init__(self, tau, T_s):
-        # tau = time-constant of the filter (higher = slower response, smaller = faster response)
-        # Ts = constant sample time of measurments
-        self.K = 1
-        self.tau = tau
-        self.T_s = T_s
-        self.a = 1 - T_s / (tau + T_s)
-        self.b = self.K * T_s / (tau + T_s)
-        self.prev_y = 0.0  # Previous output
-
-    def update(self, u):
-        """Update the PT1 filter with the new input u."""
-        y = self.a * self.prev_y + self.b * u
-        self.prev_y = y
-        return y
-    
-class FilterFloatingAvg:
-    def __init__(self, num_elements,initVal = 0.0):
+class CellVoltageFusion:
+    def __init__(self, cell_count, resistance, max_age=5, min_voltage=2.25, max_voltage=3.65):
         """
-        Initialize the floating average filter.
-        
+        Fuse the cell voltages of the BMS and of the NEEY balancers (received via MQTT).
+        Voltages, timestamps and the compensation are held in arrays sized from the cell count
+        and are processed for all cells in one pass.
+
         Parameters:
-        - num_elements: The number of elements over which to average.
+        - cell_count: The number of cells.
+        - resistance: Additional resistance of the cell connections in Ohm, missing cells are 0.
+        - max_age: Maximum age of a MQTT cell voltage in seconds.
+        - min_voltage, max_voltage: Valid range of a MQTT cell voltage.
+        """
+        self.cell_count = cell_count
+        self.resistance = array("d", (list(resistance) + [0.0] * cell_count)[:cell_count])
+        self.max_age = max_age
+        self.min_voltage = min_voltage
+        self.max_voltage = max_voltage
+        self.bms_filter = FilterFloatingAvg(8, cell_count, 3.3)
+        self.mqtt_filter = FilterFloatingAvg(10, cell_count, 3.3)
+        self.mqtt_voltages = array("d", [0.0] * cell_count)  # last valid MQTT cell voltages
+        self.stale = []  # cells with a too old MQTT cell voltage
+        self.out_of_range = []  # cells with a MQTT cell voltage out of range
+
+    def fuse_bms(self, raw, current):
         """
-        self.num_elements = num_elements
-        self.buffer = [initVal] * num_elements  # Circular buffer for input values
-        self.index = 0  # Current index in the buffer
-        self.total = initVal * num_elements  # Running total of buffer values
+        Filter the cell voltages of the BMS and compensate the voltage drop of the cell connections.
+        Returns the filtered values, the compensation and the cell voltages.
+        """
+        filtered = list(self.bms_filter.update(raw))
+        compensation = [-resistance * current for resistance in self.resistance]
+        return filtered, compensation, [flt + comp for flt, comp in zip(filtered, compensation)]
 
-    def update(self, new_value):
+    def validate_mqtt(self, voltages, timestamps, now):
         """
-        Update the filter with a new input value and return the average.
-        
-        Parameters:
-        - new_value: The new input value.
-        
-        Returns:
-        - The current average of the filter.
+        Check the MQTT cell voltages for staleness and range and keep the voltages in range.
+        Returns True, if all MQTT cell voltages are valid.
         """
-        # Subtract the value that's being overwritten from the total
-        self.total -= self.buffer[self.index]
-        # Add the new value to the total
-        self.total += new_value
-        # Update the buffer with the new value
-        self.buffer[self.index] = new_value
-        # Move to the next index (circularly)
-        self.index = (self.index + 1) % self.num_elements
-        # Return the average
-        return self.total / self.num_elements
-    
+        limit = now - self.max_age
+        self.stale = [c for c, ts in enumerate(timestamps) if ts < limit]
+        in_range = [self.min_voltage < voltage < self.max_voltage for voltage in voltages]
+        self.out_of_range = [c for c, valid in enumerate(in_range) if not valid]
+        self.mqtt_voltages = array("d", [new if valid else old for new, valid, old in zip(voltages, in_range, self.mqtt_voltages)])
+        return len(self.stale) == 0 and len(self.out_of_range) == 0
+
+    def fuse_mqtt(self, current):
+        """
+        Filter the MQTT cell voltages and compensate the voltage drop of the cell connections.
+        Returns the cell voltages.
+        """
+        filtered = self.mqtt_filter.update(self.mqtt_voltages)
+        return [flt - resistance * current for flt, resistance in zip(filtered, self.resistance)]
+
+
 # Protocol registers
 REG_ENTER_FACTORY = 0x00
 REG_EXIT_FACTORY = 0x01
@@ -363,16 +434,9 @@ FUNC_GPS_EN = 0x0100  # bit 8
 FUNC_BUZZER_EN = 0x0200  # bit 9
 
 
-def checksum(payload):
-    return (0x10000 - sum(payload)) % 0x10000
-
-
 def cmd(op, reg, data):
-    payload = [reg, len(data)] + list(data)
-    chksum = checksum(payload)
-    data = [0xDD, op] + payload + [chksum, 0x77]
-    format = f">BB{len(payload)}BHB"
-    return struct.pack(format, *data)
+    payload = bytes((reg, len(data))) + bytes(data)
+    return pack(">BB", 0xDD, op) + payload + pack(">HB", checksum16(payload), 0x77)
 
 
 def readCmd(reg, data=None):
@@ -433,9 +497,12 @@ class LltJbd(Battery):
         self.trigger_force_disable_charge = None
         self.trigger_disable_balancer = None
         self.cycle_capacity = None
-        logger.info("debugLog: init mqtt")
-        self.mqtt = MQTTHandler(MQTT_SERVER)
-        logger.info("debugLog: mqtt init done.")
+        # the MQTT handler imports paho and starts a publish thread, create it only if it's used
+        self.mqtt = None
+        if CELL_VOLT_FROM_MQTT:
+            logger.info("debugLog: init mqtt")
+            self.mqtt = MQTTHandler(MQTT_SERVER)
+            logger.info("debugLog: mqtt init done.")
         self.additionalResistance = [0,0,0,0,0,0,0,0,0.0023,0,0,0,0,0,0,0.001] #added for additional resistance resulting from battery pack configuration
         self.mqttAdditionalResistance = [0,0,0,0,0,0,0,0,0.0026,0,0,0,0,0,0,0.001]
         # list of available callbacks, in order to display the buttons in the GUI
@@ -446,12 +513,11 @@ class LltJbd(Battery):
             "disable_cvl_callback",
             "soc_from_bms_callback",
         ]
-        self.cellVoltFilters = []
-        self.mqttCellVoltFilters = []
-        self.mqttCellVoltages = [0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0]
+        self.cell_voltage_fusion = None
         self.mqttCellVoltValid = False
         self.mqttCellVoltValidZ1 = False
         self.useMqttIf = True
+        self.mqtt_publish_last = 0
         logger.info("debugLog: lltjbd init done")
         
         
@@ -472,7 +538,7 @@ class LltJbd(Battery):
         """
         result = False
         try:
-            if CELL_VOLT_FROM_MQTT:
+            if self.mqtt is not None:
                 logger.info("connect MQTT interface for cell voltages!")
                 # for i in range(16):
                 #         cellNr = i + 1
@@ -868,120 +934,104 @@ class LltJbd(Battery):
         return True
 
     def read_cell_data(self):
-        totalVoltage = 0
-        if len(self.cellVoltFilters) == 0:
-            for c in range(self.cell_count):
-                self.cellVoltFilters.append(FilterFloatingAvg(8,3.3))
-                self.mqttCellVoltFilters.append(FilterFloatingAvg(10,3.3))
-
         cell_data = self.read_serial_data_llt(self.command_cell)
         # check if connect success
         if cell_data is False or len(cell_data) < self.cell_count * 2:
             return False
 
-        for c in range(self.cell_count):
-            try:
-                cell_volts = unpack_from(">H", cell_data, c * 2)
-                if len(cell_volts) != 0:
-                    
-                    comp = -(self.additionalResistance[c] * self.current)
-                    self.mqtt.publish("lltjbd/cells/cellVoltCurComp_" + str(c),comp)
-
-                    tmpVolt = cell_volts[0] / 1000 
-                    self.mqtt.publish("lltjbd/cells/cellVoltRaw_" + str(c),tmpVolt)
-
-                    flt = self.cellVoltFilters[c].update(tmpVolt)
-                    self.mqtt.publish("lltjbd/cells/cellVoltFilt_" + str(c),flt)
-
-                    self.cells[c].voltage = flt + comp
-                    self.mqtt.publish("lltjbd/cells/cellVolt_" + str(c),self.cells[c].voltage)
-                    totalVoltage = totalVoltage + self.cells[c].voltage
-            # except struct.error:
-            #     self.cells[c].voltage = 0
-            except Exception:
-                self.cells[c].voltage = 0
-                totalVoltage = 0
-                (
-                    exception_type,
-                    exception_object,
-                    exception_traceback,
-                ) = sys.exc_info()
-                file = exception_traceback.tb_frame.f_code.co_filename
-                line = exception_traceback.tb_lineno
-                logger.error(f"MQTT Exception occurred: {repr(exception_object)} of type {exception_type} in {file} line #{line}")
-
-
-
-        if CELL_VOLT_FROM_MQTT:
+        # init the fusion stage once and again, if the cell count changed
+        if self.cell_voltage_fusion is None or self.cell_voltage_fusion.cell_count != self.cell_count:
+            self.cell_voltage_fusion = CellVoltageFusion(self.cell_count, self.additionalResistance)
+            if self.mqtt is not None:
+                self.mqtt.set_cell_topics(MQTT_CELL_VOLTAGE_TOPICS, self.cell_count)
+
+        fusion = self.cell_voltage_fusion
+        current = self.current if self.current is not None else 0
+
+        # all cell voltages of the BMS in mV
+        raw = [voltage / 1000 for voltage in unpack_from(">" + str(self.cell_count) + "H", cell_data)]
+        filtered, compensation, voltages = fusion.fuse_bms(raw, current)
+        self.cells.set_voltages(voltages, False)
+        totalVoltage = sum(voltages)
+
+        # values of this cycle, published as one JSON message
+        mqtt_state = {
+            "cellVoltCurComp": compensation,
+            "cellVoltRaw": raw,
+            "cellVoltFilt": filtered,
+            "cellVolt": voltages,
+        }
+
+        if self.mqtt is not None:
             
             if self.mqtt.is_connected() == True: # check if mqtt is general available
-                self.mqtt.publish("lltjbd/alive",True)
+                mqtt_state["alive"] = True
                 if self.mqtt.is_subsribed() == False:
-                    for i in range(self.cell_count):
-                        cellNr = i + 1
-                        if cellNr < 10:
-                            cellNrStr = "0" + str(cellNr)
-                        else:
-                            cellNrStr = str(cellNr)
-                        self.mqtt.subscribe("battery_monitoring/sensor/neey_cell_voltage_" + cellNrStr + "/state")
+                    for topic in self.mqtt.cell_topics:
+                        self.mqtt.subscribe(topic)
                     self.mqtt.set_subsribed(True)
                     self.mqtt.subscribe("lltjbd/ena")
-                self.mqttCellVoltValid = True
 
                 self.useMqttIf = self.mqtt.getMqttEna()
                 if self.useMqttIf:
-                    
-                    for c in range(self.cell_count):
-                        voltage, ts = self.mqtt.getCellVoltage(c)
-                        if ts < time.time() - 5:
-                            self.mqttCellVoltValid = False
-                            logger.debug("mqtt cell voltage ts invalid for cell " + str(c))
-                        if voltage > 2.25 and voltage < 3.65:
-                            self.mqttCellVoltages[c] = voltage
-                        else:
-                            self.mqttCellVoltValid = False
-                            logger.debug("mqtt cell voltage out of range for cell " + str(c) + ": " + str(voltage))
-                    
+                    self.mqttCellVoltValid = fusion.validate_mqtt(self.mqtt.cellVoltages, self.mqtt.cellVoltTs, time.time())
+                    if fusion.stale:
+                        logger.debug("mqtt cell voltage ts invalid for cells %s", fusion.stale)
+                    if fusion.out_of_range:
+                        logger.debug("mqtt cell voltage out of range for cells %s", fusion.out_of_range)
+
                     if self.mqttCellVoltValid == True:
-                        totalVoltage = 0
-                        for c in range(self.cell_count):
-                            # write cell vontalge including compensation for cell connection 8-9. (the long one...)
-                            self.cells[c].voltage = self.mqttCellVoltFilters[c].update(self.mqttCellVoltages[c]) - (self.additionalResistance[c] * self.current)
-                            totalVoltage = totalVoltage + self.cells[c].voltage
+                        # write cell voltages including compensation for cell connection 8-9. (the long one...)
+                        voltages = fusion.fuse_mqtt(current)
+                        self.cells.set_voltages(voltages, False)
+                        totalVoltage = sum(voltages)
+                else:
+                    self.mqttCellVoltValid = True
 
                 # if self.mqttCellVoltValidZ1 != self.mqttCellVoltValid:
                 #     if self.mqttCellVoltValid == True:
                 #         logger.info("mqtt cell voltages valid again")
                 #     elif self.mqttCellVoltValid == False:
                 #         logger.error("mqtt cell voltages invalid")
-                try:
-                    self.mqttCellVoltValidZ1 = self.mqttCellVoltValid
-                    self.mqtt.publish("lltjbd/mqttCellVoltages",json.dumps(self.mqtt.cellVoltages))
-                    self.mqtt.publish("lltjbd/cellVoltTs",json.dumps(self.mqtt.cellVoltTs))
-                    self.mqtt.publish("lltjbd/mqttCellVoltValid",json.dumps(self.mqttCellVoltValid))
-                    self.mqtt.publish("lltjbd/current",self.current)
-                    self.mqtt.publish("lltjbd/soc_bms",self.soc)
-                    self.mqtt.publish("lltjbd/soc_calc",self.soc_calc)
-                    self.mqtt.publish("lltjbd/bat_voltage",totalVoltage)
-                    if totalVoltage > 0:
-                        self.voltage = totalVoltage
-                    self.mqtt.publish("lltjbd/additionalResistance",json.dumps(self.additionalResistance))
-                except Exception:
-                    (
-                        exception_type,
-                        exception_object,
-                        exception_traceback,
-                    ) = sys.exc_info()
-                    file = exception_traceback.tb_frame.f_code.co_filename
-                    line = exception_traceback.tb_lineno
-                    logger.error(f"MQTT Exception occurred: {repr(exception_object)} of type {exception_type} in {file} line #{line}")
-                
-
-                logger.debug("mqtt cell voltages: " + str(self.mqttCellVoltages))
-                logger.debug("mqtt cell voltages valid: " + str(self.mqttCellVoltValid))
+                self.mqttCellVoltValidZ1 = self.mqttCellVoltValid
+                mqtt_state["mqttCellVoltages"] = self.mqtt.cellVoltages
+                mqtt_state["cellVoltTs"] = self.mqtt.cellVoltTs
+                mqtt_state["mqttCellVoltValid"] = self.mqttCellVoltValid
+                mqtt_state["current"] = self.current
+                mqtt_state["soc_bms"] = self.soc
+                mqtt_state["soc_calc"] = self.soc_calc
+                mqtt_state["bat_voltage"] = totalVoltage
+                if totalVoltage > 0:
+                    self.voltage = totalVoltage
+                mqtt_state["additionalResistance"] = list(fusion.resistance)
+
+                logger.debug("mqtt cell voltages: %s", fusion.mqtt_voltages)
+                logger.debug("mqtt cell voltages valid: %s", self.mqttCellVoltValid)
+
+        self.publish_mqtt_state(mqtt_state)
 
         return True
 
+    def publish_mqtt_state(self, mqtt_state):
+        """
+        Publish the values of a cycle as one JSON message, at most every MQTT_PUBLISH_INTERVAL seconds.
+        """
+        if self.mqtt is None or not self.mqtt.is_connected() or time.time() - self.mqtt_publish_last < MQTT_PUBLISH_INTERVAL:
+            return
+        self.mqtt_publish_last = time.time()
+
+        try:
+            self.mqtt.publish("lltjbd/state", json.dumps(mqtt_state))
+        except Exception:
+            (
+                exception_type,
+                exception_object,
+                exception_traceback,
+            ) = sys.exc_info()
+            file = exception_traceback.tb_frame.f_code.co_filename
+            line = exception_traceback.tb_lineno
+            logger.error(f"MQTT Exception occurred: {repr(exception_object)} of type {exception_type} in {file} line #{line}")
+
     def read_hardware_data(self):
         hardware_data = self.read_serial_data_llt(self.command_hardware)
         # check if connection success
@@ -1013,7 +1063,7 @@ class LltJbd(Battery):
         if end != 0x77:
             logger.error(">>> ERROR: Incorrect Reply. Expected end packet character 0x77")
             return False
-        if chk_sum != checksum(data[2:-3]):
+        if chk_sum != checksum16(data, 2, len(data) - 3):
             logger.error(">>> ERROR: Invalid checksum.")
             return False
 
@@ -1,7 +1,7 @@
 # -*- coding: utf-8 -*-
 
 from battery import Battery, Cell
-from utils import bytearray_to_string, read_serial_data, unpack_from, logger
+from utils import bytearray_to_string, crc16_modbus, read_serial_data, unpack_from, verify_crc16_modbus, logger
 from struct import unpack
 import struct
 import sys
@@ -15,6 +15,11 @@ class Renogy(Battery):
         # The RBT100LFP12SH-G1 uses 0xF7, another battery uses 0x30
         self.address = address
 
+        # reads executed by refresh_data(), grouped by how fast the data changes
+        self.add_poll_read("fast", self.read_soc_data)
+        self.add_poll_read("fast", self.read_cell_data)
+        self.add_poll_read("medium", self.read_temp_data)
+
     BATTERYTYPE = "Renogy"
     LENGTH_CHECK = 4
     LENGTH_POS = 2
@@ -86,11 +91,8 @@ class Renogy(Battery):
         # call all functions that will refresh the battery data.
         # This will be called for every iteration (1 second)
         # Return True if success, False for failure
-        result = self.read_soc_data()
-        result = result and self.read_cell_data()
-        result = result and self.read_temp_data()
-
-        return result
+        # read the data, which is due in its poll group
+        return self.refresh_poll_reads()
 
     def read_gen_data(self):
         model = self.read_serial_data_renogy(self.command_model)
@@ -210,23 +212,11 @@ class Renogy(Battery):
     def read_bms_config(self):
         return True
 
-    def calc_crc(self, data):
-        crc = 0xFFFF
-        for pos in data:
-            crc ^= pos
-            for i in range(8):
-                if (crc & 1) != 0:
-                    crc >>= 1
-                    crc ^= 0xA001
-                else:
-                    crc >>= 1
-        return struct.pack("<H", crc)
-
     def generate_command(self, command):
         buffer = bytearray(self.address)
         buffer += self.command_read
         buffer += command
-        buffer += self.calc_crc(buffer)
+        buffer += struct.pack("<H", crc16_modbus(buffer))
 
         return buffer
 
@@ -243,7 +233,10 @@ class Renogy(Battery):
             return False
 
         start, flag, length = unpack_from("BBB", data)
-        # checksum = unpack_from(">H", data, length + 3)
+
+        if not verify_crc16_modbus(data, length + 3):
+            logger.error(">>> ERROR: Incorrect CRC")
+            return False
 
         if flag == 3:
             return data[3 : length + 3]
@@ -5,8 +5,7 @@
 # https://github.com/Louisvdw/dbus-serialbattery/pull/530
 
 from battery import Protection, Battery, Cell
-from utils import logger
-import serial
+from utils import checksum16, lenid, open_serial_port, verify_checksum16_ascii, logger
 import sys
 
 
@@ -17,6 +16,10 @@ class Seplos(Battery):
         self.type = self.BATTERYTYPE
         self.poll_interval = 5000
 
+        # reads executed by refresh_data(), grouped by how fast the data changes
+        self.add_poll_read("fast", self.read_status_data)
+        self.add_poll_read("medium", self.read_alarm_data)
+
     BATTERYTYPE = "Seplos"
 
     COMMAND_STATUS = 0x42
@@ -40,45 +43,20 @@ class Seplos(Battery):
             signed=signed,
         )
 
-    @staticmethod
-    def get_checksum(frame: bytes) -> int:
-        """implements the Seplos checksum algorithm, returns 4 bytes"""
-        checksum = 0
-        for b in frame:
-            checksum += b
-        checksum %= 0xFFFF
-        checksum ^= 0xFFFF
-        checksum += 1
-        return checksum
-
-    @staticmethod
-    def get_info_length(info: bytes) -> int:
-        """implements the Seplos checksum for the info length"""
-        lenid = len(info)
-        if lenid == 0:
-            return 0
-
-        lchksum = (lenid & 0xF) + ((lenid >> 4) & 0xF) + ((lenid >> 8) & 0xF)
-        lchksum %= 16
-        lchksum ^= 0xF
-        lchksum += 1
-
-        return (lchksum << 12) + lenid
-
     @staticmethod
     def encode_cmd(address: bytes, cid2: int, info: bytes = b"") -> bytes:
         """encodes a command sent to a battery (cid1=0x46)"""
         try:
             cid1 = 0x46
 
-            info_length = Seplos.get_info_length(info)
+            info_length = lenid(len(info))
 
             address_int = int.from_bytes(address, byteorder="big")
 
             frame = "{:02X}{:02X}{:02X}{:02X}{:04X}".format(0x20, address_int, cid1, cid2, info_length).encode()
             frame += info
 
-            checksum = Seplos.get_checksum(frame)
+            checksum = checksum16(frame)
             encoded = b"~" + frame + "{:04X}".format(checksum).encode() + b"\r"
             return encoded
         except Exception:
@@ -143,10 +121,8 @@ class Seplos(Battery):
         # call all functions that will refresh the battery data.
         # This will be called for every iteration (self.poll_interval)
         # Return True if success, False for failure
-        result_status = self.read_status_data()
-        result_alarm = self.read_alarm_data()
-
-        return result_status and result_alarm
+        # read the data, which is due in its poll group
+        return self.refresh_poll_reads()
 
     @staticmethod
     def decode_alarm_byte(data_byte: int, alarm_bit: int, warn_bit: int):
@@ -259,8 +235,7 @@ class Seplos(Battery):
             logger.debug("short read, data={}".format(data))
             return False
 
-        chksum = Seplos.get_checksum(data[1:-5])
-        if chksum != Seplos.int_from_2byte_hex_ascii(data, -5):
+        if not verify_checksum16_ascii(data):
             logger.warning("checksum error")
             return False
 
@@ -274,7 +249,10 @@ class Seplos(Battery):
     def read_serial_data_seplos(self, command):
         logger.debug("read serial data seplos")
 
-        with serial.Serial(self.port, baudrate=self.baud_rate, timeout=1) as ser:
+        with open_serial_port(self.port, self.baud_rate, timeout=1) as ser:
+            if ser is None:
+                return False
+
             ser.flushOutput()
             ser.flushInput()
             written = ser.write(command)
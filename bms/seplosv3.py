@@ -10,8 +10,9 @@ from typing import Union
 
 import ext.minimalmodbus as minimalmodbus
 import serial
-from battery import Battery, Cell, Protection
+from battery import Battery, Cell
 from utils import logger, SEPLOS_USE_BMS_VALUES
+import utils
 
 RETRYCNT = 3
 
@@ -29,6 +30,16 @@ class Seplosv3(Battery):
             self.slaveaddress: int = 0
             self.slaveaddresses = list(range(16))
 
+        # reads executed by refresh_data(), grouped by how fast the data changes
+        # the system parameters hold the cell count, capacity and limits, which change only if the user changes them
+        # the FET states are read immediately, if the BMS reports a changed alarm
+        alarms_fet = ["high_voltage", "low_voltage", "high_charge_current", "high_discharge_current", "high_charge_temp", "low_charge_temp", "low_soc"]
+        self.add_poll_read("slow", self.read_sysinfo)
+        self.add_poll_read("fast", self.read_pack_info)
+        self.add_poll_read("fast", self.read_cells)
+        self.add_poll_read("medium", self.read_system_control, alarms_fet)
+        self.add_poll_read("fast", self.read_alarms)
+
     @staticmethod
     def to_signed_int(value: int) -> int:
         """
@@ -49,20 +60,20 @@ class Seplosv3(Battery):
         else:
             minimalmodbus._SLAVEADDRESS_BROADCAST = 0
 
+        # use the pooled serial port instead of opening and closing the port on each call
+        ser = utils.get_serial_port(self.port, 19200, 0.4, parity=serial.PARITY_NONE, stopbits=serial.STOPBITS_ONE)
+
         if self.mbdev is not None and slaveaddress == self.slaveaddress:
             return self.mbdev
 
+        minimalmodbus._serialports[self.port] = ser
         mbdev = minimalmodbus.Instrument(
             self.port,
             slaveaddress=slaveaddress,
             mode="rtu",
-            close_port_after_each_call=True,
+            close_port_after_each_call=False,
             debug=False,
         )
-        mbdev.serial.parity = minimalmodbus.serial.PARITY_NONE
-        mbdev.serial.stopbits = serial.STOPBITS_ONE
-        mbdev.serial.baudrate = 19200
-        mbdev.serial.timeout = 0.4
         return mbdev
 
     def test_connection(self):
@@ -142,25 +153,44 @@ class Seplosv3(Battery):
         self.load_connected = True
         return True
 
-    def read_device_date(self):
-        spa, pia, pib, sca, pic, sfa = None, None, None, None, None, None
+    def read_registers(self, name: str, registeraddress: int, number_of_registers: int) -> Union[list, None]:
+        try:
+            data = self.get_modbus(self.slaveaddress).read_registers(registeraddress=registeraddress, number_of_registers=number_of_registers, functioncode=4)
+            logger.debug(f"{name}: {data}")
+            return data
+        except Exception as e:
+            logger.info(f"Error getting data {e}")
+            return None
+
+    def read_bits(self, name: str, registeraddress: int, number_of_bits: int) -> Union[list, None]:
         try:
-            mb = self.get_modbus(self.slaveaddress)
-            spa = mb.read_registers(registeraddress=0x1300, number_of_registers=0x6A, functioncode=4)
-            pia = mb.read_registers(registeraddress=0x1000, number_of_registers=0x12, functioncode=4)
-            pib = mb.read_registers(registeraddress=0x1100, number_of_registers=0x1A, functioncode=4)
-            sca = mb.read_registers(registeraddress=0x1500, number_of_registers=0x04, functioncode=4)
-            pic = mb.read_bits(0x1200, number_of_bits=0x90, functioncode=1)
-            sfa = mb.read_bits(0x1400, number_of_bits=0x50, functioncode=1)
-            logger.debug(f"spa: {spa}")
-            logger.debug(f"pia: {pia}")
-            logger.debug(f"pib: {pib}")
-            logger.debug(f"sca: {sca}")
-            logger.debug(f"sfa: {sfa}")
-            logger.debug(f"pic: {pic}")
+            data = self.get_modbus(self.slaveaddress).read_bits(registeraddress, number_of_bits=number_of_bits, functioncode=1)
+            logger.debug(f"{name}: {data}")
+            return data
         except Exception as e:
             logger.info(f"Error getting data {e}")
-        return spa, pia, pib, sca, pic, sfa
+            return None
+
+    def read_sysinfo(self) -> bool:
+        spa = self.read_registers("spa", 0x1300, 0x6A)
+        return spa is not None and self.update_sysinfo(spa)
+
+    def read_pack_info(self) -> bool:
+        pia = self.read_registers("pia", 0x1000, 0x12)
+        return pia is not None and self.update_pack_info(pia)
+
+    def read_cells(self) -> bool:
+        pib = self.read_registers("pib", 0x1100, 0x1A)
+        return pib is not None and self.update_cells(pib)
+
+    def read_system_control(self) -> bool:
+        sca = self.read_registers("sca", 0x1500, 0x04)
+        pic = self.read_bits("pic", 0x1200, 0x90)
+        return sca is not None and pic is not None and self.update_system_control(pic, sca)
+
+    def read_alarms(self) -> bool:
+        sfa = self.read_bits("sfa", 0x1400, 0x50)
+        return sfa is not None and self.update_alarms(sfa)
 
     def update_cells(self, pib) -> bool:
         try:
@@ -218,7 +248,7 @@ class Seplosv3(Battery):
 
     def update_alarms(self, sfa) -> bool:
         try:
-            self.protection = Protection()
+            # the cell imbalance is set by update_system_control(), which is read less often
             #   ALARM = 2 , WARNING = 1 , OK = 0
             self.protection.high_voltage = 2 if sfa[0x05] == 0 else 1 if sfa[0x04] == 0 else 0
             self.protection.low_voltage = 2 if sfa[0x06] == 0 else 1 if sfa[0x06] == 0 else 0
@@ -253,37 +283,9 @@ class Seplosv3(Battery):
         # call all functions that will refresh the battery data.
         # This will be called for every iteration (1 second)
         # Return True if success, False for failure
-        spa, pia, pib, sca, pic, sfa = self.read_device_date()
-        results = []
-        if spa is None:
-            results.append(False)
-        else:
-            results.append(self.update_sysinfo(spa))
-
-        if pia is None:
-            results.append(False)
-        else:
-            results.append(self.update_pack_info(pia))
-
-        if pib is None:
-            results.append(False)
-        else:
-            results.append(self.update_cells(pib))
-
-        if sca is None or pic is None:
-            results.append(False)
-        else:
-            results.append(self.update_system_control(pic, sca))
-            pass
-
-        if sfa is None:
-            results.append(False)
-        else:
-            results.append(self.update_alarms(sfa))
-
-        for result in results:
-            if result is False:
-                logger.info(f"Updating Seplos v3 {self.hardware_version} {self.serialnumber} failed: {results}")
-                return False
+        # read the data, which is due in its poll group
+        if not self.refresh_poll_reads():
+            logger.info(f"Updating Seplos v3 {self.hardware_version} {self.serialnumber} failed")
+            return False
         logger.debug(f"Updating Seplos v3 {self.hardware_version} {self.serialnumber}")
         return True
@@ -5,8 +5,10 @@
 # https://github.com/Louisvdw/dbus-serialbattery/commit/7aab4c850a5c8d9c205efefc155fe62bb527da8e
 
 from battery import Battery, Cell
-from utils import kelvin_to_celsius, read_serial_data, logger
+from utils import crc8_smbus, kelvin_to_celsius, open_serial_port, read_serial_data, read_serialport_bytes, read_serialport_data, sum8, logger
 from struct import unpack_from
+from time import monotonic
+import logging
 import sys
 
 
@@ -15,6 +17,13 @@ class Sinowealth(Battery):
         super(Sinowealth, self).__init__(port, baud, address)
         self.poll_interval = 2000
         self.type = self.BATTERYTYPE
+        # the cell voltages are read in one burst, after a failed burst the next one is tried after a backoff
+        self.burst_failures = 0
+        self.burst_retry_time = 0
+        # checksum algorithm of the replies, None until detected, False if no algorithm matches
+        self.reply_check = None
+        self.reply_check_candidates = list(self.REPLY_CHECKS)
+        self.reply_check_replies = 0
 
     # command bytes [StartFlag=0A][Command byte][response dataLength=2 to 20 bytes][checksum]
     command_base = b"\x0A\x00\x04"
@@ -37,6 +46,25 @@ class Sinowealth(Battery):
     BATTERYTYPE = "Sinowealth"
     LENGTH_CHECK = 0
     LENGTH_POS = 0
+    # every reply has 4 data bytes and 1 checksum byte
+    LENGTH_REPLY = 5
+    # number of replies, that have to match a checksum algorithm, before it is used
+    REPLY_CHECK_MIN_REPLIES = 3
+    # seconds until a burst is tried again after the first failure, doubled with each consecutive failure
+    BURST_BACKOFF = 60
+    BURST_BACKOFF_MAX = 3600
+    # possible checksum algorithms of the replies, since the chip family is not known.
+    # The replies have no register id, therefore the burst read is only used, if the checksum can be verified.
+    REPLY_CHECKS = (
+        # SMBus PEC over the data bytes
+        lambda register, reply: crc8_smbus(reply, 0, 4),
+        # SMBus PEC over the register and the data bytes
+        lambda register, reply: crc8_smbus(reply, 0, 4, crc8_smbus(bytes((register,)))),
+        # SMBus PEC over the whole SMBus read transaction of the battery address 0x0B
+        lambda register, reply: crc8_smbus(reply, 0, 4, crc8_smbus(bytes((0x16, register, 0x17)))),
+        # 8 bit sum of the data bytes
+        lambda register, reply: sum8(reply, 0, 4),
+    )
 
     def test_connection(self):
         """
@@ -215,19 +243,96 @@ class Sinowealth(Battery):
         if self.cell_count is None:
             self.read_pack_config_data()
 
-        for c in range(self.cell_count):
-            self.cells[c].voltage = self.read_cell_voltage(c + 1)
+        try:
+            with open_serial_port(self.port, self.baud_rate) as ser:
+                if ser is None:
+                    return False
+                voltages = self.read_cell_voltages(ser)
+        except Exception:
+            (
+                exception_type,
+                exception_object,
+                exception_traceback,
+            ) = sys.exc_info()
+            file = exception_traceback.tb_frame.f_code.co_filename
+            line = exception_traceback.tb_lineno
+            logger.error(f"Exception occurred: {repr(exception_object)} of type {exception_type} in {file} line #{line}")
+            return False
+
+        self.cells.set_voltages(voltages)
+
+        if logger.isEnabledFor(logging.DEBUG):
+            for c, cell_voltage in enumerate(voltages):
+                logger.debug(">>> INFO: Cell %u voltage: %s V", c + 1, cell_voltage)
         return True
 
-    def read_cell_voltage(self, cell_index):
-        cell_data = self.read_serial_data_sinowealth(cell_index.to_bytes(1, byteorder="little"))
-        if cell_data is False:
-            return None
-        cell_voltage = unpack_from(">H", cell_data[:-1])
-        cell_voltage = cell_voltage[0] / 1000
+    def read_cell_voltages(self, ser):
+        """
+        The BMS has no block read for the cell voltages, therefore all cell requests are sent as one burst
+        and the fixed size replies are read in one go, if the checksum of the replies is known.
+        If the reply of the burst is incomplete or invalid, the cells are requested one by one on the already
+        opened port and the burst is tried again after a backoff, which grows with each consecutive failure.
+        If the checksum is unknown, the cells are always requested one by one.
+        """
+        if self.reply_check and monotonic() >= self.burst_retry_time:
+            commands = bytearray()
+            for c in range(self.cell_count):
+                commands += self.generate_command((c + 1).to_bytes(1, byteorder="little"))
+
+            ser.flushOutput()
+            ser.flushInput()
+            ser.write(commands)
+            data = read_serialport_bytes(ser, self.cell_count * self.LENGTH_REPLY, monotonic() + 1.0)
+            replies = [data[c * self.LENGTH_REPLY : (c + 1) * self.LENGTH_REPLY] for c in range(self.cell_count)]
+
+            if len(data) == self.cell_count * self.LENGTH_REPLY and all(self.reply_check(c + 1, reply) == reply[4] for c, reply in enumerate(replies)):
+                self.burst_failures = 0
+                return [unpack_from(">H", reply)[0] / 1000 for reply in replies]
+
+            # do not try again on every poll, a BMS that does not answer a burst would slow down every poll
+            backoff = min(self.BURST_BACKOFF * 2**self.burst_failures, self.BURST_BACKOFF_MAX)
+            self.burst_failures += 1
+            self.burst_retry_time = monotonic() + backoff
+            logger.info(">>> INFO: Invalid cell voltage burst reply [len:%u], requesting cells one by one for %u s", len(data), backoff)
+            # late replies of the burst would be read as the reply of the wrong cell
+            self.drain_serial_port(ser)
+
+        voltages = []
+        for c in range(self.cell_count):
+            command = self.generate_command((c + 1).to_bytes(1, byteorder="little"))
+            cell_data = read_serialport_data(ser, command, self.LENGTH_POS, self.LENGTH_CHECK, int(command[2]))
+            if cell_data is not False:
+                self.detect_reply_check(command[1], cell_data)
+            voltages.append(None if cell_data is False else unpack_from(">H", cell_data)[0] / 1000)
+        return voltages
+
+    def drain_serial_port(self, ser, quiet_time=0.05, timeout=1.0):
+        """
+        Read and discard received bytes until the port was idle for quiet_time or the timeout is reached.
+        """
+        deadline = monotonic() + timeout
+        while monotonic() < deadline:
+            if len(read_serialport_bytes(ser, 64, min(monotonic() + quiet_time, deadline))) == 0:
+                break
+
+    def detect_reply_check(self, register, reply):
+        """
+        Detect the checksum algorithm of the replies from the first single replies.
+        An algorithm is used, when it matched all replies and at least REPLY_CHECK_MIN_REPLIES replies.
+        If no algorithm matches, the replies can not be verified and the burst read is not used.
+        """
+        if self.reply_check is not None or len(reply) < self.LENGTH_REPLY:
+            return
+
+        self.reply_check_candidates = [check for check in self.reply_check_candidates if check(register, reply) == reply[4]]
+        self.reply_check_replies += 1
 
-        logger.debug(">>> INFO: Cell %u voltage: %f V", cell_index, cell_voltage)
-        return cell_voltage
+        if len(self.reply_check_candidates) == 0:
+            self.reply_check = False
+            logger.debug(">>> INFO: Unknown reply checksum, cell voltages are requested one by one")
+        elif self.reply_check_replies >= self.REPLY_CHECK_MIN_REPLIES:
+            self.reply_check = self.reply_check_candidates[0]
+            logger.debug(">>> INFO: Reply checksum detected, cell voltages are requested in one burst")
 
     def read_temperature_data(self):
         if self.temp_sensors is None:
@@ -290,4 +395,5 @@ class Sinowealth(Battery):
         if data is False:
             return False
 
+        self.detect_reply_check(command[0], data)
         return bytearray(data)
@@ -6,7 +6,11 @@ from time import sleep
 from datetime import datetime
 from dbus.mainloop.glib import DBusGMainLoop
 
+import importlib
+import signal
 import sys
+import threading
+import traceback
 
 from gi.repository import GLib as gobject
 
@@ -16,66 +20,60 @@ import utils
 from battery import Battery
 import math
 
-# import battery classes
-from bms.daly import Daly
-from bms.daren_485 import Daren485
-from bms.ecs import Ecs
-from bms.eg4_lifepower import EG4_Lifepower
-from bms.eg4_ll import EG4_LL
-from bms.heltecmodbus import HeltecModbus
-from bms.hlpdatabms4s import HLPdataBMS4S
-from bms.jkbms import Jkbms
-from bms.jkbms_pb import Jkbms_pb
-from bms.lltjbd import LltJbd
-from bms.renogy import Renogy
-from bms.seplos import Seplos
-from bms.seplosv3 import Seplosv3
-
-
-# enabled only if explicitly set in config under "BMS_TYPE"
-if "ANT" in utils.BMS_TYPE:
-    from bms.ant import ANT
-if "MNB" in utils.BMS_TYPE:
-    from bms.mnb import MNB
-if "Sinowealth" in utils.BMS_TYPE:
-    from bms.sinowealth import Sinowealth
-if "FelicityEss" in utils.BMS_TYPE:
-    from bms.felicity_ess import FelicityEss
-
+# registry of the battery classes
+# the modules are imported only when a BMS type is tested, see get_bms_class()
 supported_bms_types = [
-    {"bms": Daly, "baud": 9600, "address": b"\x40"},
-    {"bms": Daly, "baud": 9600, "address": b"\x80"},
-    {"bms": Daren485, "baud": 19200, "address": b"\x01"},
-    {"bms": Ecs, "baud": 19200},
-    {"bms": EG4_Lifepower, "baud": 9600, "address": b"\x01"},
-    {"bms": EG4_LL, "baud": 9600, "address": b"\x01"},
-    {"bms": HeltecModbus, "baud": 9600, "address": b"\x01"},
-    {"bms": HLPdataBMS4S, "baud": 9600},
-    {"bms": Jkbms, "baud": 115200},
-    {"bms": Jkbms_pb, "baud": 115200, "address": b"\x01"},
-    {"bms": LltJbd, "baud": 9600, "address": b"\x00"},
-    {"bms": Renogy, "baud": 9600, "address": b"\x30"},
-    {"bms": Renogy, "baud": 9600, "address": b"\xF7"},
-    {"bms": Seplos, "baud": 19200, "address": b"\x00"},
-    {"bms": Seplosv3, "baud": 19200},
+    {"bms": "Daly", "module": "bms.daly", "baud": 9600, "address": b"\x40"},
+    {"bms": "Daly", "module": "bms.daly", "baud": 9600, "address": b"\x80"},
+    {"bms": "Daren485", "module": "bms.daren_485", "baud": 19200, "address": b"\x01"},
+    {"bms": "Ecs", "module": "bms.ecs", "baud": 19200},
+    {"bms": "EG4_Lifepower", "module": "bms.eg4_lifepower", "baud": 9600, "address": b"\x01"},
+    {"bms": "EG4_LL", "module": "bms.eg4_ll", "baud": 9600, "address": b"\x01"},
+    {"bms": "HeltecModbus", "module": "bms.heltecmodbus", "baud": 9600, "address": b"\x01"},
+    {"bms": "HLPdataBMS4S", "module": "bms.hlpdatabms4s", "baud": 9600},
+    {"bms": "Jkbms", "module": "bms.jkbms", "baud": 115200},
+    {"bms": "Jkbms_pb", "module": "bms.jkbms_pb", "baud": 115200, "address": b"\x01"},
+    {"bms": "LltJbd", "module": "bms.lltjbd", "baud": 9600, "address": b"\x00"},
+    {"bms": "Renogy", "module": "bms.renogy", "baud": 9600, "address": b"\x30"},
+    {"bms": "Renogy", "module": "bms.renogy", "baud": 9600, "address": b"\xF7"},
+    {"bms": "Seplos", "module": "bms.seplos", "baud": 19200, "address": b"\x00"},
+    {"bms": "Seplosv3", "module": "bms.seplosv3", "baud": 19200},
 ]
 
 # enabled only if explicitly set in config under "BMS_TYPE"
 if "ANT" in utils.BMS_TYPE:
-    supported_bms_types.append({"bms": ANT, "baud": 19200})
+    supported_bms_types.append({"bms": "ANT", "module": "bms.ant", "baud": 19200})
 if "MNB" in utils.BMS_TYPE:
-    supported_bms_types.append({"bms": MNB, "baud": 9600})
+    supported_bms_types.append({"bms": "MNB", "module": "bms.mnb", "baud": 9600})
 if "Sinowealth" in utils.BMS_TYPE:
-    supported_bms_types.append({"bms": Sinowealth, "baud": 9600})
+    supported_bms_types.append({"bms": "Sinowealth", "module": "bms.sinowealth", "baud": 9600})
 if "FelicityEss" in utils.BMS_TYPE:
-    supported_bms_types.append({"bms": FelicityEss, "baud": 9600})
+    supported_bms_types.append({"bms": "FelicityEss", "module": "bms.felicity_ess", "baud": 9600})
 
-expected_bms_types = [battery_type for battery_type in supported_bms_types if battery_type["bms"].__name__ in utils.BMS_TYPE or len(utils.BMS_TYPE) == 0]
+expected_bms_types = [battery_type for battery_type in supported_bms_types if battery_type["bms"] in utils.BMS_TYPE or len(utils.BMS_TYPE) == 0]
 
 logger.info("")
 logger.info("Starting dbus-serialbattery")
 
 
+bms_classes = {}
+"""
+Imported battery classes by BMS type
+"""
+
+
+def get_bms_class(bms_type: dict) -> type:
+    """
+    Imports the module of a BMS type on first use and returns its battery class.
+
+    :param bms_type: The BMS type from `supported_bms_types`
+    :return: The battery class
+    """
+    if bms_type["bms"] not in bms_classes:
+        bms_classes[bms_type["bms"]] = getattr(importlib.import_module(bms_type["module"]), bms_type["bms"])
+    return bms_classes[bms_type["bms"]]
+
+
 # count loops
 count_for_loops = 5
 delayed_loop_count = 0
@@ -92,8 +90,6 @@ def main():
         :param loop: The main event loop
         :return: Always returns True
         """
-        global count_for_loops, delayed_loop_count
-
         # count execution time in milliseconds
         start = datetime.now()
 
@@ -101,6 +97,63 @@ def main():
             helper[key_address].publish_battery(loop)
 
         runtime = (datetime.now() - start).total_seconds()
+        check_poll_runtime(runtime)
+
+        return True
+
+    def poll_batteries(loop) -> None:
+        """
+        Polls all batteries on the port in a worker thread, since the port can only be used by one battery at a time.
+        The data of a battery is handed to the main loop, which publishes it on the dbus and calculates CVL/CCL/SOC
+        while the next battery is read.
+
+        :param loop: The main event loop
+        :return: None
+        """
+        # set, if the last data of the battery was published and the battery can be read again
+        published = {}
+        for key_address in battery:
+            published[key_address] = threading.Event()
+            published[key_address].set()
+
+        def publish_battery(key_address, result: bool) -> bool:
+            helper[key_address].publish_battery(loop, result)
+            published[key_address].set()
+            return False
+
+        runtime = 0
+        while True:
+            sleep(max(battery[first_key].poll_interval / 1000 - runtime, 0))
+
+            # count execution time in milliseconds
+            start = datetime.now()
+
+            for key_address in battery:
+                published[key_address].wait()
+                published[key_address].clear()
+
+                try:
+                    with utils.get_serial_port_lock(battery[key_address].port):
+                        result = battery[key_address].refresh_data()
+                except Exception:
+                    traceback.print_exc()
+                    gobject.idle_add(loop.quit)
+                    return
+
+                gobject.idle_add(publish_battery, key_address, bool(result))
+
+            runtime = (datetime.now() - start).total_seconds()
+            check_poll_runtime(runtime)
+
+    def check_poll_runtime(runtime: float) -> None:
+        """
+        Checks if polling took too long and increases the poll interval, if it happens for several loops.
+
+        :param runtime: The time polling took in seconds
+        :return: None
+        """
+        global count_for_loops, delayed_loop_count
+
         logger.debug(f"Polling data took {runtime:.3f} seconds")
 
         # check if polling took too long and adjust poll interval, but only after 5 loops
@@ -125,7 +178,41 @@ def main():
 
             delayed_loop_count = 0
 
-        return True
+    def get_probe_candidates(_port: str, _modbus_address: hex = None) -> list:
+        """
+        Returns the BMS types to test in the order they should be tested.
+        The BMS, which was detected last time on this port, is tested first. The others are grouped by baud rate,
+        starting with the baud rate of the last detected BMS, so that the shared serial port has to be
+        reconfigured as few times as possible.
+
+        :param _port: The port to connect to.
+        :param _modbus_address: The Modbus address to connect to (optional).
+        :return: The list of BMS types to test.
+        """
+        candidates = list(expected_bms_types)
+        fingerprint = utils.load_detection_fingerprint(utils.get_detection_key(_port, _modbus_address))
+        first_baud = None
+
+        if fingerprint is not None:
+            for test in candidates:
+                if (
+                    test["bms"] == fingerprint["bms"]
+                    and test.get("baud") == fingerprint.get("baud")
+                    and (_modbus_address is not None or (test["address"].hex() if "address" in test else None) == fingerprint.get("address"))
+                ):
+                    logger.info("-- Testing last detected BMS " + fingerprint["bms"] + " first")
+                    candidates.remove(test)
+                    candidates.insert(0, test)
+                    first_baud = test.get("baud")
+                    break
+
+        # sort is stable, so the order within a baud rate group is kept
+        candidates[1 if first_baud is not None else 0 :] = sorted(
+            candidates[1 if first_baud is not None else 0 :],
+            key=lambda test: (test.get("baud") != first_baud, test.get("baud") or 0),
+        )
+
+        return candidates
 
     def get_battery(_port: str, _modbus_address: hex = None) -> Union[Battery, None]:
         """
@@ -135,13 +222,15 @@ def main():
         :param _modbus_address: The Modbus address to connect to (optional).
         :return: The battery object if a connection is established, otherwise None.
         """
+        candidates = get_probe_candidates(_port, _modbus_address)
+
         # Try to establish communications with the battery 3 times, else exit
         retry = 1
         retries = 3
         while retry <= retries:
             logger.info("-- Testing BMS: " + str(retry) + " of " + str(retries) + " rounds")
             # Create a new battery object that can read the battery and run connection test
-            for test in expected_bms_types:
+            for test in candidates:
                 # noinspection PyBroadException
                 try:
                     if _modbus_address is not None:
@@ -154,16 +243,26 @@ def main():
 
                     logger.info(
                         "Testing "
-                        + test["bms"].__name__
+                        + test["bms"]
                         + (' at address "' + utils.bytearray_to_string(_bms_address) + '"' if _bms_address is not None else "")
                     )
-                    batteryClass = test["bms"]
+                    batteryClass = get_bms_class(test)
                     baud = test["baud"] if "baud" in test else None
-                    
+
                     battery: Battery = batteryClass(port=_port, baud=baud, address=_bms_address)
 
                     if battery.test_connection() and battery.validate_data():
                         logger.info("-- Connection established to " + battery.__class__.__name__)
+                        fingerprint = {
+                            "bms": batteryClass.__name__,
+                            "address": _bms_address.hex() if _bms_address is not None and _modbus_address is None else None,
+                            "baud": baud,
+                        }
+                        # keep the device instance, if the same BMS was detected again
+                        fingerprint_saved = utils.load_detection_fingerprint(utils.get_detection_key(_port, _modbus_address))
+                        if fingerprint_saved is not None and all(fingerprint_saved.get(key) == value for key, value in fingerprint.items()):
+                            fingerprint = fingerprint_saved
+                        utils.save_detection_fingerprint(utils.get_detection_key(_port, _modbus_address), fingerprint)
                         return battery
                 except KeyboardInterrupt:
                     return None
@@ -229,10 +328,10 @@ def main():
 
         if len(bms_types) > 0:
             for bms_type in bms_types:
-                if bms_type not in [bms["bms"].__name__ for bms in supported_bms_types]:
+                if bms_type not in [bms["bms"] for bms in supported_bms_types]:
                     logger.error(
                         f'ERROR >>> BMS type "{bms_type}" is not supported. Supported BMS types are: '
-                        + f"{', '.join([bms['bms'].__name__ for bms in supported_bms_types])}"
+                        + f"{', '.join([bms['bms'] for bms in supported_bms_types])}"
                         + "; Disabled by default: ANT, MNB, Sinowealth"
                     )
                     sys.exit(1)
@@ -286,23 +385,20 @@ def main():
     # CAN
     elif port.startswith("can") or port.startswith("vecan"):
         """
-        Import CAN classes only if it's a CAN port; otherwise, the driver won't start due to missing Python modules.
+        CAN classes are imported only if it's a CAN port; otherwise, the driver won't start due to missing Python modules.
         This prevents issues when using the driver exclusively with a serial connection.
         """
-        from bms.daly_can import Daly_Can
-        from bms.jkbms_can import Jkbms_Can
-
         # only try CAN BMS on CAN port
         supported_bms_types = [
-            {"bms": Daly_Can},
-            {"bms": Jkbms_Can},
+            {"bms": "Daly_Can", "module": "bms.daly_can"},
+            {"bms": "Jkbms_Can", "module": "bms.jkbms_can"},
         ]
 
         # check if utils.BMS_TYPE is not empty and all BMS types in the list are supported
         check_bms_types(supported_bms_types, "can")
 
         expected_bms_types = [
-            battery_type for battery_type in supported_bms_types if battery_type["bms"].__name__ in utils.BMS_TYPE or len(utils.BMS_TYPE) == 0
+            battery_type for battery_type in supported_bms_types if battery_type["bms"] in utils.BMS_TYPE or len(utils.BMS_TYPE) == 0
         ]
 
         battery[0] = get_battery(port)
@@ -312,9 +408,11 @@ def main():
         # check if utils.BMS_TYPE is not empty and all BMS types in the list are supported
         check_bms_types(supported_bms_types, "serial")
 
-        # wait some seconds to be sure that the serial connection is ready
+        # wait until the serial connection is ready (at most 16 seconds)
         # else the error throw a lot of timeouts
-        sleep(16)
+        # use the baud rate of the last detected BMS, so that the port has not to be reconfigured
+        fingerprint = utils.load_detection_fingerprint(utils.get_detection_key(port))
+        utils.wait_serial_port_ready(port, fingerprint["baud"] if fingerprint is not None and fingerprint.get("baud") else 9600)
 
         # check if MODBUS_ADDRESSES is not empty
         if utils.MODBUS_ADDRESSES:
@@ -374,11 +472,11 @@ def main():
 
         logger.info(f"Polling interval: {battery[first_key].poll_interval/1000:.3f} s")
 
-        # if not possible, poll the battery every poll_interval milliseconds
-        gobject.timeout_add(
-            battery[first_key].poll_interval,
-            lambda: poll_battery(mainloop),
-        )
+        # if not possible, poll the batteries every poll_interval milliseconds in a worker thread
+        # and publish the data in the main loop, the thread is started right before the main loop
+        poll_thread = threading.Thread(target=poll_batteries, args=(mainloop,), daemon=True)
+    else:
+        poll_thread = None
 
     # print log at this point, else not all data is correctly populated
     for key_address in battery:
@@ -396,12 +494,30 @@ def main():
         for key_address in battery:
             battery[key_address].setup_external_current_sensor()
 
+    # start polling only after the settings are logged and validated
+    if poll_thread is not None:
+        poll_thread.start()
+
+    # stop the main loop on SIGTERM (e.g. svc -d, pkill) and SIGINT,
+    # so that the battery states, which were not saved yet, are written below
+    def stop_mainloop(signal_name: str) -> bool:
+        logger.info(f"Received {signal_name}, stopping the driver")
+        mainloop.quit()
+        return False
+
+    for signal_number, signal_name in ((signal.SIGTERM, "SIGTERM"), (signal.SIGINT, "SIGINT")):
+        gobject.unix_signal_add(gobject.PRIORITY_HIGH, signal_number, stop_mainloop, signal_name)
+
     # Run the main loop
     try:
         mainloop.run()
     except KeyboardInterrupt:
         pass
 
+    # write the battery states, which were not saved yet
+    for key_address in helper:
+        helper[key_address].save_current_battery_state(True)
+
 
 if __name__ == "__main__":
     main()
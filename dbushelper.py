@@ -4,12 +4,15 @@ import os
 import platform
 import dbus
 import traceback
-from time import sleep, time
+from time import monotonic, sleep, time
 from utils import logger, publish_config_variables
 import utils
 from xml.etree import ElementTree
 import requests
 import threading
+from fnmatch import fnmatchcase
+from functools import lru_cache
+from typing import Union
 
 # add path to velib_python
 sys.path.insert(1, os.path.join(os.path.dirname(__file__), "ext", "velib_python"))
@@ -32,12 +35,167 @@ def get_bus() -> dbus.bus.BusConnection:
     return SessionBus() if "DBUS_SESSION_BUS_ADDRESS" in os.environ else SystemBus()
 
 
+DBUS_DEADBANDS = {
+    "/Dc/0/Voltage": 0.01,
+    "/Dc/0/Current": 0.01,
+    "/Dc/0/Power": 1,
+    "/CurrentAvg": 0.01,
+    "/System/MinCellVoltage": 0.001,
+    "/System/MaxCellVoltage": 0.001,
+    "/Voltages/Cell*": 0.001,
+    "/Cell/*/Volts": 0.001,
+}
+"""
+Minimum change of a value, before it's published again on the dbus. The key is a path pattern
+"""
+
+
+@lru_cache(maxsize=None)
+def get_dbus_deadband(path: str) -> Union[float, None]:
+    """
+    Get the deadband of a dbus path.
+
+    :param path: The dbus path
+    :return: The deadband or None, if every change is published
+    """
+    for pattern, deadband in DBUS_DEADBANDS.items():
+        if fnmatchcase(path, pattern):
+            return deadband
+    return None
+
+
+class DbusDeadbandContext:
+    """
+    Wraps the context of a VeDbusService, which collects the changed values and publishes them
+    in a single ItemsChanged signal. Values, which changed less than the deadband of their path
+    since they were published last, are skipped.
+    """
+
+    def __init__(self, service_context):
+        self.service_context = service_context
+
+    def __contains__(self, path):
+        return path in self.service_context
+
+    def __getitem__(self, path):
+        return self.service_context[path]
+
+    def add_path(self, path, value, *args, **kwargs):
+        self.service_context.add_path(path, value, *args, **kwargs)
+
+    def __setitem__(self, path, value):
+        deadband = get_dbus_deadband(path)
+        if deadband is not None and isinstance(value, (int, float)):
+            published = self.service_context[path]
+            if isinstance(published, (int, float)) and round(abs(value - published), 6) < deadband:
+                return
+
+        self.service_context[path] = value
+
+
+class DbusSettingsCache:
+    """
+    Caches the values of a settings service like com.victronenergy.settings.
+    All values are read with a single GetItems call on the root path and kept up to date
+    through the ItemsChanged and PropertiesChanged signals of the service.
+    """
+
+    def __init__(self, service: str):
+        self.service = service
+        self.bus = get_bus()
+        self.values: Union[dict, None] = None
+        """
+        Values of the service by path, None if the values could not be read
+        """
+
+        self.refresh_time: Union[float, None] = None
+        """
+        Monotonic time of the last successful GetItems call, None if the values were never read
+        """
+
+        self.bus.add_signal_receiver(
+            self.items_changed,
+            signal_name="ItemsChanged",
+            dbus_interface="com.victronenergy.BusItem",
+            bus_name=service,
+            path="/",
+        )
+        self.bus.add_signal_receiver(
+            self.properties_changed,
+            signal_name="PropertiesChanged",
+            dbus_interface="com.victronenergy.BusItem",
+            bus_name=service,
+            path_keyword="path",
+        )
+        self.refresh()
+
+    def refresh(self, max_age: float = 0) -> bool:
+        """
+        Read all values of the service with a single GetItems call.
+
+        :param max_age: skip the call, if the values were read less than `max_age` seconds ago
+        :return: False if the service does not support GetItems or is not available, else True
+        """
+        if self.refresh_time is not None and monotonic() - self.refresh_time < max_age:
+            return True
+
+        try:
+            items = self.bus.call_blocking(self.service, "/", "com.victronenergy.BusItem", "GetItems", "", [])
+        except dbus.exceptions.DBusException as e:
+            logger.debug(f"DbusSettingsCache: GetItems on {self.service} failed: {e}")
+            self.values = None
+            return False
+
+        self.values = {str(path): item["Value"] for path, item in items.items() if "Value" in item}
+        self.refresh_time = monotonic()
+        return True
+
+    def items_changed(self, changes) -> None:
+        if self.values is not None:
+            for path, item in changes.items():
+                if "Value" in item:
+                    self.values[str(path)] = item["Value"]
+
+    def properties_changed(self, changes, path=None) -> None:
+        if self.values is not None and path is not None and "Value" in changes:
+            self.values[str(path)] = changes["Value"]
+
+    def get_values(self, object_path: str) -> Union[dict, None]:
+        """
+        Get all values below a path.
+
+        :param object_path: The path, e.g. "/Settings/Devices"
+        :return: The values by path or None, if the values are not cached
+        """
+        if self.values is None:
+            return None
+
+        prefix = object_path.rstrip("/") + "/"
+        return {path: value for path, value in self.values.items() if path == object_path or path.startswith(prefix)}
+
+
+settings_caches: dict = {}
+"""
+Settings caches by service name, shared by all batteries of this driver instance
+"""
+
+
+def get_settings_cache(service: str) -> DbusSettingsCache:
+    if service not in settings_caches:
+        settings_caches[service] = DbusSettingsCache(service)
+    return settings_caches[service]
+
+
 class DbusHelper:
     """
     This class is used to handle all the dbus communication.
     """
 
     EMPTY_DICT = {}
+    # walk over all devices in the settings at least every x seconds, to remove old entries
+    DEVICES_CLEANUP_INTERVAL = 60 * 60 * 24
+    # settings read less than x seconds ago are not read again, when a refresh is requested
+    SETTINGS_CACHE_MAX_AGE = 2
 
     def __init__(self, battery, bms_address=None):
         self.battery = battery
@@ -58,12 +216,20 @@ class DbusHelper:
             for c in self.battery.unique_identifier()
         )
         self.path_battery = None
+        self.detection_key = utils.get_detection_key(self.battery.port, bms_address if bms_address is not None and bms_address != 0 else None)
+        """
+        Key of the battery in the BMS detection cache
+        """
         self.save_charge_details_last = {
             "allow_max_voltage": self.battery.allow_max_voltage,
             "max_voltage_start_time": self.battery.max_voltage_start_time,
             "soc_reset_last_reached": self.battery.soc_reset_last_reached,
             "soc_calc": (self.battery.soc_calc if self.battery.soc_calc is not None else ""),
         }
+        self.save_charge_details_pending: dict = {}
+        self.save_charge_details_time: int = 0
+        self.settings_bus = None
+        self.settings_objects: dict = {}
         self.telemetry_upload_error_count: int = 0
         self.telemetry_upload_interval: int = 60 * 60 * 24 * 7  # 1 week
         self.telemetry_upload_last: int = 0
@@ -159,12 +325,38 @@ class DbusHelper:
         self.settings = SettingsDevice(get_bus(), self.EMPTY_DICT, self.handle_changed_setting)
         logger.debug("setup_instance(): SettingsDevice")
 
+        # if the BMS was detected from the cache and its device instance is known,
+        # read only the settings of this battery and skip the cleanup of the other devices,
+        # but walk over all devices at least once a day to remove old entries
+        fingerprint = utils.load_detection_fingerprint(self.detection_key)
+        settings_from_dbus = None
+        devices_cleanup = int(time())
+        if (
+            fingerprint is not None
+            and fingerprint.get("unique_identifier") == self.bms_id
+            and fingerprint.get("instance") is not None
+            and int(time()) - fingerprint.get("devices_cleanup", 0) < self.DEVICES_CLEANUP_INTERVAL
+        ):
+            devices_cleanup = fingerprint["devices_cleanup"]
+            settings_from_dbus = self.get_settings_with_values(
+                get_bus(),
+                "com.victronenergy.settings",
+                self.path_battery,
+            )
+            if "UniqueIdentifier" not in settings_from_dbus.get("Settings", {}).get("Devices", {}).get("serialbattery_" + str(self.bms_id), {}):
+                logger.debug("setup_instance(): battery not found in the settings, read all devices")
+                settings_from_dbus = None
+                devices_cleanup = int(time())
+
         # get all the settings from the dbus
-        settings_from_dbus = self.get_settings_with_values(
-            get_bus(),
-            "com.victronenergy.settings",
-            "/Settings/Devices",
-        )
+        # read the values again, since other driver instances could have added their settings meanwhile
+        if settings_from_dbus is None:
+            settings_from_dbus = self.get_settings_with_values(
+                get_bus(),
+                "com.victronenergy.settings",
+                "/Settings/Devices",
+                refresh=True,
+            )
         logger.debug("setup_instance(): get_settings_with_values")
         # output:
         # {
@@ -387,6 +579,13 @@ class DbusHelper:
         self.battery.role, self.instance = self.get_role_instance()
         logger.info(f"Use DeviceInstance: {self.instance}")
 
+        # save the device instance in the BMS detection cache for the next start
+        if fingerprint is not None:
+            utils.save_detection_fingerprint(
+                self.detection_key,
+                {**fingerprint, "unique_identifier": self.bms_id, "instance": self.instance, "devices_cleanup": devices_cleanup},
+            )
+
         logger.debug(f"Found DeviceInstances: {device_instances_used}")
 
         # create pid file
@@ -446,6 +645,13 @@ class DbusHelper:
 
         self._dbusservice.add_path("/State", self.battery.state, writeable=True)
         self._dbusservice.add_path("/ErrorCode", self.battery.error_code, writeable=True)
+        self._dbusservice.add_path("/Errors/Total", 0, writeable=True)
+        self._dbusservice.add_path(
+            "/Errors/Rate",
+            None,
+            writeable=True,
+            gettextcallback=lambda p, v: "{:0.1f}/h".format(v),
+        )
         self._dbusservice.add_path("/ConnectionInformation", "")
 
         # Create static battery info
@@ -700,12 +906,17 @@ class DbusHelper:
 
         return True
 
-    def publish_battery(self, loop):
+    def publish_battery(self, loop, result: Union[bool, None] = None):
         # This is called every battery.poll_interval milli second as set up per battery type to read and update the data
+        # result is the return value of refresh_data(), if the battery was already read by the poll worker
         try:
             # Call the battery's refresh_data function
-            result = self.battery.refresh_data()
+            if result is None:
+                result = self.battery.refresh_data()
             if result:
+                # filter the readings, before they are used for the calculations
+                self.battery.apply_filters()
+
                 # reset error variables
                 self.error["count"] = 0
                 self.battery.online = True
@@ -823,128 +1034,140 @@ class DbusHelper:
             loop.quit()
 
     def publish_dbus(self):
+        # collect the changed values and publish them in a single ItemsChanged signal
+        with self._dbusservice as dbusservice:
+            self.publish_dbus_values(DbusDeadbandContext(dbusservice))
+
+    def publish_dbus_values(self, dbusservice):
         # Update SOC, DC and System items
-        self._dbusservice["/System/NrOfCellsPerBattery"] = self.battery.cell_count
+        dbusservice["/System/NrOfCellsPerBattery"] = self.battery.cell_count
         if utils.SOC_CALCULATION:
-            self._dbusservice["/Soc"] = round(self.battery.soc_calc, 2) if self.battery.soc_calc is not None else None
+            dbusservice["/Soc"] = round(self.battery.soc_calc, 2) if self.battery.soc_calc is not None else None
             # add original SOC for comparing
-            self._dbusservice["/SocBms"] = round(self.battery.soc, 2) if self.battery.soc is not None else None
+            dbusservice["/SocBms"] = round(self.battery.soc, 2) if self.battery.soc is not None else None
         else:
-            self._dbusservice["/Soc"] = round(self.battery.soc, 2) if self.battery.soc is not None else None
-        self._dbusservice["/Dc/0/Voltage"] = round(self.battery.voltage, 2) if self.battery.voltage is not None else None
-        self._dbusservice["/Dc/0/Current"] = round(self.battery.get_current(), 2) if self.battery.get_current() is not None else None
-        self._dbusservice["/Dc/0/Power"] = (
-            round(self.battery.voltage * self.battery.get_current(), 2)
-            if self.battery.get_current() is not None and self.battery.get_current() is not None
-            else None
-        )
-        self._dbusservice["/Dc/0/Temperature"] = self.battery.get_temp()
-        self._dbusservice["/Capacity"] = self.battery.get_capacity_remain()
-        self._dbusservice["/ConsumedAmphours"] = (
+            dbusservice["/Soc"] = round(self.battery.soc, 2) if self.battery.soc is not None else None
+        dbusservice["/Dc/0/Voltage"] = round(self.battery.voltage, 2) if self.battery.voltage is not None else None
+        current = self.battery.get_current()
+        dbusservice["/Dc/0/Current"] = round(current, 2) if current is not None else None
+        dbusservice["/Dc/0/Power"] = round(self.battery.voltage * current, 2) if current is not None else None
+        dbusservice["/Dc/0/Temperature"] = self.battery.get_temp()
+        dbusservice["/Capacity"] = self.battery.get_capacity_remain()
+        dbusservice["/ConsumedAmphours"] = (
             None if self.battery.capacity is None or self.battery.get_capacity_remain() is None else self.battery.capacity - self.battery.get_capacity_remain()
         )
 
         midpoint, deviation = self.battery.get_midvoltage()
         if midpoint is not None:
-            self._dbusservice["/Dc/0/MidVoltage"] = midpoint
-            self._dbusservice["/Dc/0/MidVoltageDeviation"] = deviation
+            dbusservice["/Dc/0/MidVoltage"] = midpoint
+            dbusservice["/Dc/0/MidVoltageDeviation"] = deviation
 
         # Update battery extras
-        self._dbusservice["/State"] = self.battery.state
+        dbusservice["/State"] = self.battery.state
         # https://github.com/victronenergy/veutil/blob/master/inc/veutil/ve_regs_payload.h
         # https://github.com/victronenergy/veutil/blob/master/src/qt/bms_error.cpp
-        self._dbusservice["/ErrorCode"] = self.battery.error_code
-        self._dbusservice["/ConnectionInformation"] = self.battery.connection_info
-
-        self._dbusservice["/History/DeepestDischarge"] = self.battery.history.deepest_discharge
-        self._dbusservice["/History/LastDischarge"] = self.battery.history.last_discharge
-        self._dbusservice["/History/AverageDischarge"] = self.battery.history.average_discharge
-        self._dbusservice["/History/ChargeCycles"] = self.battery.history.charge_cycles
-        self._dbusservice["/History/FullDischarges"] = self.battery.history.full_discharges
-        self._dbusservice["/History/TotalAhDrawn"] = self.battery.history.total_ah_drawn
-        self._dbusservice["/History/MinimumVoltage"] = self.battery.history.minimum_voltage
-        self._dbusservice["/History/MaximumVoltage"] = self.battery.history.maximum_voltage
-        self._dbusservice["/History/MinimumCellVoltage"] = self.battery.history.minimum_cell_voltage
-        self._dbusservice["/History/MaximumCellVoltage"] = self.battery.history.maximum_cell_voltage
-        self._dbusservice["/History/TimeSinceLastFullCharge"] = self.battery.history.time_since_last_full_charge
-        self._dbusservice["/History/LowVoltageAlarms"] = self.battery.history.low_voltage_alarms
-        self._dbusservice["/History/HighVoltageAlarms"] = self.battery.history.high_voltage_alarms
-        self._dbusservice["/History/DischargedEnergy"] = self.battery.history.discharged_energy
-        self._dbusservice["/History/ChargedEnergy"] = self.battery.history.charged_energy
-
-        self._dbusservice["/Io/AllowToCharge"] = 1 if self.battery.get_allow_to_charge() else 0
-        self._dbusservice["/Io/AllowToDischarge"] = 1 if self.battery.get_allow_to_discharge() else 0
-        self._dbusservice["/Io/AllowToBalance"] = 1 if self.battery.get_allow_to_balance() else 0
+        dbusservice["/ErrorCode"] = self.battery.error_code
+
+        # Update error statistics, the paths of the error codes are added when the first error occurs
+        dbusservice["/Errors/Total"] = self.battery.error_rate.total
+        dbusservice["/Errors/Rate"] = round(self.battery.error_rate.rate(), 1) if self.battery.error_rate.count else None
+        for error_code, count in self.battery.error_rate.counters.items():
+            path = f"/Errors/Codes/{error_code}"
+            if path in dbusservice:
+                dbusservice[path] = count
+            else:
+                dbusservice.add_path(path, count, writeable=True)
+        dbusservice["/ConnectionInformation"] = self.battery.connection_info
+
+        dbusservice["/History/DeepestDischarge"] = self.battery.history.deepest_discharge
+        dbusservice["/History/LastDischarge"] = self.battery.history.last_discharge
+        dbusservice["/History/AverageDischarge"] = self.battery.history.average_discharge
+        dbusservice["/History/ChargeCycles"] = self.battery.history.charge_cycles
+        dbusservice["/History/FullDischarges"] = self.battery.history.full_discharges
+        dbusservice["/History/TotalAhDrawn"] = self.battery.history.total_ah_drawn
+        dbusservice["/History/MinimumVoltage"] = self.battery.history.minimum_voltage
+        dbusservice["/History/MaximumVoltage"] = self.battery.history.maximum_voltage
+        dbusservice["/History/MinimumCellVoltage"] = self.battery.history.minimum_cell_voltage
+        dbusservice["/History/MaximumCellVoltage"] = self.battery.history.maximum_cell_voltage
+        dbusservice["/History/TimeSinceLastFullCharge"] = self.battery.history.time_since_last_full_charge
+        dbusservice["/History/LowVoltageAlarms"] = self.battery.history.low_voltage_alarms
+        dbusservice["/History/HighVoltageAlarms"] = self.battery.history.high_voltage_alarms
+        dbusservice["/History/DischargedEnergy"] = self.battery.history.discharged_energy
+        dbusservice["/History/ChargedEnergy"] = self.battery.history.charged_energy
+
+        dbusservice["/Io/AllowToCharge"] = 1 if self.battery.get_allow_to_charge() else 0
+        dbusservice["/Io/AllowToDischarge"] = 1 if self.battery.get_allow_to_discharge() else 0
+        dbusservice["/Io/AllowToBalance"] = 1 if self.battery.get_allow_to_balance() else 0
         # Publish whether SOC should be taken from the BMS (UI switch)
-        self._dbusservice["/Io/SocFromBMS"] = 1 if self.battery.soc_from_bms_ui else 0
-        self._dbusservice["/System/NrOfModulesBlockingCharge"] = 0 if self.battery.get_allow_to_charge() else 1
-        self._dbusservice["/System/NrOfModulesBlockingDischarge"] = 0 if self.battery.get_allow_to_discharge() else 1
-        self._dbusservice["/System/NrOfModulesOnline"] = 1 if self.battery.online else 0
-        self._dbusservice["/System/NrOfModulesOffline"] = 0 if self.battery.online else 1
-        self._dbusservice["/System/MinCellTemperature"] = self.battery.get_min_temp()
-        self._dbusservice["/System/MinTemperatureCellId"] = self.battery.get_min_temp_id()
-        self._dbusservice["/System/MaxCellTemperature"] = self.battery.get_max_temp()
-        self._dbusservice["/System/MaxTemperatureCellId"] = self.battery.get_max_temp_id()
-        self._dbusservice["/System/MOSTemperature"] = self.battery.get_mos_temp()
-        self._dbusservice["/System/Temperature1"] = self.battery.temp1
-        self._dbusservice["/System/Temperature1Name"] = utils.TEMP_1_NAME
-        self._dbusservice["/System/Temperature2"] = self.battery.temp2
-        self._dbusservice["/System/Temperature2Name"] = utils.TEMP_2_NAME
-        self._dbusservice["/System/Temperature3"] = self.battery.temp3
-        self._dbusservice["/System/Temperature3Name"] = utils.TEMP_3_NAME
-        self._dbusservice["/System/Temperature4"] = self.battery.temp4
-        self._dbusservice["/System/Temperature4Name"] = utils.TEMP_4_NAME
+        dbusservice["/Io/SocFromBMS"] = 1 if self.battery.soc_from_bms_ui else 0
+        dbusservice["/System/NrOfModulesBlockingCharge"] = 0 if self.battery.get_allow_to_charge() else 1
+        dbusservice["/System/NrOfModulesBlockingDischarge"] = 0 if self.battery.get_allow_to_discharge() else 1
+        dbusservice["/System/NrOfModulesOnline"] = 1 if self.battery.online else 0
+        dbusservice["/System/NrOfModulesOffline"] = 0 if self.battery.online else 1
+        dbusservice["/System/MinCellTemperature"] = self.battery.get_min_temp()
+        dbusservice["/System/MinTemperatureCellId"] = self.battery.get_min_temp_id()
+        dbusservice["/System/MaxCellTemperature"] = self.battery.get_max_temp()
+        dbusservice["/System/MaxTemperatureCellId"] = self.battery.get_max_temp_id()
+        dbusservice["/System/MOSTemperature"] = self.battery.get_mos_temp()
+        dbusservice["/System/Temperature1"] = self.battery.temp1
+        dbusservice["/System/Temperature1Name"] = utils.TEMP_1_NAME
+        dbusservice["/System/Temperature2"] = self.battery.temp2
+        dbusservice["/System/Temperature2Name"] = utils.TEMP_2_NAME
+        dbusservice["/System/Temperature3"] = self.battery.temp3
+        dbusservice["/System/Temperature3Name"] = utils.TEMP_3_NAME
+        dbusservice["/System/Temperature4"] = self.battery.temp4
+        dbusservice["/System/Temperature4Name"] = utils.TEMP_4_NAME
 
         # Voltage control
-        self._dbusservice["/Info/MaxChargeVoltage"] = (
+        dbusservice["/Info/MaxChargeVoltage"] = (
             round(self.battery.control_voltage + utils.VOLTAGE_DROP, 2) if self.battery.control_voltage is not None else None
         )
 
         # Charge control
-        self._dbusservice["/Info/MaxChargeCurrent"] = self.battery.control_charge_current
-        self._dbusservice["/Info/MaxDischargeCurrent"] = self.battery.control_discharge_current
+        dbusservice["/Info/MaxChargeCurrent"] = self.battery.control_charge_current
+        dbusservice["/Info/MaxDischargeCurrent"] = self.battery.control_discharge_current
 
         # Voltage and charge control info (custom dbus paths)
-        self._dbusservice["/Info/ChargeMode"] = self.battery.charge_mode
-        self._dbusservice["/Info/ChargeModeDebug"] = self.battery.charge_mode_debug
-        self._dbusservice["/Info/ChargeModeDebugFloat"] = self.battery.charge_mode_debug_float
-        self._dbusservice["/Info/ChargeModeDebugBulk"] = self.battery.charge_mode_debug_bulk
-        self._dbusservice["/Info/ChargeLimitation"] = self.battery.charge_limitation
-        self._dbusservice["/Info/DischargeLimitation"] = self.battery.discharge_limitation
+        dbusservice["/Info/ChargeMode"] = self.battery.charge_mode
+        dbusservice["/Info/ChargeModeDebug"] = self.battery.charge_mode_debug
+        dbusservice["/Info/ChargeModeDebugFloat"] = self.battery.charge_mode_debug_float
+        dbusservice["/Info/ChargeModeDebugBulk"] = self.battery.charge_mode_debug_bulk
+        dbusservice["/Info/ChargeLimitation"] = self.battery.charge_limitation
+        dbusservice["/Info/DischargeLimitation"] = self.battery.discharge_limitation
 
         # Updates from cells
-        self._dbusservice["/System/MinVoltageCellId"] = self.battery.get_min_cell_desc()
-        self._dbusservice["/System/MaxVoltageCellId"] = self.battery.get_max_cell_desc()
-        self._dbusservice["/System/MinCellVoltage"] = self.battery.get_min_cell_voltage()
-        self._dbusservice["/System/MaxCellVoltage"] = self.battery.get_max_cell_voltage()
-        self._dbusservice["/Balancing"] = self.battery.get_balancing()
+        dbusservice["/System/MinVoltageCellId"] = self.battery.get_min_cell_desc()
+        dbusservice["/System/MaxVoltageCellId"] = self.battery.get_max_cell_desc()
+        dbusservice["/System/MinCellVoltage"] = self.battery.get_min_cell_voltage()
+        dbusservice["/System/MaxCellVoltage"] = self.battery.get_max_cell_voltage()
+        dbusservice["/Balancing"] = self.battery.get_balancing()
 
         # Update the alarms
-        self._dbusservice["/Alarms/LowVoltage"] = self.battery.protection.low_voltage
-        self._dbusservice["/Alarms/LowCellVoltage"] = self.battery.protection.low_cell_voltage
+        dbusservice["/Alarms/LowVoltage"] = self.battery.protection.low_voltage
+        dbusservice["/Alarms/LowCellVoltage"] = self.battery.protection.low_cell_voltage
         # disable high voltage warning temporarly, if loading to bulk voltage and bulk voltage reached is 30 minutes ago
-        self._dbusservice["/Alarms/HighVoltage"] = (
+        dbusservice["/Alarms/HighVoltage"] = (
             self.battery.protection.high_voltage
             if (self.battery.soc_reset_requested is False and self.battery.soc_reset_last_reached < int(time()) - (60 * 30))
             else 0
         )
-        self._dbusservice["/Alarms/HighCellVoltage"] = (
+        dbusservice["/Alarms/HighCellVoltage"] = (
             self.battery.protection.high_cell_voltage
             if (self.battery.soc_reset_requested is False and self.battery.soc_reset_last_reached < int(time()) - (60 * 30))
             else 0
         )
-        self._dbusservice["/Alarms/LowSoc"] = self.battery.protection.low_soc
-        self._dbusservice["/Alarms/HighChargeCurrent"] = self.battery.protection.high_charge_current
-        self._dbusservice["/Alarms/HighDischargeCurrent"] = self.battery.protection.high_discharge_current
-        self._dbusservice["/Alarms/CellImbalance"] = self.battery.protection.cell_imbalance
-        self._dbusservice["/Alarms/InternalFailure"] = self.battery.protection.internal_failure
-        self._dbusservice["/Alarms/HighChargeTemperature"] = self.battery.protection.high_charge_temp
-        self._dbusservice["/Alarms/LowChargeTemperature"] = self.battery.protection.low_charge_temp
-        self._dbusservice["/Alarms/HighTemperature"] = self.battery.protection.high_temperature
-        self._dbusservice["/Alarms/LowTemperature"] = self.battery.protection.low_temperature
-        self._dbusservice["/Alarms/BmsCable"] = 2 if self.battery.block_because_disconnect else 0
-        self._dbusservice["/Alarms/HighInternalTemperature"] = self.battery.protection.high_internal_temp
-        self._dbusservice["/Alarms/FuseBlown"] = self.battery.protection.fuse_blown
+        dbusservice["/Alarms/LowSoc"] = self.battery.protection.low_soc
+        dbusservice["/Alarms/HighChargeCurrent"] = self.battery.protection.high_charge_current
+        dbusservice["/Alarms/HighDischargeCurrent"] = self.battery.protection.high_discharge_current
+        dbusservice["/Alarms/CellImbalance"] = self.battery.protection.cell_imbalance
+        dbusservice["/Alarms/InternalFailure"] = self.battery.protection.internal_failure
+        dbusservice["/Alarms/HighChargeTemperature"] = self.battery.protection.high_charge_temp
+        dbusservice["/Alarms/LowChargeTemperature"] = self.battery.protection.low_charge_temp
+        dbusservice["/Alarms/HighTemperature"] = self.battery.protection.high_temperature
+        dbusservice["/Alarms/LowTemperature"] = self.battery.protection.low_temperature
+        dbusservice["/Alarms/BmsCable"] = 2 if self.battery.block_because_disconnect else 0
+        dbusservice["/Alarms/HighInternalTemperature"] = self.battery.protection.high_internal_temp
+        dbusservice["/Alarms/FuseBlown"] = self.battery.protection.fuse_blown
 
         # cell voltages
         if utils.BATTERY_CELL_DATA_FORMAT > 0:
@@ -953,14 +1176,14 @@ class DbusHelper:
                 for i in range(self.battery.cell_count):
                     voltage = self.battery.get_cell_voltage(i)
                     cellpath = "/Cell/%s/Volts" if (utils.BATTERY_CELL_DATA_FORMAT & 2) else "/Voltages/Cell%s"
-                    self._dbusservice[cellpath % (str(i + 1))] = voltage
+                    dbusservice[cellpath % (str(i + 1))] = voltage
                     if utils.BATTERY_CELL_DATA_FORMAT & 1:
-                        self._dbusservice["/Balances/Cell%s" % (str(i + 1))] = self.battery.get_cell_balancing(i)
+                        dbusservice["/Balances/Cell%s" % (str(i + 1))] = self.battery.get_cell_balancing(i)
                     if voltage:
                         voltage_sum += voltage
                 pathbase = "Cell" if (utils.BATTERY_CELL_DATA_FORMAT & 2) else "Voltages"
-                self._dbusservice["/%s/Sum" % pathbase] = round(voltage_sum, 2)
-                self._dbusservice["/%s/Diff" % pathbase] = round(
+                dbusservice["/%s/Sum" % pathbase] = round(voltage_sum, 2)
+                dbusservice["/%s/Diff" % pathbase] = round(
                     self.battery.get_max_cell_voltage() - self.battery.get_min_cell_voltage(),
                     3,
                 )
@@ -973,21 +1196,14 @@ class DbusHelper:
                 line = exception_traceback.tb_lineno
                 logger.error("Non blocking exception occurred: " + f"{repr(exception_object)} of type {exception_type} in {file} line #{line}")
 
-        # Calculate average current for the last 300 cycles
-        if self.battery.get_current() is not None:
-            self.battery.current_avg_lst.append(self.battery.get_current())
-            # delete oldest value
-            if len(self.battery.current_avg_lst) > 300:
-                del self.battery.current_avg_lst[0]
-
-            self.battery.current_avg = round(
-                sum(self.battery.current_avg_lst) / len(self.battery.current_avg_lst),
-                2,
-            )
+        # Calculate average current for the last CURRENT_AVG_WINDOW seconds
+        if current is not None:
+            self.battery.current_avg_window.add(current)
+            self.battery.current_avg = round(self.battery.current_avg_window.mean, 2)
         else:
             self.battery.current_avg = None
 
-        self._dbusservice["/CurrentAvg"] = self.battery.current_avg
+        dbusservice["/CurrentAvg"] = self.battery.current_avg
 
         # Update TimeToGo and/or TimeToSoC
         try:
@@ -1005,14 +1221,14 @@ class DbusHelper:
                 # Update TimeToGo item
                 if utils.TIME_TO_GO_ENABLE and percent_per_seconds is not None:
 
-                    # Get settings from dbus
+                    # Get settings from the settings cache
                     settings_battery_life = self.get_settings_with_values(
-                        get_bus(),
+                        None,
                         "com.victronenergy.settings",
                         "/Settings/CGwacs/BatteryLife",
                     )
                     settings_hub4mode = self.get_settings_with_values(
-                        get_bus(),
+                        None,
                         "com.victronenergy.settings",
                         "/Settings/CGwacs/Hub4Mode",
                     )
@@ -1055,12 +1271,12 @@ class DbusHelper:
                     )
 
                     # Check that time_to_go is not None and current is not near zero
-                    self._dbusservice["/TimeToGo"] = abs(int(time_to_go)) if time_to_go is not None and abs(self.battery.current_avg) > 0.1 else None
+                    dbusservice["/TimeToGo"] = abs(int(time_to_go)) if time_to_go is not None and abs(self.battery.current_avg) > 0.1 else None
 
                 # Update TimeToSoc items
                 if len(utils.TIME_TO_SOC_POINTS) > 0:
                     for num in utils.TIME_TO_SOC_POINTS:
-                        self._dbusservice["/TimeToSoC/" + str(num)] = self.battery.get_timeToSoc(num, percent_per_seconds) if self.battery.current_avg else None
+                        dbusservice["/TimeToSoC/" + str(num)] = self.battery.get_timeToSoc(num, percent_per_seconds) if self.battery.current_avg else None
 
         except Exception:
             # set error code, to show in the GUI that something is wrong
@@ -1071,18 +1287,38 @@ class DbusHelper:
             line = exception_traceback.tb_lineno
             logger.error("Non blocking exception occurred: " + f"{repr(exception_object)} of type {exception_type} in {file} line #{line}")
 
-        # save settings every 15 seconds to dbus
-        if int(time()) % 15:
-            self.save_current_battery_state()
+        # save the changed battery states to dbus, they are written every SAVE_BATTERY_STATE_INTERVAL seconds
+        self.save_current_battery_state()
 
         if self.battery.soc is not None:
             logger.debug("logged to dbus [%s]" % str(round(self.battery.soc, 2)))
             self.battery.log_cell_data()
 
         if self.battery.has_settings:
-            self._dbusservice["/Settings/ResetSoc"] = self.battery.reset_soc
-
-    def get_settings_with_values(self, bus, service: str, object_path: str, recursive: bool = True) -> dict:
+            dbusservice["/Settings/ResetSoc"] = self.battery.reset_soc
+
+    def get_settings_with_values(self, bus, service: str, object_path: str, recursive: bool = True, refresh: bool = False) -> dict:
+        # use the cached values of the service, if available
+        settings_cache = get_settings_cache(service)
+        # values read just before, e.g. when the cache was created by this call, are up to date
+        if refresh:
+            settings_cache.refresh(self.SETTINGS_CACHE_MAX_AGE)
+
+        values = settings_cache.get_values(object_path)
+        if values is not None:
+            if not recursive:
+                return values.get(object_path)
+
+            result = {}
+            for path, value in values.items():
+                if type(value) is not dbus.Dictionary:
+                    self.merge_dicts(result, self.create_nested_dict(path, str(value)))
+            return result
+
+        # fall back to walk the tree, if the service does not support GetItems
+        return self.get_settings_with_values_introspect(bus if bus is not None else settings_cache.bus, service, object_path, recursive)
+
+    def get_settings_with_values_introspect(self, bus, service: str, object_path: str, recursive: bool = True) -> dict:
         # print(object_path)
         obj = bus.get_object(service, object_path)
         iface = dbus.Interface(obj, "org.freedesktop.DBus.Introspectable")
@@ -1095,7 +1331,7 @@ class DbusHelper:
                     object_path = ""
                 new_path = "/".join((object_path, child.attrib["name"]))
                 # result.update(get_settings_with_values(bus, service, new_path))
-                result_sub = self.get_settings_with_values(bus, service, new_path)
+                result_sub = self.get_settings_with_values_introspect(bus, service, new_path)
                 self.merge_dicts(result, result_sub)
             elif child.tag == "interface":
                 if child.attrib["name"] == "com.victronenergy.Settings":
@@ -1185,61 +1421,120 @@ class DbusHelper:
         return value if result else None
 
     # save current battery states to dbus
-    def save_current_battery_state(self) -> bool:
+    def save_current_battery_state(self, flush: bool = False) -> bool:
+        """
+        Write the changed battery states asynchronously to the dbus settings. Changes of the calculated SoC
+        are collected and written every SAVE_BATTERY_STATE_INTERVAL seconds, the charge states immediately.
+
+        :param flush: write the changed states immediately and wait for the result, e.g. on shutdown
+        :return: False if a write failed, else True
+        """
+        states = {
+            "AllowMaxVoltage": ("allow_max_voltage", self.battery.allow_max_voltage),
+            "MaxVoltageStartTime": ("max_voltage_start_time", self.battery.max_voltage_start_time),
+            "SocCalc": ("soc_calc", self.battery.soc_calc),
+            "SocResetLastReached": ("soc_reset_last_reached", self.battery.soc_reset_last_reached),
+        }
+
+        for setting_name, (key, value) in states.items():
+            if value == self.save_charge_details_last[key]:
+                self.save_charge_details_pending.pop(setting_name, None)
+                continue
+
+            # skip small changes of the calculated SoC, the last value is written on shutdown
+            if (
+                key == "soc_calc"
+                and not flush
+                and setting_name not in self.save_charge_details_pending
+                and isinstance(value, (int, float))
+                and isinstance(self.save_charge_details_last[key], (int, float))
+                and abs(value - self.save_charge_details_last[key]) < utils.SOC_CALC_SAVE_DEADBAND
+            ):
+                continue
+
+            self.save_charge_details_pending[setting_name] = (key, value)
+
+        if len(self.save_charge_details_pending) == 0:
+            return True
+
+        # only the calculated SoC changes often, write it at most every SAVE_BATTERY_STATE_INTERVAL seconds
+        write_soc_calc = flush or self.save_charge_details_time + utils.SAVE_BATTERY_STATE_INTERVAL <= int(time())
+        pending = {setting_name: item for setting_name, item in self.save_charge_details_pending.items() if write_soc_calc or setting_name != "SocCalc"}
+        if len(pending) == 0:
+            return True
+        if write_soc_calc:
+            self.save_charge_details_time = int(time())
+
         result = True
 
-        if self.battery.allow_max_voltage != self.save_charge_details_last["allow_max_voltage"]:
-            result = result + self.set_settings(
-                get_bus(),
-                "com.victronenergy.settings",
-                self.path_battery,
-                "AllowMaxVoltage",
-                1 if self.battery.allow_max_voltage else 0,
-            )
-            logger.debug(f"Saved AllowMaxVoltage. Before {self.save_charge_details_last['allow_max_voltage']}, " + f"after {self.battery.allow_max_voltage}")
-            self.save_charge_details_last["allow_max_voltage"] = self.battery.allow_max_voltage
+        for setting_name, (key, value) in pending.items():
+            logger.debug(f"Save {setting_name}. Before {self.save_charge_details_last[key]}, after {value}")
+            self.save_charge_details_last[key] = value
 
-        if self.battery.max_voltage_start_time != self.save_charge_details_last["max_voltage_start_time"]:
-            result = result and self.set_settings(
-                get_bus(),
-                "com.victronenergy.settings",
-                self.path_battery,
-                "MaxVoltageStartTime",
-                (self.battery.max_voltage_start_time if self.battery.max_voltage_start_time is not None else ""),
-            )
-            logger.debug(
-                f"Saved MaxVoltageStartTime. Before {self.save_charge_details_last['max_voltage_start_time']}, "
-                + f"after {self.battery.max_voltage_start_time}"
-            )
-            self.save_charge_details_last["max_voltage_start_time"] = self.battery.max_voltage_start_time
+            # convert to the setting value
+            if key == "allow_max_voltage":
+                value = 1 if value else 0
+            elif key == "max_voltage_start_time" and value is None:
+                value = ""
+            elif value is None:
+                continue
 
-        if self.battery.soc_calc != self.save_charge_details_last["soc_calc"]:
-            result = result and self.set_settings(
-                get_bus(),
-                "com.victronenergy.settings",
-                self.path_battery,
-                "SocCalc",
-                self.battery.soc_calc,
-            )
-            logger.debug(f"soc_calc written to dbus: {self.battery.soc_calc}")
-            self.save_charge_details_last["soc_calc"] = self.battery.soc_calc
+            if flush:
+                result = self.set_battery_setting(setting_name, value) and result
+            else:
+                self.set_battery_setting_async(setting_name, key, self.save_charge_details_last[key], value)
 
-        if self.battery.soc_reset_last_reached != self.save_charge_details_last["soc_reset_last_reached"]:
-            result = result and self.set_settings(
-                get_bus(),
-                "com.victronenergy.settings",
-                self.path_battery,
-                "SocResetLastReached",
-                self.battery.soc_reset_last_reached,
-            )
-            logger.debug(
-                f"Saved SocResetLastReached. Before {self.save_charge_details_last['soc_reset_last_reached']}, "
-                + f"after {self.battery.soc_reset_last_reached}",
-            )
-            self.save_charge_details_last["soc_reset_last_reached"] = self.battery.soc_reset_last_reached
+        for setting_name in pending:
+            self.save_charge_details_pending.pop(setting_name, None)
 
         return result
 
+    def get_battery_setting_object(self, setting_name: str):
+        """
+        Get the proxy object of a battery setting. The proxy objects are reused for each write.
+
+        :param setting_name: name of the setting below the battery path
+        :return: the proxy object
+        """
+        if setting_name not in self.settings_objects:
+            if self.settings_bus is None:
+                self.settings_bus = get_bus()
+            self.settings_objects[setting_name] = self.settings_bus.get_object("com.victronenergy.settings", self.path_battery + "/" + setting_name)
+        return self.settings_objects[setting_name]
+
+    def set_battery_setting(self, setting_name: str, value) -> bool:
+        try:
+            obj = self.get_battery_setting_object(setting_name)
+            return True if obj.SetValue(value, dbus_interface="com.victronenergy.BusItem") == 0 else False
+        except dbus.exceptions.DBusException as e:
+            # set error code, to show in the GUI that something is wrong
+            self.battery.manage_error_code(8)
+
+            logger.error(f"Failed to set setting {setting_name}: {e}")
+            return False
+
+    def set_battery_setting_async(self, setting_name: str, key: str, state, value) -> None:
+        def error_handler(e) -> None:
+            # set error code, to show in the GUI that something is wrong
+            self.battery.manage_error_code(8)
+
+            logger.error(f"Failed to set setting {setting_name}: {e}")
+
+            # write the state again with the next save
+            if self.save_charge_details_last[key] == state:
+                self.save_charge_details_last[key] = ""
+
+        try:
+            obj = self.get_battery_setting_object(setting_name)
+            obj.SetValue(
+                value,
+                dbus_interface="com.victronenergy.BusItem",
+                reply_handler=lambda result: None,
+                error_handler=error_handler,
+            )
+        except dbus.exceptions.DBusException as e:
+            error_handler(e)
+
     def telemetry_upload(self) -> None:
         """
         Check if telemetry should be uploaded
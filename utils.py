@@ -2,12 +2,22 @@
 # Standard library imports
 import bisect
 import configparser
+import fcntl
+import json
 import logging
+import math
+import os
+import select
 import sys
+import threading
+from abc import ABC, abstractmethod
+from array import array
+from collections import deque
+from contextlib import contextmanager
 from pathlib import Path
 from struct import unpack_from
-from time import sleep
-from typing import List, Any, Callable, Union
+from time import monotonic, sleep, time
+from typing import Dict, Iterator, List, Any, Callable, Sequence, Tuple, Union
 
 # Third-party imports
 import serial
@@ -122,12 +132,73 @@ def check_config_issue(condition: bool, message: str):
         errors_in_config.append(f"**CONFIG ISSUE**: {message}")
 
 
+def parse_filter_spec(spec: str) -> Union[Tuple[str, Union[int, float]], None]:
+    """
+    Parse a filter of a filter pipeline.
+    "pt1" needs a time constant in seconds > 0, "avg" and "median" need an integer number of samples >= 1.
+
+    :param spec: The filter as "<type>:<value>"
+    :return: The filter type and value or None, if the filter is invalid
+    """
+    filter_type, _, filter_value = spec.partition(":")
+    filter_type = filter_type.strip().lower()
+    filter_value = filter_value.strip()
+    if filter_type not in FILTER_TYPES:
+        return None
+
+    if filter_type == "pt1":
+        try:
+            value = float(filter_value)
+        except ValueError:
+            return None
+        return (filter_type, value) if math.isfinite(value) and value > 0 else None
+
+    # avg and median, int() rejects fractions like "2.5"
+    try:
+        value = int(filter_value)
+    except ValueError:
+        return None
+    return (filter_type, value) if value >= 1 else None
+
+
+def check_filter_config(option: str, specs: List[str]):
+    """
+    Check the filters of a filter pipeline and append a message to the errors_in_config list for each invalid filter.
+
+    :param option: The option in the config file
+    :param specs: The filters as "<type>:<value>"
+    """
+    for spec in specs:
+        check_config_issue(
+            parse_filter_spec(spec) is None,
+            f'{option}: "{spec}" is not a valid filter. Valid filters are "pt1:<seconds>" with seconds > 0, '
+            + '"avg:<samples>" and "median:<samples>" with an integer number of samples >= 1. The filter is ignored.',
+        )
+
 
 # MQTT SETTINGS:
 CELL_VOLT_FROM_MQTT: bool = get_bool_from_config("DEFAULT", "CELL_VOLT_FROM_MQTT")
 MQTT_SERVER: str = config["DEFAULT"]["MQTT_SERVER"]
+MQTT_CELL_VOLTAGE_TOPICS: List[str] = get_list_from_config("DEFAULT", "MQTT_CELL_VOLTAGE_TOPICS", str)
+"""
+Topic prefixes of the cell voltages of the NEEY balancers, one for each balancer
+"""
+MQTT_PUBLISH_INTERVAL: float = get_float_from_config("DEFAULT", "MQTT_PUBLISH_INTERVAL")
+"""
+Publish the MQTT state at most every x seconds, 0 publishes every poll cycle
+"""
+MQTT_QUEUE_SIZE: int = max(get_int_from_config("DEFAULT", "MQTT_QUEUE_SIZE"), 1)
+"""
+Maximum number of MQTT messages waiting to be sent, the oldest messages are dropped
+"""
 
 # SAVE CONFIG VALUES to constants
+# --------- Set logging level ---------
+LOGGING_DEBUG_SAMPLE: int = max(get_int_from_config("DEFAULT", "LOGGING_DEBUG_SAMPLE"), 1)
+"""
+Log only every n-th frame of the BMS communication at debug level
+"""
+
 # --------- Battery Current Limits ---------
 MAX_BATTERY_CHARGE_CURRENT: float = get_float_from_config("DEFAULT", "MAX_BATTERY_CHARGE_CURRENT")
 """
@@ -195,6 +266,14 @@ SOC_RESET_CURRENT: float = get_float_from_config("DEFAULT", "SOC_RESET_CURRENT")
 SOC_RESET_TIME: int = get_int_from_config("DEFAULT", "SOC_RESET_TIME")
 SOC_CALC_CURRENT_REPORTED_BY_BMS: list = get_list_from_config("DEFAULT", "SOC_CALC_CURRENT_REPORTED_BY_BMS", float)
 SOC_CALC_CURRENT_MEASURED_BY_USER: list = get_list_from_config("DEFAULT", "SOC_CALC_CURRENT_MEASURED_BY_USER", float)
+SAVE_BATTERY_STATE_INTERVAL: int = get_int_from_config("DEFAULT", "SAVE_BATTERY_STATE_INTERVAL")
+"""
+Interval in seconds to write the changed battery state to the dbus settings
+"""
+SOC_CALC_SAVE_DEADBAND: float = get_float_from_config("DEFAULT", "SOC_CALC_SAVE_DEADBAND")
+"""
+Minimum change of the calculated SoC in %, before it's written to the dbus settings again
+"""
 
 # check if lists are different
 # this allows to calculate linear relationship between the two lists only if needed
@@ -386,6 +465,10 @@ Defines the percentage of the maximum discharge current that the battery has to
 
 # --------- Time-To-Go ---------
 TIME_TO_GO_ENABLE: bool = get_bool_from_config("DEFAULT", "TIME_TO_GO_ENABLE")
+CURRENT_AVG_WINDOW: float = max(get_float_from_config("DEFAULT", "CURRENT_AVG_WINDOW"), 1)
+"""
+Time span in seconds over which the average current is calculated
+"""
 
 # --------- Time-To-Soc ---------
 TIME_TO_SOC_POINTS: List[int] = get_list_from_config("DEFAULT", "TIME_TO_SOC_POINTS", int)
@@ -396,10 +479,22 @@ TIME_TO_SOC_INC_FROM: bool = get_bool_from_config("DEFAULT", "TIME_TO_SOC_INC_FR
 # --------- Additional settings ---------
 BMS_TYPE: List[str] = get_list_from_config("DEFAULT", "BMS_TYPE", str)
 EXCLUDED_DEVICES: List[str] = get_list_from_config("DEFAULT", "EXCLUDED_DEVICES", str)
+BMS_DETECTION_CACHE_FILE: str = config["DEFAULT"]["BMS_DETECTION_CACHE_FILE"].strip()
+"""
+File, where the last detected BMS of each serial port is saved, empty to disable
+"""
 POLL_INTERVAL: Union[float, None] = float(config["DEFAULT"]["POLL_INTERVAL"]) * 1000 if config["DEFAULT"]["POLL_INTERVAL"] else None
 """
 Poll interval in milliseconds
 """
+POLL_INTERVAL_MEDIUM: float = get_float_from_config("DEFAULT", "POLL_INTERVAL_MEDIUM")
+"""
+Poll interval in seconds for the "medium" poll group
+"""
+POLL_INTERVAL_SLOW: float = get_float_from_config("DEFAULT", "POLL_INTERVAL_SLOW")
+"""
+Poll interval in seconds for the "slow" poll group
+"""
 PUBLISH_CONFIG_VALUES: bool = get_bool_from_config("DEFAULT", "PUBLISH_CONFIG_VALUES")
 BATTERY_CELL_DATA_FORMAT: int = get_int_from_config("DEFAULT", "BATTERY_CELL_DATA_FORMAT")
 MIDPOINT_ENABLE: bool = get_bool_from_config("DEFAULT", "MIDPOINT_ENABLE")
@@ -415,6 +510,27 @@ TELEMETRY: bool = get_bool_from_config("DEFAULT", "TELEMETRY")
 # --------- Voltage drop ---------
 VOLTAGE_DROP: float = get_float_from_config("DEFAULT", "VOLTAGE_DROP")
 
+# --------- Filters ---------
+FILTER_TYPES: Tuple[str, ...] = ("pt1", "avg", "median")
+"""
+Available filter types of the filter pipelines
+"""
+FILTER_CURRENT: List[str] = get_list_from_config("DEFAULT", "FILTER_CURRENT", str)
+"""
+Filter pipeline of the battery current
+"""
+FILTER_CELL_VOLTAGES: List[str] = get_list_from_config("DEFAULT", "FILTER_CELL_VOLTAGES", str)
+"""
+Filter pipeline of the cell voltages
+"""
+FILTER_TEMPERATURES: List[str] = get_list_from_config("DEFAULT", "FILTER_TEMPERATURES", str)
+"""
+Filter pipeline of the temperatures
+"""
+check_filter_config("FILTER_CURRENT", FILTER_CURRENT)
+check_filter_config("FILTER_CELL_VOLTAGES", FILTER_CELL_VOLTAGES)
+check_filter_config("FILTER_TEMPERATURES", FILTER_TEMPERATURES)
+
 # --------- BMS specific settings ---------
 AUTO_RESET_SOC: bool = get_bool_from_config("DEFAULT", "AUTO_RESET_SOC")
 USE_PORT_AS_UNIQUE_ID: bool = get_bool_from_config("DEFAULT", "USE_PORT_AS_UNIQUE_ID")
@@ -439,6 +555,16 @@ LIPRO_CELL_COUNT: int = get_int_from_config("DEFAULT", "LIPRO_CELL_COUNT")
 # -- Seplos V3 settings
 SEPLOS_USE_BMS_VALUES: bool = get_bool_from_config("DEFAULT", "SEPLOS_USE_BMS_VALUES")
 
+# -- Felicity ESS settings
+FELICITY_ESS_MODBUS_MAX_GAP: int = get_int_from_config("DEFAULT", "FELICITY_ESS_MODBUS_MAX_GAP")
+"""
+Maximum number of unused registers between two register windows which are still read in one request.
+"""
+FELICITY_ESS_MODBUS_MAX_REGISTERS: int = min(get_int_from_config("DEFAULT", "FELICITY_ESS_MODBUS_MAX_REGISTERS"), 125)
+"""
+Maximum number of registers per Modbus request, Modbus RTU allows up to 125 registers.
+"""
+
 
 # FUNCTIONS
 def constrain(val: float, min_val: float, max_val: float) -> float:
@@ -566,22 +692,925 @@ def bytearray_to_string(data: bytearray) -> str:
     return "".join(f"\\x{byte:02x}" for byte in data)
 
 
-def open_serial_port(port: str, baud: int) -> Union[serial.Serial, None]:
+def _build_crc16_table(polynomial: int, reflected: bool) -> Tuple[int, ...]:
+    """
+    Build a 256 entry lookup table for a 16 bit CRC.
+
+    :param polynomial: CRC polynomial, already bit reversed for reflected CRCs
+    :param reflected: True if the CRC is processed LSB first
+    :return: Lookup table
+    """
+    table = []
+    for byte in range(256):
+        if reflected:
+            crc = byte
+            for _ in range(8):
+                crc = (crc >> 1) ^ polynomial if crc & 0x0001 else crc >> 1
+        else:
+            crc = byte << 8
+            for _ in range(8):
+                crc = ((crc << 1) ^ polynomial if crc & 0x8000 else crc << 1) & 0xFFFF
+        table.append(crc)
+    return tuple(table)
+
+
+_CRC16_MODBUS_TABLE = _build_crc16_table(0xA001, True)
+# a CRC-8 table is the upper byte of a CRC-16 table with the polynomial in the upper byte
+_CRC8_SMBUS_TABLE = tuple(_build_crc16_table(0x0700, False)[byte] >> 8 for byte in range(256))
+
+
+def _buffer_view(data: Union[bytes, bytearray, memoryview], start: int, end: Union[int, None]) -> Union[bytes, bytearray, memoryview]:
+    """
+    Return the requested part of a buffer without copying it.
+
+    :param data: Buffer
+    :param start: First byte
+    :param end: Byte after the last byte, None for the end of the buffer
+    :return: The buffer itself or a memoryview of the requested part
+    """
+    if start == 0 and end is None:
+        return data
+    return memoryview(data)[start:end]
+
+
+def crc16_modbus(data: Union[bytes, bytearray, memoryview], start: int = 0, end: int = None) -> int:
+    """
+    Calculate the CRC-16/Modbus of a buffer.
+
+    :param data: Buffer
+    :param start: First byte
+    :param end: Byte after the last byte, None for the end of the buffer
+    :return: CRC, has to be sent little-endian
+    """
+    table = _CRC16_MODBUS_TABLE
+    crc = 0xFFFF
+    for byte in _buffer_view(data, start, end):
+        crc = (crc >> 8) ^ table[(crc ^ byte) & 0xFF]
+    return crc
+
+
+def crc8_smbus(data: Union[bytes, bytearray, memoryview], start: int = 0, end: int = None, crc: int = 0) -> int:
+    """
+    Calculate the CRC-8/SMBUS (SMBus PEC) of a buffer.
+
+    :param data: Buffer
+    :param start: First byte
+    :param end: Byte after the last byte, None for the end of the buffer
+    :param crc: Initial value, e.g. the CRC of the preceding bytes of the transaction
+    :return: CRC
+    """
+    table = _CRC8_SMBUS_TABLE
+    for byte in _buffer_view(data, start, end):
+        crc = table[crc ^ byte]
+    return crc
+
+
+def sum8(data: Union[bytes, bytearray, memoryview], start: int = 0, end: int = None) -> int:
+    """
+    Calculate the 8 bit sum of a buffer.
+
+    :param data: Buffer
+    :param start: First byte
+    :param end: Byte after the last byte, None for the end of the buffer
+    :return: Sum of all bytes modulo 256
+    """
+    return sum(_buffer_view(data, start, end)) & 0xFF
+
+
+def sum16(data: Union[bytes, bytearray, memoryview], start: int = 0, end: int = None) -> int:
+    """
+    Calculate the 16 bit sum of a buffer.
+
+    :param data: Buffer
+    :param start: First byte
+    :param end: Byte after the last byte, None for the end of the buffer
+    :return: Sum of all bytes modulo 65536
+    """
+    return sum(_buffer_view(data, start, end)) & 0xFFFF
+
+
+def checksum16(data: Union[bytes, bytearray, memoryview], start: int = 0, end: int = None) -> int:
+    """
+    Calculate the 16 bit two's complement of the sum of a buffer.
+    Used by the LLT/JBD binary protocol and by the ASCII protocols of Seplos and Daren (Pylontech style).
+
+    :param data: Buffer
+    :param start: First byte
+    :param end: Byte after the last byte, None for the end of the buffer
+    :return: Checksum, so that the sum of all bytes plus the checksum is 0 modulo 65536
+    """
+    return -sum(_buffer_view(data, start, end)) & 0xFFFF
+
+
+def lenid(length: int) -> int:
+    """
+    Calculate the LENGTH field of the Seplos and Daren ASCII protocols.
+    The upper nibble is the LCHKSUM of the three LENID nibbles, the lower 12 bits are the LENID.
+
+    :param length: Number of ASCII characters in the INFO field
+    :return: LENGTH field
+    """
+    length &= 0x0FFF
+    lchksum = -((length & 0xF) + ((length >> 4) & 0xF) + (length >> 8)) & 0xF
+    return (lchksum << 12) | length
+
+
+def verify_crc16_modbus(frame: Union[bytes, bytearray, memoryview], end: int = None) -> bool:
+    """
+    Verify the CRC-16/Modbus of a frame in place.
+
+    :param frame: Frame
+    :param end: Position of the little-endian CRC, None if the CRC are the last two bytes
+    :return: True if the CRC is valid
+    """
+    if end is None:
+        end = len(frame) - 2
+    if end < 0 or len(frame) < end + 2:
+        return False
+    return crc16_modbus(frame, 0, end) == frame[end] | (frame[end + 1] << 8)
+
+
+def verify_sum8(frame: Union[bytes, bytearray, memoryview], end: int = None) -> bool:
+    """
+    Verify the 8 bit sum of a frame in place.
+
+    :param frame: Frame
+    :param end: Position of the checksum byte, None if the checksum is the last byte
+    :return: True if the checksum is valid
+    """
+    if end is None:
+        end = len(frame) - 1
+    if end < 0 or len(frame) <= end:
+        return False
+    return sum8(frame, 0, end) == frame[end]
+
+
+def verify_lenid(length: int) -> bool:
+    """
+    Verify the LCHKSUM of a LENGTH field of the Seplos and Daren ASCII protocols.
+
+    :param length: LENGTH field
+    :return: True if the LCHKSUM is valid
+    """
+    return lenid(length) == length
+
+
+def verify_checksum16_ascii(frame: Union[bytes, bytearray, memoryview]) -> bool:
+    """
+    Verify the checksum of a Seplos or Daren ASCII frame in place.
+    The frame has the layout ``~<data><CHKSUM>\\r``, where CHKSUM are four hex characters.
+
+    :param frame: Frame including SOI and EOI
+    :return: True if the checksum is valid
+    """
+    if len(frame) < 6:
+        return False
+    try:
+        received = int(bytes(frame[-5:-1]), 16)
+    except ValueError:
+        return False
+    return checksum16(frame, 1, len(frame) - 5) == received
+
+
+class RollingWindow:
+    """
+    Streaming statistics over the samples of the last `window` seconds.
+
+    Adding a sample and reading the mean, minimum, maximum and EWMA is O(1) (amortized),
+    since a running sum and monotonic queues for the minimum and maximum are kept.
+    The window is based on the sample timestamps and not on the number of samples,
+    so the result doesn't change, if the poll interval changes.
+
+    :param window: the time span of the window in seconds
+    :param ewma_time_constant: the time constant of the exponentially weighted moving average in seconds,
+        None to use the window
+    """
+
+    RESUM_EVERY: int = 1000
+    """
+    Recalculate the running sum every n samples to prevent the accumulation of rounding errors
+    """
+
+    def __init__(self, window: float, ewma_time_constant: float = None):
+        self.window: float = window
+        self.ewma_time_constant: float = ewma_time_constant if ewma_time_constant is not None else window
+        self.samples: deque = deque()
+        self.sum: float = 0.0
+        self.ewma: Union[float, None] = None
+        self.last_timestamp: Union[float, None] = None
+        self._min_samples: deque = deque()
+        self._max_samples: deque = deque()
+        self._added: int = 0
+
+    def __len__(self) -> int:
+        return len(self.samples)
+
+    def add(self, value: float, timestamp: float = None) -> None:
+        """
+        Add a sample to the window and remove samples, which are older than the window.
+
+        :param value: the value of the sample
+        :param timestamp: the monotonic timestamp of the sample in seconds, None to use the current time
+        :return: None
+        """
+        if timestamp is None:
+            timestamp = monotonic()
+
+        # exponentially weighted moving average, weighted by the time since the last sample
+        if self.ewma is None or self.ewma_time_constant <= 0:
+            self.ewma = value
+        else:
+            alpha = 1 - math.exp(-max(timestamp - self.last_timestamp, 0) / self.ewma_time_constant)
+            self.ewma += alpha * (value - self.ewma)
+        self.last_timestamp = timestamp
+
+        self.samples.append((timestamp, value))
+        self.sum += value
+
+        while self._min_samples and self._min_samples[-1][1] >= value:
+            self._min_samples.pop()
+        self._min_samples.append((timestamp, value))
+        while self._max_samples and self._max_samples[-1][1] <= value:
+            self._max_samples.pop()
+        self._max_samples.append((timestamp, value))
+
+        self.expire(timestamp)
+
+        self._added += 1
+        if self._added >= self.RESUM_EVERY:
+            self._added = 0
+            self.sum = math.fsum(sample[1] for sample in self.samples)
+
+    def expire(self, now: float = None) -> None:
+        """
+        Remove all samples, which are older than the window.
+
+        :param now: the monotonic timestamp in seconds, None to use the current time
+        :return: None
+        """
+        if now is None:
+            now = monotonic()
+        limit = now - self.window
+
+        while self.samples and self.samples[0][0] <= limit:
+            self.sum -= self.samples.popleft()[1]
+        while self._min_samples and self._min_samples[0][0] <= limit:
+            self._min_samples.popleft()
+        while self._max_samples and self._max_samples[0][0] <= limit:
+            self._max_samples.popleft()
+
+        if not self.samples:
+            self.sum = 0.0
+
+    def clear(self) -> None:
+        """
+        Remove all samples and reset the EWMA.
+
+        :return: None
+        """
+        self.samples.clear()
+        self._min_samples.clear()
+        self._max_samples.clear()
+        self.sum = 0.0
+        self.ewma = None
+        self.last_timestamp = None
+        self._added = 0
+
+    @property
+    def mean(self) -> Union[float, None]:
+        """
+        The arithmetic mean of the samples in the window, None if there are no samples
+        """
+        return self.sum / len(self.samples) if self.samples else None
+
+    @property
+    def min(self) -> Union[float, None]:
+        """
+        The minimum of the samples in the window, None if there are no samples
+        """
+        return self._min_samples[0][1] if self._min_samples else None
+
+    @property
+    def max(self) -> Union[float, None]:
+        """
+        The maximum of the samples in the window, None if there are no samples
+        """
+        return self._max_samples[0][1] if self._max_samples else None
+
+
+class ErrorRateTracker:
+    """
+    Keeps the timestamps of the last `size` errors in a fixed size ring buffer and counts the errors per error code.
+    Adding an error and checking, if the limit was reached within a time span, is O(1).
+
+    :param size: the number of error timestamps to keep
+    """
+
+    def __init__(self, size: int):
+        self.size: int = size
+        self.timestamps: List[float] = [0.0] * size
+        self.index: int = 0
+        """
+        Position in the ring buffer, where the next timestamp is written
+        """
+        self.count: int = 0
+        """
+        Number of timestamps in the ring buffer
+        """
+        self.total: int = 0
+        """
+        Number of errors since the start of the driver
+        """
+        self.counters: Dict[int, int] = {}
+        """
+        Number of errors since the start of the driver by error code
+        """
+
+    def __len__(self) -> int:
+        return self.count
+
+    def add(self, error_code: int, timestamp: float = None) -> None:
+        """
+        Add an error.
+
+        :param error_code: the error code
+        :param timestamp: the timestamp of the error in seconds, None to use the current time
+        :return: None
+        """
+        self.timestamps[self.index] = time() if timestamp is None else timestamp
+        self.index = (self.index + 1) % self.size
+        if self.count < self.size:
+            self.count += 1
+        self.total += 1
+        self.counters[error_code] = self.counters.get(error_code, 0) + 1
+
+    @property
+    def full(self) -> bool:
+        """
+        True, if the ring buffer contains `size` timestamps
+        """
+        return self.count >= self.size
+
+    @property
+    def oldest(self) -> Union[float, None]:
+        """
+        Timestamp of the oldest error in the ring buffer, None if there are no errors
+        """
+        if self.count == 0:
+            return None
+        return self.timestamps[self.index if self.full else 0]
+
+    def limit_reached(self, window: float, now: float = None) -> bool:
+        """
+        Check, if `size` errors occurred within the last `window` seconds.
+
+        :param window: the time span in seconds
+        :param now: the current timestamp in seconds, None to use the current time
+        :return: True, if the limit was reached
+        """
+        return self.full and (time() if now is None else now) - self.oldest <= window
+
+    def rate(self, now: float = None) -> Union[float, None]:
+        """
+        Get the error rate in errors per hour over the errors in the ring buffer.
+
+        :param now: the current timestamp in seconds, None to use the current time
+        :return: the error rate or None, if there are no errors
+        """
+        if self.count == 0:
+            return None
+        return self.count / max((time() if now is None else now) - self.oldest, 1) * 3600
+
+
+class Filter(ABC):
+    """
+    Base class of the signal filters. A filter processes several signals at once (e.g. all cell voltages),
+    its state is stored in flat arrays, which are updated in place.
+    The filter is initialized with the first values, if no initial value is given.
+
+    :param size: number of signals
+    :param init_value: initial value of all signals, None to initialize with the first values
+    """
+
+    def __init__(self, size: int = 1, init_value: float = None):
+        self.init_value: Union[float, None] = init_value
+        self.reset(size)
+
+    def reset(self, size: int = None) -> None:
+        """
+        Reset the filter state.
+
+        :param size: new number of signals, None to keep it
+        :return: None
+        """
+        if size is not None:
+            self.size: int = size
+        self.output: array = array("d", [self.init_value or 0.0] * self.size)
+        self.initialized: bool = self.init_value is not None
+
+    def update(self, values: Sequence[float], dt: float = None) -> array:
+        """
+        Update the filter with new values.
+
+        :param values: the new values, one for each signal
+        :param dt: the time since the last update in seconds, None for the nominal sample time
+        :return: the filtered values; the array is reused by the next update
+        """
+        if len(values) != self.size:
+            self.reset(len(values))
+        if not self.initialized:
+            self.initialize(values)
+            self.initialized = True
+            return self.output
+        self.process(values, dt)
+        return self.output
+
+    def update_value(self, value: float, dt: float = None) -> float:
+        """
+        Update a filter of a single signal with a new value.
+
+        :param value: the new value
+        :param dt: the time since the last update in seconds, None for the nominal sample time
+        :return: the filtered value
+        """
+        return self.update((value,), dt)[0]
+
+    def initialize(self, values: Sequence[float]) -> None:
+        self.output[:] = array("d", values)
+
+    @abstractmethod
+    def process(self, values: Sequence[float], dt: Union[float, None]) -> None:
+        """
+        Each filter must override this function to update `self.output` with the new values.
+
+        :param values: the new values, one for each signal
+        :param dt: the time since the last update in seconds, None for the nominal sample time
+        :return: None
+        """
+
+
+class FilterPT1(Filter):
+    """
+    First-order low-pass filter.
+
+    :param tau: time constant in seconds (higher = slower response, smaller = faster response)
+    :param T_s: nominal sample time in seconds, used if no `dt` is passed to `update()`
+    :param size: number of signals
+    :param init_value: initial value of all signals, None to initialize with the first values
+    """
+
+    def __init__(self, tau: float, T_s: float = 1.0, size: int = 1, init_value: float = None):
+        self.tau: float = tau
+        self.T_s: float = T_s
+        super().__init__(size, init_value)
+
+    def process(self, values: Sequence[float], dt: Union[float, None]) -> None:
+        dt = self.T_s if dt is None else dt
+        b = dt / (self.tau + dt)
+        output = self.output
+        for i, value in enumerate(values):
+            output[i] += b * (value - output[i])
+
+
+class FilterFloatingAvg(Filter):
+    """
+    Moving average over the last `num_elements` values. Keeps a running total of each signal.
+
+    :param num_elements: number of values to average
+    :param size: number of signals
+    :param init_value: initial value of all signals, None to initialize with the first values
+    """
+
+    def __init__(self, num_elements: int, size: int = 1, init_value: float = None):
+        self.num_elements: int = num_elements
+        super().__init__(size, init_value)
+
+    def reset(self, size: int = None) -> None:
+        super().reset(size)
+        # circular buffer of the values, the values of a sample are stored next to each other
+        self.buffer: array = array("d", [self.init_value or 0.0] * (self.size * self.num_elements))
+        self.total: array = array("d", [(self.init_value or 0.0) * self.num_elements] * self.size)
+        self.index: int = 0
+
+    def initialize(self, values: Sequence[float]) -> None:
+        super().initialize(values)
+        for slot in range(self.num_elements):
+            self.buffer[slot * self.size : (slot + 1) * self.size] = self.output
+        for i, value in enumerate(values):
+            self.total[i] = value * self.num_elements
+
+    def process(self, values: Sequence[float], dt: Union[float, None]) -> None:
+        buffer, total, output = self.buffer, self.total, self.output
+        offset = self.index * self.size
+        for i, value in enumerate(values):
+            total[i] = total[i] - buffer[offset + i] + value
+            buffer[offset + i] = value
+            output[i] = total[i] / self.num_elements
+        self.index = (self.index + 1) % self.num_elements
+
+
+class FilterMedian(FilterFloatingAvg):
+    """
+    Median over the last `num_elements` values, removes single spikes.
+
+    :param num_elements: number of values
+    :param size: number of signals
+    :param init_value: initial value of all signals, None to initialize with the first values
+    """
+
+    def process(self, values: Sequence[float], dt: Union[float, None]) -> None:
+        buffer, output = self.buffer, self.output
+        offset = self.index * self.size
+        buffer[offset : offset + self.size] = array("d", values)
+        middle = self.num_elements // 2
+        for i in range(self.size):
+            window = sorted(buffer[i :: self.size])
+            output[i] = window[middle] if self.num_elements % 2 else (window[middle - 1] + window[middle]) / 2
+        self.index = (self.index + 1) % self.num_elements
+
+
+class FilterPipeline:
+    """
+    Applies several filters in a row to the same signals.
+
+    :param filters: the filters in the order they are applied
+    """
+
+    def __init__(self, filters: List[Filter]):
+        self.filters: List[Filter] = filters
+        self.last_update: Union[float, None] = None
+
+    def update(self, values: Sequence[float]) -> Sequence[float]:
+        """
+        Update all filters with new values. The time since the last update is passed to the filters.
+
+        :param values: the new values, one for each signal
+        :return: the filtered values; the array is reused by the next update
+        """
+        now = monotonic()
+        dt = now - self.last_update if self.last_update is not None else None
+        self.last_update = now
+        for signal_filter in self.filters:
+            values = signal_filter.update(values, dt)
+        return values
+
+    def reset(self) -> None:
+        """
+        Reset all filters, they are initialized again with the next values.
+
+        :return: None
+        """
+        self.last_update = None
+        for signal_filter in self.filters:
+            signal_filter.reset()
+
+
+def create_filter_pipeline(specs: List[str]) -> Union[FilterPipeline, None]:
+    """
+    Create a filter pipeline from the config, e.g. `["median:3", "avg:5"]`. Invalid filters are ignored.
+
+    :param specs: the filters as "<type>:<value>"
+    :return: the filter pipeline or None, if no filter is configured
+    """
+    filters = []
+    for spec in specs:
+        parsed = parse_filter_spec(spec)
+        if parsed is None:
+            continue
+
+        filter_type, filter_value = parsed
+        if filter_type == "pt1":
+            filters.append(FilterPT1(filter_value))
+        elif filter_type == "avg":
+            filters.append(FilterFloatingAvg(filter_value))
+        elif filter_type == "median":
+            filters.append(FilterMedian(filter_value))
+
+    return FilterPipeline(filters) if len(filters) > 0 else None
+
+
+class LazyString:
+    """
+    Calls a function only when the object is converted to a string. Use it as argument of a
+    `%`-style log message, so that the conversion is skipped, if the message is not logged.
+
+    Example: `logger.debug("data: %s", LazyString(bytearray_to_string, data))`
+
+    :param function: the function, which returns the string
+    :param args: the arguments of the function
+    """
+
+    __slots__ = ("function", "args")
+
+    def __init__(self, function: Callable[..., str], *args):
+        self.function = function
+        self.args = args
+
+    def __str__(self) -> str:
+        return str(self.function(*self.args))
+
+
+class DebugSampler:
+    """
+    Decides, if a frame should be logged at debug level. Only every `every`-th frame is logged.
+
+    :param every: log every n-th frame, defaults to `LOGGING_DEBUG_SAMPLE`
+    """
+
+    def __init__(self, every: int = None):
+        self.every: int = every if every is not None else LOGGING_DEBUG_SAMPLE
+        self.counter: int = 0
+        self.active: bool = False
+        """
+        True, if the current frame is logged
+        """
+
+    def next(self) -> bool:
+        """
+        Start a new frame.
+
+        :return: True, if the frame should be logged
+        """
+        if not logger.isEnabledFor(logging.DEBUG):
+            self.active = False
+            return False
+
+        self.counter += 1
+        self.active = self.counter >= self.every
+        if self.active:
+            self.counter = 0
+        return self.active
+
+
+def plan_register_reads(windows: List[Tuple[int, int]], max_gap: int, max_registers: int) -> List[Tuple[int, int]]:
     """
-    Open a serial port.
+    Merge Modbus register windows into as few read requests as possible.
+    Two windows are merged, if there are not more than `max_gap` unused registers between them
+    and the resulting request does not exceed `max_registers`.
+
+    :param windows: List of tuples with the start register and the number of registers
+    :param max_gap: Maximum number of unused registers between two windows to still merge them
+    :param max_registers: Maximum number of registers per request
+    :return: List of tuples with the start register and the number of registers to request
+    """
+    blocks = []
+    for start, count in sorted(windows):
+        if blocks:
+            block_start, block_count = blocks[-1]
+            block_end = block_start + block_count
+            new_end = max(block_end, start + count)
+            if start - block_end <= max_gap and new_end - block_start <= max_registers:
+                blocks[-1] = (block_start, new_end - block_start)
+                continue
+        blocks.append((start, count))
+    return blocks
+
+
+def slice_register_window(blocks: List[Tuple[int, int, List[int]]], start: int, count: int) -> Union[List[int], None]:
+    """
+    Get the values of a register window from the read register blocks.
+
+    :param blocks: List of tuples with the start register, the number of registers and the read values
+    :param start: Start register of the window
+    :param count: Number of registers of the window
+    :return: Values of the window or None, if the window was not read
+    """
+    for block_start, block_count, values in blocks:
+        if block_start <= start and start + count <= block_start + block_count:
+            if values is None or len(values) < start - block_start + count:
+                return None
+            return values[start - block_start : start - block_start + count]
+    return None
+
+
+serial_ports: Dict[str, serial.Serial] = {}
+"""
+Process wide pool of open serial ports, one handle per port
+"""
+
+serial_port_locks: Dict[str, threading.RLock] = {}
+"""
+Locks serializing the access to the pooled serial ports
+"""
+
+serial_ports_lock = threading.Lock()
+
+
+def get_serial_port_lock(port: str) -> threading.RLock:
+    """
+    Get the lock which serializes the access to a pooled serial port.
+
+    :param port: Serial port
+    :return: Lock of the serial port
+    """
+    with serial_ports_lock:
+        if port not in serial_port_locks:
+            serial_port_locks[port] = threading.RLock()
+        return serial_port_locks[port]
+
+
+def get_serial_port(port: str, baud: int, timeout: float = 0.1, **settings) -> serial.Serial:
+    """
+    Get the pooled handle of a serial port. The port is opened on first use and reopened if it was closed.
+    Baud rate, timeout and further settings (e.g. parity, stopbits) are only reconfigured if they changed,
+    since pySerial reconfigures the port on every assignment.
+    The handle is always the same object for a port, so it can be kept by the caller (e.g. minimalmodbus).
 
     :param port: Serial port
     :param baud: Baud rate
+    :param timeout: Read timeout in seconds
+    :param settings: Further pySerial settings
+    :return: Opened serial port
+    :raises serial.SerialException: If the port could not be opened
+    """
+    with get_serial_port_lock(port):
+        ser = serial_ports.get(port)
+        if ser is None:
+            ser = serial.Serial(port, baudrate=baud, timeout=timeout, **settings)
+            serial_ports[port] = ser
+            return ser
+
+        if ser.baudrate != baud:
+            ser.baudrate = baud
+        if ser.timeout != timeout:
+            ser.timeout = timeout
+        for key, value in settings.items():
+            if getattr(ser, key) != value:
+                setattr(ser, key, value)
+
+        if not ser.is_open:
+            ser.open()
+
+        return ser
+
+
+def close_serial_port(port: str) -> None:
+    """
+    Close a pooled serial port, e.g. after a SerialException. It is reopened on the next use.
+
+    :param port: Serial port
+    """
+    with get_serial_port_lock(port):
+        ser = serial_ports.get(port)
+        if ser is not None:
+            try:
+                ser.close()
+            except Exception as e:
+                logger.error(e)
+
+
+@contextmanager
+def open_serial_port(port: str, baud: int, timeout: float = 0.1) -> Iterator[Union[serial.Serial, None]]:
+    """
+    Open a serial port from the serial port pool and lock it for the duration of the context.
+    The port is not closed when leaving the context, but on a SerialException.
+
+    :param port: Serial port
+    :param baud: Baud rate
+    :param timeout: Read timeout in seconds
     :return: Opened serial port or None if failed
     """
-    tries = 3
-    while tries > 0:
+    with get_serial_port_lock(port):
+        ser = None
+        tries = 3
+        while tries > 0:
+            try:
+                ser = get_serial_port(port, baud, timeout)
+                break
+            except serial.SerialException as e:
+                logger.error(e)
+                close_serial_port(port)
+                tries -= 1
+
         try:
-            return serial.Serial(port, baudrate=baud, timeout=0.1)
-        except serial.SerialException as e:
-            logger.error(e)
-            tries -= 1
-    return None
+            yield ser
+        except serial.SerialException:
+            close_serial_port(port)
+            raise
+
+
+def wait_serial_port_ready(port: str, baud: int, timeout: float = 16.0, quiet_time: float = 0.1) -> bool:
+    """
+    Wait until a serial port can be opened and the line is quiet, which means that no bytes are received
+    for `quiet_time` seconds after flushing the input buffer (e.g. no garbage of an USB adapter, which is
+    still initializing). Retries with exponential backoff, but waits at most `timeout` seconds.
+    The port stays opened in the serial port pool.
+
+    :param port: Serial port
+    :param baud: Baud rate
+    :param timeout: Maximum time to wait in seconds
+    :param quiet_time: Time in seconds without received bytes, to consider the line as quiet
+    :return: True if the port is ready, False if the timeout was reached
+    """
+    deadline = monotonic() + timeout
+    delay = 0.1
+    tries = 1
+    while True:
+        with get_serial_port_lock(port):
+            try:
+                ser = get_serial_port(port, baud)
+                ser.reset_input_buffer()
+                sleep(quiet_time)
+                if ser.in_waiting == 0:
+                    logger.debug(f"Serial port {port} ready after {tries} tries")
+                    return True
+                logger.debug(f"Serial port {port} not quiet, received {ser.in_waiting} bytes")
+            except (serial.SerialException, OSError) as e:
+                logger.debug(f"Serial port {port} not ready: {e}")
+                close_serial_port(port)
+
+        remaining = deadline - monotonic()
+        if remaining <= 0:
+            logger.warning(f"Serial port {port} not ready after {timeout} seconds, continue anyway")
+            return False
+
+        sleep(min(delay, remaining))
+        delay = min(delay * 2, 2.0)
+        tries += 1
+
+
+def read_serialport_bytes(ser: serial.Serial, size: int, deadline: float) -> bytearray:
+    """
+    Read bytes from a serial port until the requested number of bytes is received or the deadline is reached.
+    Blocks on the file descriptor instead of polling the input buffer.
+
+    :param ser: Serial port
+    :param size: Number of bytes to read
+    :param deadline: Deadline as monotonic() timestamp
+    :return: Data read from the serial port, shorter than size on timeout
+    """
+    try:
+        fd = ser.fileno()
+    except Exception:
+        fd = None
+
+    data = bytearray()
+    while len(data) < size:
+        remaining = deadline - monotonic()
+        if remaining <= 0:
+            break
+
+        if fd is None:
+            # no file descriptor available, block in pySerial using the port timeout
+            data.extend(ser.read(size - len(data)))
+            continue
+
+        waiting = ser.in_waiting
+        if waiting == 0:
+            readable, _, _ = select.select([fd], [], [], remaining)
+            if not readable:
+                break
+            waiting = max(ser.in_waiting, 1)
+
+        data.extend(ser.read(min(waiting, size - len(data))))
+
+    return data
+
+
+def read_serialport_until(ser: serial.Serial, terminator: bytes, deadline: float, max_size: int = 4096) -> bytearray:
+    """
+    Read bytes from a serial port until the terminator is received or the deadline is reached.
+    Blocks on the file descriptor instead of polling the input buffer and reads all waiting bytes at once.
+
+    :param ser: Serial port
+    :param terminator: Bytes that mark the end of a reply
+    :param deadline: Deadline as monotonic() timestamp
+    :param max_size: Maximum number of bytes to read
+    :return: Data read from the serial port up to and including the terminator, without terminator on timeout
+    """
+    try:
+        fd = ser.fileno()
+    except Exception:
+        fd = None
+
+    data = bytearray()
+    search_start = 0
+    while len(data) < max_size:
+        remaining = deadline - monotonic()
+        if remaining <= 0:
+            break
+
+        if fd is None:
+            # no file descriptor available, block in pySerial using the port timeout
+            data.extend(ser.read(max(ser.in_waiting, 1)))
+        else:
+            waiting = ser.in_waiting
+            if waiting == 0:
+                readable, _, _ = select.select([fd], [], [], remaining)
+                if not readable:
+                    break
+                waiting = max(ser.in_waiting, 1)
+
+            data.extend(ser.read(min(waiting, max_size - len(data))))
+
+        # only search the new bytes, but include a possibly split terminator
+        end = data.find(terminator, search_start)
+        if end >= 0:
+            del data[end + len(terminator) :]
+            break
+        search_start = max(len(data) - len(terminator) + 1, 0)
+
+    return data
 
 
 def read_serialport_data(
@@ -591,6 +1620,7 @@ def read_serialport_data(
     length_check: int,
     length_fixed: Union[int, None] = None,
     length_size: str = "B",
+    timeout: float = 1.0,
 ) -> bytearray:
     """
     Read data from a serial port
@@ -601,12 +1631,14 @@ def read_serialport_data(
     :param length_check: Length of the checksum
     :param length_fixed: Fixed length of the data, if not set it will be read from the data
     :param length_size: Size of the length byte, can be "B", "H", "I" or "L"
+    :param timeout: Overall timeout for the reply in seconds
     :return: Data read from the serial port
     """
     try:
         ser.flushOutput()
         ser.flushInput()
         ser.write(command)
+        deadline = monotonic() + timeout
 
         if length_size.upper() == "B":
             length_byte_size = 1
@@ -615,45 +1647,34 @@ def read_serialport_data(
         elif length_size.upper() == "I" or length_size.upper() == "L":
             length_byte_size = 4
 
-        count = 0
-        toread = ser.inWaiting()
+        data = read_serialport_bytes(ser, length_pos + length_byte_size, deadline)
+        if len(data) < (length_pos + length_byte_size):
+            logger.error(">>> ERROR: No reply - returning [len:" + str(len(data)) + "]")
+            return False
 
-        while toread < (length_pos + length_byte_size):
-            sleep(0.005)
-            toread = ser.inWaiting()
-            count += 1
-            if count > 50:
-                logger.error(">>> ERROR: No reply - returning")
-                return False
-
-        # logger.info('serial data toread ' + str(toread))
-        res = ser.read(toread)
         if length_fixed is not None:
             length = length_fixed
         else:
-            if len(res) < (length_pos + length_byte_size):
-                logger.error(">>> ERROR: No reply - returning [len:" + str(len(res)) + "]")
-                return False
-            length = unpack_from(">" + length_size, res, length_pos)[0]
+            length = unpack_from(">" + length_size, data, length_pos)[0]
 
         # logger.info('serial data length ' + str(length))
 
-        count = 0
-        data = bytearray(res)
-        while len(data) <= length + length_check:
-            res = ser.read(length + length_check)
-            data.extend(res)
-            # logger.info('serial data length ' + str(len(data)))
-            sleep(0.005)
-            count += 1
-            if count > 150:
-                logger.error(">>> ERROR: No reply - returning [len:" + str(len(data)) + "/" + str(length + length_check) + "]")
-                return False
+        data.extend(read_serialport_bytes(ser, length + length_check + 1 - len(data), deadline))
+        if len(data) <= length + length_check:
+            logger.error(">>> ERROR: No reply - returning [len:" + str(len(data)) + "/" + str(length + length_check) + "]")
+            return False
+
+        # keep trailing bytes, which are already received, as part of the reply
+        if ser.in_waiting > 0:
+            data.extend(ser.read(ser.in_waiting))
 
         return data
 
     except serial.SerialException as e:
         logger.error(e)
+        # reopen the port on the next use
+        if ser.port is not None:
+            close_serial_port(ser.port)
         return False
 
     except Exception:
@@ -690,7 +1711,9 @@ def read_serial_data(
     :return: Data read from the serial port
     """
     try:
-        with serial.Serial(port, baudrate=baud, timeout=0.1) as ser:
+        with open_serial_port(port, baud) as ser:
+            if ser is None:
+                return False
             return read_serialport_data(ser, command, length_pos, length_check, length_fixed, length_size)
 
     except serial.SerialException as e:
@@ -708,6 +1731,116 @@ def read_serial_data(
         logger.error(f"Exception occurred: {repr(exception_object)} of type {exception_type} in {file} line #{line}")
 
 
+def get_usb_device_id(port: str) -> Union[str, None]:
+    """
+    Get the USB ID of a serial port from sysfs.
+
+    :param port: The serial port, e.g. "/dev/ttyUSB0"
+    :return: "<vendor id>:<product id>:<serial number>" or "<vendor id>:<product id>", if the adapter has no
+        serial number, None if it's not an USB device
+    """
+    device = os.path.realpath(f"/sys/class/tty/{os.path.basename(port)}/device")
+
+    # walk up from the tty to the USB device
+    while device.startswith("/sys/") and not os.path.isfile(os.path.join(device, "idVendor")):
+        device = os.path.dirname(device)
+    if not device.startswith("/sys/"):
+        return None
+
+    usb_id = []
+    for attribute in ("idVendor", "idProduct", "serial"):
+        try:
+            with open(os.path.join(device, attribute), "r") as file:
+                usb_id.append(file.readline().strip())
+        except OSError:
+            pass
+
+    return ":".join(value for value in usb_id if value) or None
+
+
+def get_detection_key(port: str, modbus_address: str = None) -> str:
+    """
+    Get the key of a serial port in the BMS detection cache.
+    If the USB adapter has a serial number, it's used instead of the port, so that the key doesn't change,
+    if the adapter gets another tty after an USB reset.
+
+    :param port: The serial port, e.g. "/dev/ttyUSB0"
+    :param modbus_address: The Modbus address (optional)
+    :return: The key
+    """
+    usb_id = get_usb_device_id(port)
+    if usb_id is not None and usb_id.count(":") >= 2:
+        key = "usb:" + usb_id
+    elif usb_id is not None:
+        key = port + "|" + usb_id
+    else:
+        key = port
+
+    return key + ("@" + modbus_address if modbus_address is not None else "")
+
+
+def load_detection_fingerprint(key: str) -> Union[dict, None]:
+    """
+    Load the last detected BMS of a serial port from `BMS_DETECTION_CACHE_FILE`.
+
+    :param key: The key of the serial port, see `get_detection_key()`
+    :return: The fingerprint with the keys "bms", "address", "baud" and optional "unique_identifier" and "instance"
+        or None, if nothing was saved
+    """
+    if not BMS_DETECTION_CACHE_FILE:
+        return None
+
+    try:
+        with open(BMS_DETECTION_CACHE_FILE, "r") as file:
+            fingerprint = json.load(file).get(key)
+        return fingerprint if isinstance(fingerprint, dict) and "bms" in fingerprint else None
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def save_detection_fingerprint(key: str, fingerprint: Union[dict, None]) -> None:
+    """
+    Save the last detected BMS of a serial port to `BMS_DETECTION_CACHE_FILE`.
+    A driver instance runs for each serial port and all share the file, therefore the read-modify-write
+    is done while holding an exclusive lock on a lock file and the file is replaced atomically.
+
+    :param key: The key of the serial port, see `get_detection_key()`
+    :param fingerprint: The fingerprint with the keys "bms", "address", "baud" and optional "unique_identifier" and
+        "instance", None to remove it
+    :return: None
+    """
+    if not BMS_DETECTION_CACHE_FILE:
+        return
+
+    try:
+        with open(f"{BMS_DETECTION_CACHE_FILE}.lock", "a") as lock_file:
+            # released when the lock file is closed
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+
+            try:
+                with open(BMS_DETECTION_CACHE_FILE, "r") as file:
+                    fingerprints = json.load(file)
+                if not isinstance(fingerprints, dict):
+                    fingerprints = {}
+            except (OSError, ValueError):
+                fingerprints = {}
+
+            if fingerprints.get(key) == fingerprint:
+                return
+
+            if fingerprint is None:
+                fingerprints.pop(key, None)
+            else:
+                fingerprints[key] = fingerprint
+
+            file_tmp = f"{BMS_DETECTION_CACHE_FILE}.{os.getpid()}.tmp"
+            with open(file_tmp, "w") as file:
+                json.dump(fingerprints, file, indent=4, sort_keys=True)
+            os.replace(file_tmp, BMS_DETECTION_CACHE_FILE)
+    except OSError as e:
+        logger.warning(f"Could not save the detected BMS to {BMS_DETECTION_CACHE_FILE}: {e}")
+
+
 def validate_config_values() -> bool:
     """
     Validate the config values and log any issues.